@@ -0,0 +1,39 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+actions.py: Typed actions attached to UI elements
+
+Screens register each interactive element with one of these when they
+create it, so DashDemo can find what a click means with a single dict
+lookup instead of parsing element names.
+'''
+from collections import namedtuple
+
+# Go to another screen. target is a DashDemo.states key, eg 'rooms'
+Navigate = namedtuple('Navigate', ['target'])
+
+# Move to the previous (-1) or next (+1) floor
+ChangeFloor = namedtuple('ChangeFloor', ['step'])
+
+# Open a room on the selected floor, by index into Floor.rooms
+OpenRoom = namedtuple('OpenRoom', ['room_id'])
+
+# Inspect a device, by its DeviceRegistry id
+OpenDevice = namedtuple('OpenDevice', ['device_id'])
+
+# A device control, eg the power button or the intensity slider.
+# device_id is the DeviceRegistry id
+Control = namedtuple('Control', ['device_id', 'attribute'])
+
+# A house-wide command, eg 'turnoffall'
+HouseCommand = namedtuple('HouseCommand', ['name'])
+
+# Zoom the floor plan in (factor > 1) or out
+Zoom = namedtuple('Zoom', ['factor'])
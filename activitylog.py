@@ -0,0 +1,270 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+activitylog.py: Bounded activity log with time and device/room indexes
+'''
+from array import array
+from collections import deque
+from datetime import datetime
+from time import time
+
+# Device/room column value for entries logged against several of them
+MANY = -2
+
+class Interner(object):
+    '''
+    Maps repeated values (message strings, devices, rooms) to small ints
+    so the log columns only store ints. Reference counted, so values are
+    forgotten once the last log entry using them is overwritten.
+    '''
+    def __init__(self):
+        self.ids = {}
+        self.values = []
+        self.refs = []
+        self.free = []
+
+    def acquire(self, value):
+        id = self.ids.get(value)
+        if id is None:
+            if self.free:
+                id = self.free.pop()
+                self.values[id] = value
+                self.refs[id] = 0
+            else:
+                id = len(self.values)
+                self.values.append(value)
+                self.refs.append(0)
+            self.ids[value] = id
+        self.refs[id] += 1
+        return id
+
+    def release(self, id):
+        self.refs[id] -= 1
+        if self.refs[id] == 0:
+            del self.ids[self.values[id]]
+            self.values[id] = None
+            self.free.append(id)
+
+    def lookup(self, value):
+        return self.ids.get(value)
+
+    def __len__(self):
+        return len(self.ids)
+
+class ActivityLog(object):
+    '''
+    Ring buffer of (datetime, description) log entries.
+
+    Holds at most capacity entries; the oldest is overwritten once full.
+    Each column is a flat array: epoch timestamps, and interned ids for the
+    message, device and room (-1 for none, MANY for a bulk entry whose
+    ids are kept in self.groups).
+
+    Every entry gets a sequence number that keeps counting up, so the
+    live entries are always seqs [first, total) and slot = seq % capacity.
+    Timestamps are kept non-decreasing so time queries can bisect.
+
+    Reads like a list oldest first, so log[-1] is the newest entry.
+    '''
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        self.messages = array('l', [0]) * capacity
+        self.devices = array('l', [-1]) * capacity
+        self.rooms = array('l', [-1]) * capacity
+
+        self.messageIds = Interner()
+        self.deviceIds = Interner()
+        self.roomIds = Interner()
+
+        # device/room id -> seqs of its entries, oldest first
+        self.byDevice = {}
+        self.byRoom = {}
+
+        # slot -> (device ids, room ids) for entries made by append_many
+        self.groups = {}
+
+        self.start = 0
+        self.total = 0
+
+    @property
+    def first(self):
+        return max(self.start, self.total - self.capacity)
+
+    def skip_to(self, seq):
+        '''
+        Starts numbering entries at seq. Used when carrying on from a
+        journal, so seqs line up with journal record numbers.
+        '''
+        self.start = self.total = seq
+
+    def __len__(self):
+        return self.total - self.first
+
+    def append(self, desc, device=None, room=None, when=None):
+        slot = self.next_slot(when)
+        self.messages[slot] = self.messageIds.acquire(desc)
+        self.devices[slot] = self.index(self.deviceIds, self.byDevice, device)
+        self.rooms[slot] = self.index(self.roomIds, self.byRoom, room)
+        self.total += 1
+
+    def append_many(self, desc, pairs, when=None):
+        '''
+        One entry covering several (device, room) pairs, eg a bulk
+        operation. The entry shows up in for_device/for_room for every
+        device and room in it, and detail() gives the pairs back.
+        '''
+        slot = self.next_slot(when)
+        self.messages[slot] = self.messageIds.acquire(desc)
+
+        devices, rooms = array('l'), array('l')
+        seenDevices, seenRooms = set(), set()
+        for device, room in pairs:
+            devices.append(self.index(self.deviceIds, self.byDevice, device, seenDevices))
+            rooms.append(self.index(self.roomIds, self.byRoom, room, seenRooms))
+        self.groups[slot] = (devices, rooms)
+
+        self.devices[slot] = MANY
+        self.rooms[slot] = MANY
+        self.total += 1
+
+    def next_slot(self, when):
+        '''
+        Clears and timestamps the slot for the next entry.
+        '''
+        if when is None:
+            when = time()
+        if self.total > self.start:
+            when = max(when, self.times[(self.total - 1) % self.capacity])
+
+        slot = self.total % self.capacity
+        if self.total - self.start >= self.capacity:
+            self.overwrite(slot)
+
+        self.times[slot] = when
+        return slot
+
+    def index(self, interner, byKey, key, seen=None):
+        '''
+        Interns key and records the new entry against it. seen stops an
+        entry being recorded twice against the same key.
+        '''
+        if key is None:
+            return -1
+        id = interner.acquire(key)
+        if seen is None or id not in seen:
+            byKey.setdefault(id, deque()).append(self.total)
+            if seen is not None:
+                seen.add(id)
+        return id
+
+    def overwrite(self, slot):
+        '''
+        Releases everything the oldest entry held before its slot is reused.
+        Its seq is always the oldest for its device/room too, so popleft.
+        '''
+        self.messageIds.release(self.messages[slot])
+
+        if self.devices[slot] == MANY:
+            devices, rooms = self.groups.pop(slot)
+        else:
+            devices, rooms = (self.devices[slot],), (self.rooms[slot],)
+
+        for interner, byKey, ids in ((self.deviceIds, self.byDevice, devices),
+                                     (self.roomIds, self.byRoom, rooms)):
+            for id in ids:
+                if id < 0:
+                    continue
+                seqs = byKey.get(id)
+                if seqs and seqs[0] == self.first:
+                    seqs.popleft()
+                    if not seqs:
+                        del byKey[id]
+                interner.release(id)
+
+    def detail(self, seq):
+        '''
+        The (device, room) pairs an entry was logged against.
+        '''
+        slot = seq % self.capacity
+        if self.devices[slot] == MANY:
+            devices, rooms = self.groups[slot]
+        else:
+            devices, rooms = (self.devices[slot],), (self.rooms[slot],)
+        return [(self.deviceIds.values[d] if d >= 0 else None,
+                 self.roomIds.values[r] if r >= 0 else None)
+                for d, r in zip(devices, rooms)]
+
+    def entry(self, seq):
+        slot = seq % self.capacity
+        return (datetime.fromtimestamp(self.times[slot]),
+                self.messageIds.values[self.messages[slot]])
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('log index out of range')
+        return self.entry(self.first + i)
+
+    def __iter__(self):
+        for seq in range(self.first, self.total):
+            yield self.entry(seq)
+
+    def newest(self, n):
+        '''
+        Up to n most recent entries, newest first.
+        '''
+        start = max(self.first, self.total - n)
+        return [self.entry(seq) for seq in range(self.total - 1, start - 1, -1)]
+
+    def bisect(self, when):
+        '''
+        First seq with a timestamp at or after when.
+        '''
+        lo, hi = self.first, self.total
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.times[mid % self.capacity] < when:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def between(self, start, end=None):
+        '''
+        Entries with start <= time < end, oldest first. Takes datetimes.
+        No end means up to now.
+        '''
+        lo = self.bisect(start.timestamp())
+        hi = self.total if end is None else self.bisect(end.timestamp())
+        return [self.entry(seq) for seq in range(lo, hi)]
+
+    def for_device(self, device, n=None):
+        '''
+        Entries logged against device, newest first. At most n if given.
+        '''
+        return self.keyed(self.deviceIds, self.byDevice, device, n)
+
+    def for_room(self, room, n=None):
+        '''
+        Entries logged against room, newest first. At most n if given.
+        '''
+        return self.keyed(self.roomIds, self.byRoom, room, n)
+
+    def keyed(self, interner, byKey, key, n):
+        id = interner.lookup(key)
+        if id is None:
+            return []
+        seqs = byKey[id]
+        if n is None:
+            n = len(seqs)
+        return [self.entry(seqs[-1 - i]) for i in range(min(n, len(seqs)))]
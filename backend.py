@@ -0,0 +1,369 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+backend.py: Asynchronous device I/O
+
+Commands to devices are sent from an asyncio loop on a worker thread,
+so a slow or dead device never holds up a frame. The UI applies a
+command straight away (optimistically), then the result comes back as
+a DEVICE_RESULT pygame event and the change is either kept or rolled
+back.
+
+Transports:
+    SimulatedTransport  in-process fake devices with latency/failures
+    StreamTransport     JSON lines over TCP, MQTT-style topics
+    DeviceServer        serves SimulatedTransport devices over TCP, for
+                        StreamTransport to talk to:
+                            python backend.py --port 1884
+'''
+import argparse
+import asyncio
+import json
+import logging
+import random
+import threading
+from collections import namedtuple
+
+import pygame
+
+log = logging.getLogger(__name__)
+
+# Posted once per command with the fields of Command plus ok, and
+# reported (the value the device ended up with) or error
+DEVICE_RESULT = pygame.event.custom_type()
+
+Command = namedtuple('Command', ['seq', 'device_id', 'attribute', 'value'])
+
+class DeviceError(Exception):
+    '''
+    A device refused or failed a command.
+    '''
+
+class Transport(object):
+    '''
+    How commands reach devices. Every method is a coroutine run on the
+    backend's loop.
+    '''
+    async def connect(self):
+        pass
+
+    async def send(self, command):
+        '''
+        Sends command and returns the value the device ended up with.
+        Raises DeviceError (or anything else) on failure.
+        '''
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+class SimulatedTransport(Transport):
+    '''
+    Fake devices that take latency +/- jitter seconds to answer and fail
+    failureRate of the time. Keeps the last value set per device and
+    attribute, like a real device would.
+    '''
+    def __init__(self, latency=0.05, jitter=0.02, failureRate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.failureRate = failureRate
+        self.random = random.Random(seed)
+        self.state = {}
+
+    async def send(self, command):
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        await asyncio.sleep(delay)
+        if self.random.random() < self.failureRate:
+            raise DeviceError(f'device {command.device_id} did not respond')
+        self.state[(command.device_id, command.attribute)] = command.value
+        return command.value
+
+class StreamTransport(Transport):
+    '''
+    Talks to a device server over TCP, one JSON object per line:
+        -> {"id": seq, "topic": "home/devices/<id>/<attribute>/set", "value": v}
+        <- {"id": seq, "ok": true, "value": v}
+        <- {"id": seq, "ok": false, "error": "..."}
+    Replies can come back in any order; they are matched up by id.
+    '''
+    topic = 'home/devices/{}/{}/set'
+
+    def __init__(self, host='127.0.0.1', port=1884):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.listener = None
+        self.connecting = None
+
+    async def connect(self):
+        '''
+        Opens the connection, once, however many commands are waiting
+        on it. Shielded so a command timing out doesn't cancel it.
+        '''
+        if self.connecting is None:
+            self.connecting = asyncio.ensure_future(self.open())
+        try:
+            await asyncio.shield(self.connecting)
+        except Exception:
+            self.connecting = None
+            raise
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.listener = asyncio.ensure_future(self.listen())
+
+    async def listen(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                reply = json.loads(line)
+                future = self.pending.pop(reply['id'], None)
+                if future is None or future.done():
+                    continue
+                if reply['ok']:
+                    future.set_result(reply['value'])
+                else:
+                    future.set_exception(DeviceError(reply['error']))
+        finally:
+            # Connection gone, nothing in flight will be answered.
+            # The next command reconnects.
+            self.writer = None
+            self.connecting = None
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(DeviceError('connection lost'))
+            self.pending.clear()
+
+    async def send(self, command):
+        if self.writer is None:
+            await self.connect()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[command.seq] = future
+        message = {
+            'id':       command.seq,
+            'topic':    self.topic.format(command.device_id, command.attribute),
+            'value':    command.value
+        }
+        self.writer.write(json.dumps(message).encode('utf-8') + b'\n')
+        await self.writer.drain()
+        try:
+            return await future
+        finally:
+            self.pending.pop(command.seq, None)
+
+    async def close(self):
+        if self.listener is not None:
+            self.listener.cancel()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class DeviceServer(object):
+    '''
+    Answers StreamTransport requests using another transport, by default
+    SimulatedTransport, so the whole path can be tried without hardware.
+    '''
+    def __init__(self, host='127.0.0.1', port=1884, devices=None):
+        self.host = host
+        self.port = port
+        self.devices = devices if devices is not None else SimulatedTransport()
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        # port 0 picks a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def serve(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            asyncio.ensure_future(self.answer(message, writer))
+        writer.close()
+
+    async def answer(self, message, writer):
+        _, _, deviceId, attribute, _ = message['topic'].split('/')
+        command = Command(message['id'], int(deviceId), attribute, message['value'])
+        try:
+            value = await self.devices.send(command)
+            reply = {'id': command.seq, 'ok': True, 'value': value}
+        except Exception as e:
+            reply = {'id': command.seq, 'ok': False, 'error': str(e)}
+        writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+        await writer.drain()
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+class DeviceBackend(object):
+    '''
+    Sends device commands from an asyncio loop on its own thread.
+
+    submit() is called from the UI thread and never blocks: the new
+    value is set on the device right away and the command is handed to
+    the loop. Commands to the same device go out one at a time, in
+    order. When one finishes a DEVICE_RESULT event is posted, and the
+    UI thread passes it to resolve(), which keeps the value or puts the
+    last confirmed one back.
+    '''
+    def __init__(self, transport, timeout=2.0, post=None):
+        self.transport = transport
+        self.timeout = timeout
+        self.post = post if post is not None else pygame.event.post
+
+        self.seq = 0
+
+        # (device id, attribute) -> [last confirmed value, newest seq sent]
+        # Only kept while a command for it is in flight. UI thread only.
+        self.inflight = {}
+
+        # device id -> asyncio.Lock, loop thread only
+        self.locks = {}
+
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='device-backend', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+
+    def submit(self, device, attribute, value):
+        '''
+        Sets attribute optimistically and queues the command.
+        Returns the command's seq.
+        '''
+        key = (device.id, attribute)
+        current = device.attributes[attribute]
+        if current == value:
+            return None
+
+        self.seq += 1
+        entry = self.inflight.get(key)
+        if entry is None:
+            self.inflight[key] = [current, self.seq]
+        else:
+            entry[1] = self.seq
+
+        device.attributes[attribute] = value
+        command = Command(self.seq, device.id, attribute, value)
+        future = asyncio.run_coroutine_threadsafe(self.execute(command), self.loop)
+        future.add_done_callback(self.executed)
+        return command.seq
+
+    def executed(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            log.error('Device command crashed', exc_info=future.exception())
+
+    async def execute(self, command):
+        lock = self.locks.get(command.device_id)
+        if lock is None:
+            lock = self.locks[command.device_id] = asyncio.Lock()
+
+        async with lock:
+            try:
+                value = await asyncio.wait_for(self.transport.send(command), self.timeout)
+                result = {'ok': True, 'reported': value}
+            except asyncio.TimeoutError:
+                result = {'ok': False, 'error': 'timed out'}
+            except Exception as e:
+                result = {'ok': False, 'error': str(e) or type(e).__name__}
+
+        self.post(pygame.event.Event(DEVICE_RESULT, **command._asdict(), **result))
+
+    def resolve(self, event, device):
+        '''
+        Applies a DEVICE_RESULT to device. Returns True if the device's
+        value was rolled back.
+
+        Only the newest command for a device attribute decides what
+        sticks; results for older ones just update the confirmed value.
+        '''
+        key = (event.device_id, event.attribute)
+        entry = self.inflight.get(key)
+        if entry is None:
+            return False
+
+        latest = event.seq == entry[1]
+        if event.ok:
+            entry[0] = event.reported
+        if not latest:
+            return False
+
+        del self.inflight[key]
+        if device is None:
+            return False
+        if event.ok:
+            # The device may have clamped or rounded the value
+            device.attributes[event.attribute] = event.reported
+            return False
+
+        log.warning('Command %d to device %d failed: %s', event.seq, event.device_id, event.error)
+        device.attributes[event.attribute] = entry[0]
+        return True
+
+    def pending(self):
+        '''
+        Number of device attributes waiting on a result.
+        '''
+        return len(self.inflight)
+
+    async def shutdown(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.transport.close()
+
+    def close(self):
+        '''
+        Stops the loop. Commands still in flight are abandoned.
+        '''
+        future = asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+        try:
+            future.result(self.timeout)
+        except Exception as e:
+            log.warning('Closing transport failed: %s', e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated device server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1884)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--failures', type=float, default=0.0, help='fraction of commands to fail')
+    args = parser.parse_args()
+
+    async def serve():
+        server = DeviceServer(args.host, args.port,
+                              SimulatedTransport(args.latency, failureRate=args.failures))
+        port = await server.start()
+        print(f'Serving simulated devices on {args.host}:{port}')
+        await server.server.serve_forever()
+
+    asyncio.run(serve())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,663 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+benchmark.py: Headless benchmarks for screens, navigation and events
+
+Runs DashDemo under the SDL dummy video driver against a generated
+house, replays a script of button presses and reports how long each
+go_* transition and each frame took, how much each transition
+allocated and how many widgets were alive. Results are saved as JSON
+so runs can be compared.
+
+    python benchmark.py --floors 4 --rooms 9 --devices 40 --out new.json
+    python benchmark.py --floors 4 --rooms 9 --devices 40 --compare old.json
+'''
+import os
+
+# Must be set before pygame opens a display
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+import argparse
+import json
+import math
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime
+from time import perf_counter
+
+import pygame
+import pygame_gui
+
+from main import DashDemo
+from house import House, Floor, Room
+from device import Device, Light
+from store import HouseStore
+from scheduler import Scheduler, Command, Scene, SetAll
+from telemetry import Telemetry
+from usage import Usage
+import sync
+
+# Each step presses a button:
+#   common.<key>                navbar/status bar element
+#   screen.<key>                element of the current screen
+#   room.<i>                    button for room i on the floor plan
+#   row.<i>.<control>           control in row i of the device list
+#   row.<i>.<control>=<value>   move a slider to value
+DEFAULT_SCRIPT = [
+    'common.rooms',
+    'room.0',
+    'screen.devicelabel0',
+    'row.0.power',
+    'row.0.power',
+    'row.1.intensity=40',
+    'screen.backbutton',
+    'screen.backbutton',
+    'screen.nextfloor',
+    'screen.zoomout',
+    'screen.zoomin',
+    'room.1',
+    'screen.devicelabel0',
+    'row.0.power',
+    'common.activity',
+    'common.home',
+    'screen.turnoffall',
+    'screen.viewall',
+    'common.rooms',
+    'screen.prevfloor',
+    'common.home',
+]
+
+TRANSITIONS = ('go_home', 'go_rooms', 'go_room', 'go_device', 'go_activity', 'go_addnew')
+
+def build_house(floors, rooms, devices, lightRatio=0.5):
+    '''
+    House with floors x rooms x devices, rooms laid out in a square-ish
+    grid. Every device is registered with the house.
+    '''
+    width = max(1, math.ceil(math.sqrt(rooms)))
+    floorList = []
+    for f in range(floors):
+        roomList = [Room(f'Room {r}') for r in range(rooms)]
+        grid = [[i if i < rooms else None for i in range(row, row + width)]
+                for row in range(0, rooms, width)]
+        floorList.append(Floor(f'Floor {f}', roomList, grid))
+
+    house = House(floors=floorList)
+    lights = int(devices * lightRatio)
+    for floor in floorList:
+        for room in floor.rooms:
+            for d in range(devices):
+                deviceClass = Light if d < lights else Device
+                house.add_device(deviceClass(f'{deviceClass.__name__} {d}', ''), room, floor)
+    return house
+
+def summarise(values):
+    '''
+    count/mean/p50/p90/p99/max of a list of milliseconds.
+    '''
+    if not values:
+        return {'count': 0}
+    ordered = sorted(values)
+    def pct(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+    return {
+        'count':    len(ordered),
+        'mean':     sum(ordered) / len(ordered),
+        'p50':      pct(50),
+        'p90':      pct(90),
+        'p99':      pct(99),
+        'max':      ordered[-1]
+    }
+
+class Benchmark(object):
+    '''
+    Drives a DashDemo that isn't running its own loop. go_* methods and
+    show_screen are wrapped on the instance to time transitions and to
+    tell cold (screen built) from warm (screen cached) ones.
+    '''
+    def __init__(self, demo, trackAllocations=False):
+        self.demo = demo
+        self.trackAllocations = trackAllocations
+        self.transitions = {}
+        self.allocations = {}
+        self.frames = []
+        self.widgets = []
+        self.created = False
+
+        # Benchmarks measure work, not the frame cap
+        demo.activeFPS = 0
+
+        showScreen = demo.show_screen
+        def show_screen(*args):
+            self.created = showScreen(*args)
+            return self.created
+        demo.show_screen = show_screen
+
+        for name in TRANSITIONS:
+            setattr(demo, name, self.timed(name, getattr(demo, name)))
+
+    def timed(self, name, method):
+        def wrapper(*args):
+            self.created = False
+            if self.trackAllocations:
+                before = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+            start = perf_counter()
+            result = method(*args)
+            ms = (perf_counter() - start) * 1000
+            kind = 'cold' if self.created else 'warm'
+            self.transitions.setdefault(name, {}).setdefault(kind, []).append(ms)
+            if self.trackAllocations:
+                current, peak = tracemalloc.get_traced_memory()
+                self.allocations.setdefault(name, {}).setdefault(kind, []).append(
+                    {'net_kb': (current - before) / 1024, 'peak_kb': (peak - before) / 1024})
+            return result
+        return wrapper
+
+    def resolve(self, target):
+        '''
+        Element and slider value (or None) for a script step.
+        '''
+        value = None
+        if '=' in target:
+            target, value = target.split('=')
+            value = float(value)
+
+        parts = target.split('.')
+        if parts[0] == 'common':
+            return self.demo.common.elems[parts[1]], value
+        if parts[0] == 'screen':
+            return self.demo.screen.elems[parts[1]], value
+        if parts[0] == 'room':
+            return self.demo.screen.elems['plan'].button_for(int(parts[1])), value
+        if parts[0] == 'row':
+            deviceList = self.demo.screen.elems['devicelist']
+            deviceList.rebind()
+            return deviceList.bound[int(parts[1])].uiElements[parts[2]], value
+        raise ValueError(f'Unknown script target {target}')
+
+    def press(self, target):
+        elem, value = self.resolve(target)
+        if value is None:
+            event = pygame.event.Event(pygame_gui.UI_BUTTON_PRESSED, ui_element=elem)
+        else:
+            elem.set_current_value(value)
+            event = pygame.event.Event(pygame_gui.UI_HORIZONTAL_SLIDER_MOVED, ui_element=elem)
+        pygame.event.post(event)
+
+        # Frame that handles the press, then one to settle
+        self.frame()
+        self.frame()
+
+    def frame(self):
+        self.demo.idle = False
+        start = perf_counter()
+        self.demo.step()
+        self.frames.append((perf_counter() - start) * 1000)
+
+        sprites = self.demo.manager.get_sprite_group().sprites()
+        self.widgets.append((len(sprites), sum(1 for s in sprites if s.visible)))
+
+    def run(self, script, loops):
+        for loop in range(loops):
+            for target in script:
+                self.press(target)
+
+    def results(self):
+        return {
+            'transitions': {name: {kind: summarise(ms) for kind, ms in kinds.items()}
+                            for name, kinds in self.transitions.items()},
+            'frames': summarise(self.frames),
+            'widgets': {
+                'max':              max(total for total, visible in self.widgets),
+                'final':            self.widgets[-1][0],
+                'visible_final':    self.widgets[-1][1],
+                'cached_screens':   len(self.demo.screens.screens),
+                'cached_elements':  self.demo.screens.element_count()
+            },
+            'render': self.demo.tracker.stats(),
+            'commands': self.demo.house.pipeline.stats(),
+            'text': self.demo.text.stats(),
+            'phases': {phase: {'mean': mean, 'max': worst}
+                       for phase, (mean, worst) in self.phase_summary().items()}
+        }
+
+    def phase_summary(self):
+        summary = self.demo.timings.summary()
+        summary.pop('fps')
+        return summary
+
+    def allocation_results(self):
+        out = {}
+        for name, kinds in self.allocations.items():
+            out[name] = {}
+            for kind, samples in kinds.items():
+                out[name][kind] = {
+                    'net_kb':   summarise([s['net_kb'] for s in samples])['mean'],
+                    'peak_kb':  summarise([s['peak_kb'] for s in samples])['max']
+                }
+        return out
+
+def json_save(house, path):
+    '''
+    The naive way to save a house, for comparison: everything as one
+    JSON document.
+    '''
+    floors = []
+    for floor in house.floors:
+        floors.append({
+            'name':     floor.name,
+            'grid':     floor.grid,
+            'rooms':    [{
+                'name':     room.name,
+                'w':        room.w,
+                'h':        room.h,
+                'devices':  [{
+                    'type':         type(device).__name__,
+                    'name':         device.name,
+                    'icon':         device.icon,
+                    'attributes':   dict(device.attributes)
+                } for device in room.devices]
+            } for room in floor.rooms]
+        })
+    with open(path, 'w') as f:
+        json.dump({'floors': floors}, f)
+
+def json_load(path):
+    with open(path) as f:
+        data = json.load(f)
+    floors = []
+    placed = []
+    for floorData in data['floors']:
+        floor = Floor(floorData['name'], [], floorData['grid'])
+        rooms = floor.rooms
+        for roomData in floorData['rooms']:
+            room = Room(roomData['name'])
+            room.w, room.h = roomData['w'], roomData['h']
+            for deviceData in roomData['devices']:
+                device = HouseStore.deviceTypes[deviceData['type']](deviceData['name'], deviceData['icon'])
+                for name, value in deviceData['attributes'].items():
+                    device.attributes[name] = value
+                placed.append((device, room, floor))
+            rooms.append(room)
+        floors.append(floor)
+    house = House(floors=floors)
+    for device, room, floor in placed:
+        house.add_device(device, room, floor)
+    return house
+
+def storage_benchmark(house, changes=100):
+    '''
+    Save/load times and file sizes for the binary snapshot against a
+    JSON dump, plus an incremental save of changes attribute edits.
+    '''
+    results = {}
+    path = tempfile.mkdtemp(prefix='home-dash-bench-')
+    try:
+        jsonPath = os.path.join(path, 'house.json')
+        start = perf_counter()
+        json_save(house, jsonPath)
+        results['json_save_ms'] = (perf_counter() - start) * 1000
+        results['json_bytes'] = os.path.getsize(jsonPath)
+        start = perf_counter()
+        json_load(jsonPath)
+        results['json_load_ms'] = (perf_counter() - start) * 1000
+
+        store = HouseStore(os.path.join(path, 'house.snap'))
+        start = perf_counter()
+        store.write_snapshot(house)
+        results['snapshot_save_ms'] = (perf_counter() - start) * 1000
+        results['snapshot_bytes'] = os.path.getsize(store.path)
+
+        start = perf_counter()
+        loaded = store.load_house()
+        results['snapshot_load_ms'] = (perf_counter() - start) * 1000
+
+        start = perf_counter()
+        HouseStore(store.path).load_house(floors=[0])
+        results['snapshot_first_floor_ms'] = (perf_counter() - start) * 1000
+
+        store.track(loaded)
+        devices = [device for device, room in loaded.devices()]
+        pick = random.Random(0)
+        for i in range(changes):
+            device = pick.choice(devices)
+            device.attributes['on'] = not device.attributes['on']
+        start = perf_counter()
+        store.save(loaded)
+        results['incremental_save_ms'] = (perf_counter() - start) * 1000
+        results['incremental_bytes'] = os.path.getsize(store.changesPath)
+        store.close()
+    finally:
+        shutil.rmtree(path)
+    return results
+
+def scheduler_benchmark(house, timers, seconds=3600):
+    '''
+    Scheduling, cancelling and firing timers spread over seconds of
+    simulated time, one Command per timer on random devices, plus a
+    house-wide SetAll and a captured Scene.
+    '''
+    now = [0.0]
+    scheduler = Scheduler(house, clock=lambda: now[0], arm=lambda seconds: None)
+    pick = random.Random(2)
+    devices = [device for device, room in house.devices() if 'intensity' in device.attributes]
+    results = {'timers': timers}
+    if not devices:
+        return results
+
+    start = perf_counter()
+    scheduled = [scheduler.at(pick.uniform(0, seconds),
+                              Command(pick.choice(devices), 'intensity', pick.randint(0, 100), 'Timed dimming'))
+                 for i in range(timers)]
+    results['schedule_us'] = (perf_counter() - start) * 1e6 / timers
+
+    start = perf_counter()
+    for timer in scheduled[::10]:
+        scheduler.cancel(timer)
+    results['cancel_us'] = (perf_counter() - start) * 1e6 / len(scheduled[::10])
+
+    # Wake up at each deadline like the pygame timer would
+    wakeups = 0
+    start = perf_counter()
+    while True:
+        deadline = scheduler.next_deadline()
+        if deadline is None:
+            break
+        now[0] = deadline
+        scheduler.run_due()
+        wakeups += 1
+    results['fire_all_ms'] = (perf_counter() - start) * 1000
+    results['wakeups'] = wakeups
+    results['fired'] = scheduler.counts['fired']
+
+    scheduler.at(now[0], SetAll('on', False, Light, 'Lights off'))
+    start = perf_counter()
+    scheduler.run_due()
+    results['set_all_ms'] = (perf_counter() - start) * 1000
+
+    start = perf_counter()
+    scene = Scene.capture('Bench', house)
+    results['scene_capture_ms'] = (perf_counter() - start) * 1000
+    with house.batch('Reset') as batch:
+        SetAll('intensity', 0).fire(house, batch)
+    house.pipeline.flush()
+    scheduler.at(now[0], scene)
+    start = perf_counter()
+    scheduler.run_due()
+    house.pipeline.flush()
+    results['scene_apply_ms'] = (perf_counter() - start) * 1000
+    return results
+
+def telemetry_benchmark(house, samples, days=3):
+    '''
+    Recording samples intensity changes on random lights spread over
+    days of simulated time, rolling them up every 15 simulated seconds
+    like the thread would, then graphing the busiest light over an hour,
+    a day and the whole run.
+    '''
+    now = [0.0]
+    telemetry = Telemetry(house, clock=lambda: now[0], post=lambda event: None)
+    pick = random.Random(3)
+    devices = [device for device, room in house.devices() if 'intensity' in device.attributes]
+    results = {'samples': samples}
+    if not devices:
+        return results
+
+    seconds = days * 86400
+    busiest = devices[0]
+    record = rollup = 0.0
+    for i in range(samples):
+        before = now[0]
+        now[0] = i * seconds / samples
+        if now[0] // telemetry.rollupInterval != before // telemetry.rollupInterval:
+            start = perf_counter()
+            telemetry.rollup()
+            rollup += perf_counter() - start
+        device = busiest if i % 4 == 0 else pick.choice(devices)
+        start = perf_counter()
+        device.attributes['intensity'] = (device.attributes['intensity'] + pick.randint(1, 99)) % 100
+        record += perf_counter() - start
+    now[0] = seconds
+    telemetry.rollup()
+    results['record_us'] = record * 1e6 / samples
+    results['rollup_total_ms'] = rollup * 1000
+    results['rollups'] = telemetry.counts['rollups']
+
+    for name, window in (('hour', 3600), ('day', 86400), ('all', seconds)):
+        start = perf_counter()
+        for i in range(10):
+            telemetry.history(busiest, 'intensity', now[0] - window, now[0], 60)
+        results[f'history_{name}_us'] = (perf_counter() - start) * 1e6 / 10
+    results.update(telemetry.stats())
+    telemetry.close()
+    return results
+
+def usage_benchmark(house, changes):
+    '''
+    Cost of keeping usage totals up to date per device change, and of
+    reading them, against walking every floor, room and device.
+    '''
+    now = [0.0]
+    usage = Usage(house, clock=lambda: now[0])
+    pick = random.Random(4)
+    devices = [device for device, room in house.devices() if 'intensity' in device.attributes]
+    results = {'changes': changes}
+    if not devices:
+        return results
+
+    start = perf_counter()
+    for i in range(changes):
+        now[0] = i
+        device = pick.choice(devices)
+        if i % 2:
+            device.attributes['on'] = not device.attributes['on']
+        else:
+            device.attributes['intensity'] = pick.randint(0, 100)
+    results['change_us'] = (perf_counter() - start) * 1e6 / changes
+
+    start = perf_counter()
+    for floor in house.floors:
+        totals = usage.floor(floor)
+        totals.on, totals.average_intensity()
+    totals = usage.house_totals()
+    totals.watts, totals.energy_wh(now[0])
+    results['read_us'] = (perf_counter() - start) * 1e6
+
+    start = perf_counter()
+    on = sum(device.attributes['on'] for floor in house.floors for room in floor.rooms for device in room.devices)
+    results['walk_us'] = (perf_counter() - start) * 1e6
+    results['lights_on'] = usage.house_totals().on
+    usage.close()
+    return results
+
+def hub_benchmark(house, panels, ticks=200, changes=20):
+    '''
+    Connects panels raw clients to a StateHub over a Unix socket, then
+    times snapshots, and ticks of changes devices each from hub.tick()
+    until every panel has read the DELTA.
+    '''
+    import asyncio
+
+    devices = [device for device, room in house.devices()]
+    results = {'panels': panels, 'ticks': ticks}
+    if not devices:
+        return results
+
+    async def run():
+        path = tempfile.mkdtemp(prefix='home-dash-bench-')
+        hub = sync.StateHub(house, os.path.join(path, 'hub.sock'))
+        await hub.start(tick=False)
+        connects = []
+        streams = []
+        try:
+            for i in range(panels):
+                start = perf_counter()
+                reader, writer = await asyncio.open_unix_connection(hub.path)
+                out = sync.Writer()
+                out.pack(sync.HELLO_HEAD, 0, 0, hub.layout, i + 1)
+                out.str(f'bench-{i}')
+                writer.write(sync.frame(sync.HELLO, bytes(out.data)))
+                await sync.read_frame(reader)
+                kind, payload = await sync.read_frame(reader)
+                connects.append((perf_counter() - start) * 1000)
+                streams.append((reader, writer))
+            results['snapshot_bytes'] = len(payload) + sync.FRAME.size
+            results['connect'] = summarise(connects)
+
+            pick = random.Random(5)
+            latencies = []
+            sizes = []
+            async def receive(reader, start):
+                kind, payload = await sync.read_frame(reader)
+                latencies.append((perf_counter() - start) * 1000)
+                return len(payload) + sync.FRAME.size
+            for t in range(ticks):
+                for i in range(changes):
+                    device = pick.choice(devices)
+                    device.attributes['on'] = not device.attributes['on']
+                start = perf_counter()
+                hub.tick()
+                sizes = await asyncio.gather(*(receive(reader, start) for reader, writer in streams))
+            results['delta_bytes'] = sizes[0]
+            results['fanout'] = summarise(latencies)
+            results.update(hub.stats())
+        finally:
+            for reader, writer in streams:
+                writer.close()
+            await hub.close()
+            shutil.rmtree(path)
+
+    asyncio.run(run())
+    return results
+
+def run_benchmark(args, script):
+    results = {
+        'meta': {
+            'floors':       args.floors,
+            'rooms':        args.rooms,
+            'devices':      args.devices,
+            'loops':        args.loops,
+            'timers':       args.timers,
+            'samples':      args.samples,
+            'panels':       args.panels,
+            'render':       args.render,
+            'python':       platform.python_version(),
+            'pygame':       pygame.version.ver,
+            'pygame_gui':   getattr(pygame_gui, '__version__', 'unknown'),
+            'date':         datetime.now().isoformat(timespec='seconds')
+        }
+    }
+
+    house = build_house(args.floors, args.rooms, args.devices)
+    results['storage'] = storage_benchmark(house)
+    results['scheduler'] = scheduler_benchmark(build_house(args.floors, args.rooms, args.devices), args.timers)
+    results['telemetry'] = telemetry_benchmark(build_house(args.floors, args.rooms, args.devices), args.samples)
+    results['usage'] = usage_benchmark(build_house(args.floors, args.rooms, args.devices), args.samples)
+    results['hub'] = hub_benchmark(build_house(args.floors, args.rooms, args.devices), args.panels)
+
+    start = perf_counter()
+    demo = DashDemo(renderMode=args.render, house=house, run=False)
+    results['startup_ms'] = (perf_counter() - start) * 1000
+    results['startup_phases'] = demo.startup.report()
+
+    bench = Benchmark(demo)
+    bench.run(script, args.loops)
+    results.update(bench.results())
+
+    # Second, separate run with tracemalloc on, since it skews timings
+    house = build_house(args.floors, args.rooms, args.devices)
+    tracemalloc.start()
+    demo = DashDemo(renderMode=args.render, house=house, run=False)
+    bench = Benchmark(demo, trackAllocations=True)
+    bench.run(script, 1)
+    tracemalloc.stop()
+    results['allocations'] = bench.allocation_results()
+
+    return results
+
+def compare(old, new, threshold):
+    '''
+    Prints p50 timings side by side. Returns the list of metrics that
+    got slower by more than threshold (a fraction).
+    '''
+    oldStorage, newStorage = old.get('storage', {}), new.get('storage', {})
+    oldTimers, newTimers = old.get('scheduler', {}), new.get('scheduler', {})
+    oldHistory, newHistory = old.get('telemetry', {}), new.get('telemetry', {})
+    oldHub, newHub = old.get('hub', {}).get('fanout', {}), new.get('hub', {}).get('fanout', {})
+    rows = [('startup', old.get('startup_ms'), new.get('startup_ms')),
+            ('snapshot load', oldStorage.get('snapshot_load_ms'), newStorage.get('snapshot_load_ms')),
+            ('snapshot save', oldStorage.get('snapshot_save_ms'), newStorage.get('snapshot_save_ms')),
+            ('timers fire all', oldTimers.get('fire_all_ms'), newTimers.get('fire_all_ms')),
+            ('telemetry rollups', oldHistory.get('rollup_total_ms'), newHistory.get('rollup_total_ms')),
+            ('hub fan-out p99', oldHub.get('p99'), newHub.get('p99')),
+            ('frame p50', old['frames'].get('p50'), new['frames'].get('p50')),
+            ('frame p90', old['frames'].get('p90'), new['frames'].get('p90'))]
+    for name in TRANSITIONS:
+        for kind in ('cold', 'warm'):
+            o = old['transitions'].get(name, {}).get(kind, {}).get('p50')
+            n = new['transitions'].get(name, {}).get(kind, {}).get('p50')
+            rows.append((f'{name} {kind} p50', o, n))
+
+    regressions = []
+    for name, o, n in rows:
+        if o is None or n is None:
+            continue
+        change = (n - o) / o if o else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print(f'{name:<24}{o:10.3f} ms{n:10.3f} ms{change * 100:+8.1f}%{flag}')
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless home-dash benchmarks')
+    parser.add_argument('--floors', type=int, default=2)
+    parser.add_argument('--rooms', type=int, default=4)
+    parser.add_argument('--devices', type=int, default=20, help='devices per room')
+    parser.add_argument('--loops', type=int, default=5, help='times to replay the script')
+    parser.add_argument('--timers', type=int, default=20000, help='timers for the scheduler benchmark')
+    parser.add_argument('--samples', type=int, default=50000, help='changes for the telemetry benchmark')
+    parser.add_argument('--panels', type=int, default=40, help='panels for the hub benchmark')
+    parser.add_argument('--render', choices=('idle', 'full'), default='idle')
+    parser.add_argument('--script', help='JSON list of script steps, default is a full tour')
+    parser.add_argument('--out', help='write results to this JSON file')
+    parser.add_argument('--compare', help='compare against an earlier results file')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slowdown that counts as a regression, default 0.2 = 20%%')
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+
+    results = run_benchmark(args, script)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=4)
+    else:
+        print(json.dumps(results, indent=4))
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if compare(old, results, args.threshold):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -13,61 +13,292 @@ device.py: Device classes and their attributes
 Split off December 1st, 2024
 '''
 
+from collections.abc import MutableMapping
+
 import pygame
-import pygame_gui
-from pygame_gui.core import ObjectID
-from pygame_gui.elements import UIButton, UILabel, UIHorizontalSlider
+
+def attr_text(attr):
+    if isinstance(attr, bool):
+        if attr:
+            return 'on'
+        else:
+            return 'off'
+    else:
+        return str(attr)
 
 class DeviceModifier(object):
     '''
     GUI element container that handles events by acting on the device.
-    It's just the controls themselves, eg buttons & sliders.
+    It's the row for one device in the device list: its name, the
+    controls themselves, eg buttons & sliders, and a label showing the
+    attribute each control changes.
     
-    Initially elements have no manager. Once linked they will actually 
-    be drawn.
+    Nothing is built until build() is called, which happens the first
+    time the row scrolls into view. After that the same modifier is
+    moved around and bound to other devices of the same type with
+    bind(), see widgets.DeviceList.
     
-    For each device there should be 3 elements in the room device list:
+    For each device the row contains:
         - label with devices' name
         - pairs of controls & attribute labels
             - eg. power switch and "ON/OFF" label
             - eg. dimmer switch and integer 0-100 label
     '''
-    def __init__(self, device):
+    
+    # Control name -> device attribute it changes
+    controls = {'power': 'on'}
+    
+    titleHeight = 25
+    controlHeight = 35
+    
+    # Row height in the device list, known without building anything
+    height = titleHeight + len(controls) * controlHeight + 10
+    
+    def __init__(self, device=None):
         self.device = device
+        self.manager = None
+        self.uiElements = {}
+        self.labels = {}
+        # Element -> its position relative to the top of the row
+        self.offsets = {}
+    
+    def build(self, manager, container):
+        '''
+        Creates the widgets. Only the first call does anything.
+        '''
+        if self.manager is not None:
+            return
+        self.manager = manager
+        
+        # pygame_gui is only imported once there's UI to build, so the
+        # house can be loaded before it's needed (see DashDemo.boot)
+        from pygame_gui.core import ObjectID
+        from pygame_gui.elements import UIButton, UILabel
+        
+        self.title = UILabel(
+            relative_rect=pygame.Rect((0, 0), (200, self.titleHeight)),
+            text='',
+            manager=manager,
+            container=container
+        )
+        self.offsets[self.title] = (0, 0)
         
         # Construct a basic on/off switch which all devices have
         toggleSwitch = UIButton(
             relative_rect=pygame.Rect((0, 0), (75, 30)),
             text='ON/OFF',
-            manager=None,
+            manager=manager,
+            container=container,
             object_id = ObjectID(class_id='@navbar_button')
         )
-        self.uiElements = {'power': toggleSwitch}
+        self.add_control('power', toggleSwitch, container)
     
-    def linkManager(self, manager):
-        self.manager = manager
-        for key, elem in self.uiElements.items():
-            print(f'linked {key}')
-            elem.manager = manager
-            elem.rebuild()
-            
-    def handle(self, event):
-        print(f'{event.ui_element} == {self.uiElements["power"]}')
-        if event.ui_element == self.uiElements['power']:
-            self.device.attributes['on'] = not self.device.attributes['on']
-            print(f'device power now:{self.device.attributes["on"]} ')
+    def add_control(self, name, elem, container):
+        '''
+        Places a control on the next line of the row, with a label for
+        its attribute next to it.
+        '''
+        from pygame_gui.elements import UILabel
+        
+        y = self.titleHeight + len(self.uiElements) * self.controlHeight
+        self.uiElements[name] = elem
+        self.offsets[elem] = (0, y)
+        
+        label = UILabel(
+            relative_rect=pygame.Rect((160, 0), (60, 30)),
+            text='',
+            manager=self.manager,
+            container=container
+        )
+        self.labels[self.controls[name]] = label
+        self.offsets[label] = (160, y)
+    
+    def bind(self, device, y):
+        '''
+        Points this row at device and moves it to y in the list.
+        '''
+        self.device = device
+        if self.title.text != device.name:
+            self.title.set_text(device.name)
+        for elem, (dx, dy) in self.offsets.items():
+            elem.set_relative_position((dx, y + dy))
+        for attribute in self.labels:
+            self.refresh(attribute)
+        self.show()
+    
+    def refresh(self, attribute):
+        '''
+        Shows the device's current value for attribute.
+        '''
+        label = self.labels.get(attribute)
+        if label is None:
+            return
+        text = attr_text(self.device.attributes[attribute])
+        if label.text != text:
+            label.set_text(text)
+    
+    def elements(self):
+        return self.offsets.keys()
+    
+    def show(self):
+        for elem in self.offsets:
+            elem.show()
+    
+    def hide(self):
+        for elem in self.offsets:
+            elem.hide()
+
+class LightModifier(DeviceModifier):
+    
+    controls = {'power': 'on', 'intensity': 'intensity'}
+    
+    height = DeviceModifier.titleHeight + len(controls) * DeviceModifier.controlHeight + 10
+    
+    def build(self, manager, container):
+        if self.manager is not None:
+            return
+        super().build(manager, container)
+        
+        from pygame_gui.elements import UIHorizontalSlider
+        slider = UIHorizontalSlider(
+            relative_rect=pygame.Rect((0, 0), (150, 30)),
+            start_value=0,
+            value_range=(0, 100),
+            manager=manager,
+            container=container
+        )
+        self.add_control('intensity', slider, container)
+    
+    def refresh(self, attribute):
+        super().refresh(attribute)
+        if attribute == 'intensity':
+            slider = self.uiElements['intensity']
+            value = self.device.attributes['intensity']
+            if slider.get_current_value() != value:
+                slider.set_current_value(value)
+
+class Schema(object):
+    '''
+    Attribute names and default values shared by every device of a
+    class, so each device only has to store a list of values.
+    '''
+    __slots__ = ('names', 'index', 'defaults')
+
+    def __init__(self, **defaults):
+        self.names = tuple(defaults)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.defaults = tuple(defaults.values())
+
+    def extend(self, **defaults):
+        '''
+        Schema for a subclass: these attributes plus the new ones.
+        '''
+        return Schema(**dict(zip(self.names, self.defaults)), **defaults)
+
+class Attributes(MutableMapping):
+    '''
+    A device's attributes, which reads like a dict and keeps track of
+    what changed.
+    
+    Values for the class's Schema live in a plain list; anything else
+    set on the device goes in a dict that is only made when needed.
+    
+    Setting an attribute to a new value marks it dirty and calls every
+    subscriber with (device, attribute, value). Setting it to the value
+    it already has does nothing.
+    '''
+    __slots__ = ('device', 'schema', 'values', 'extra', 'dirty', 'subscribers')
+
+    def __init__(self, device, schema):
+        self.device = device
+        self.schema = schema
+        self.values = list(schema.defaults)
+        self.extra = None
+        self.dirty = None
+        self.subscribers = ()
+    
+    def __getitem__(self, key):
+        i = self.schema.index.get(key)
+        if i is not None:
+            return self.values[i]
+        if self.extra is None:
+            raise KeyError(key)
+        return self.extra[key]
+    
+    def __setitem__(self, key, value):
+        i = self.schema.index.get(key)
+        if i is not None:
+            if self.values[i] == value:
+                return
+            self.values[i] = value
         else:
-            # TODO: This is glitched, the power button doesn't match the power button.
-            print('Not a match for power')
+            if self.extra is None:
+                self.extra = {}
+            elif key in self.extra and self.extra[key] == value:
+                return
+            self.extra[key] = value
+        
+        if self.dirty is None:
+            self.dirty = set()
+        self.dirty.add(key)
+        for callback in tuple(self.subscribers):
+            callback(self.device, key, value)
+    
+    def __delitem__(self, key):
+        if key in self.schema.index or self.extra is None:
+            raise KeyError(key)
+        del self.extra[key]
+    
+    def __iter__(self):
+        yield from self.schema.names
+        if self.extra is not None:
+            yield from self.extra
+    
+    def __len__(self):
+        return len(self.values) + (len(self.extra) if self.extra is not None else 0)
+    
+    def __contains__(self, key):
+        return key in self.schema.index or (self.extra is not None and key in self.extra)
+    
+    def subscribe(self, callback):
+        if not self.subscribers:
+            self.subscribers = []
+        if callback not in self.subscribers:
+            self.subscribers.append(callback)
+    
+    def unsubscribe(self, callback):
+        if callback in self.subscribers:
+            self.subscribers.remove(callback)
+    
+    def take_dirty(self):
+        '''
+        Returns the attributes changed since the last call and clears them.
+        '''
+        dirty, self.dirty = self.dirty, None
+        return dirty if dirty is not None else set()
 
 class Device(object):
     '''
-    Stores device name, icon & on/off state.    
+    Stores device name, icon & on/off state.
+    
+    id is given by the house's DeviceRegistry when the device is added.
     '''
+    __slots__ = ('name', 'icon', 'attributes', 'id')
+    
+    schema = Schema(on=True)
+    
+    # Row type used for this device in the device list
+    modifierClass = DeviceModifier
+    
+    # Rated power when on, at full intensity if it dims, for the energy
+    # estimates in usage.py
+    watts = 5
+    
     def __init__(self, name, icon):
         self.name = name
         self.icon = icon # TODO: Path to an icon.
-        self.attributes = {'on': True}
+        self.attributes = Attributes(self, self.schema)
+        self.id = None
 
     def toggle_power(self):
         if self.attributes['on']:
@@ -81,32 +312,19 @@ class Device(object):
     def get_modifier(self):
         '''
         Returns an object that can be used to modify & get gui elements for 
-        modifying this device.
+        modifying this device. Widgets aren't built until it's placed.
         '''
-        return DeviceModifier(self)
+        return self.modifierClass(self)
 
 class Light(Device):
     '''
     Dimmer switch. Has on/off state and percentage.
     '''
-    def __init__(self, name, icon):
-        super().__init__(name, icon)
-        self.attributes['intensity'] = 100
-
-    def get_modifier(self):
-        '''
-        Returns an object that can be used to modify & get gui elements for 
-        modifying this device.
-        '''
-        return LightModifier(self)
-
-class LightModifier(DeviceModifier):
+    __slots__ = ()
     
-    def __init__(self, device):
-        super().__init__(device)
-        
-        self.uiElements['intensity'] = UIHorizontalSlider(
-            relative_rect=pygame.Rect((0, 0), (150, 30)),
-            start_value=0,
-            value_range=(0, 100),
-        )
\ No newline at end of file
+    schema = Device.schema.extend(intensity=100)
+    
+    modifierClass = LightModifier
+    
+    # A typical LED bulb
+    watts = 9
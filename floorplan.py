@@ -0,0 +1,124 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+floorplan.py: Floor plan layout and hit-testing
+
+Room rectangles are worked out once per floor, in plan coordinates
+(pixels at zoom 1, origin at the top left room cell), and kept until the
+floor's grid changes. FloorPlanView in widgets.py maps them to the screen.
+'''
+import pygame
+
+class SpatialIndex(object):
+    '''
+    Uniform grid of buckets over plan coordinates. Each rect is listed
+    in every bucket it touches, so finding what's at a point or inside
+    a view only looks at the buckets that cover it.
+    '''
+    def __init__(self, cellSize=256):
+        self.cellSize = cellSize
+        self.buckets = {}
+        self.rects = {}
+
+    def cells(self, rect):
+        size = self.cellSize
+        for cx in range(rect.left // size, (rect.right - 1) // size + 1):
+            for cy in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield cx, cy
+
+    def insert(self, key, rect):
+        self.rects[key] = rect
+        for cell in self.cells(rect):
+            self.buckets.setdefault(cell, []).append(key)
+
+    def query(self, rect):
+        '''
+        Keys whose rects overlap rect.
+        '''
+        found = set()
+        rects = self.rects
+        for cell in self.cells(rect):
+            for key in self.buckets.get(cell, ()):
+                if key not in found and rects[key].colliderect(rect):
+                    found.add(key)
+        return found
+
+    def hit(self, point):
+        '''
+        Key of the rect containing point, or None.
+        '''
+        x, y = point
+        cell = (int(x) // self.cellSize, int(y) // self.cellSize)
+        for key in self.buckets.get(cell, ()):
+            if self.rects[key].collidepoint(point):
+                return key
+        return None
+
+class FloorLayout(object):
+    '''
+    Where each room of a floor goes, by index into Floor.rooms.
+    Rooms sit in their grid cell, roomSize big with margin between them.
+    '''
+    def __init__(self, grid, roomSize=(75, 75), margin=2):
+        self.signature = self.signature_of(grid)
+        self.roomSize = roomSize
+        self.margin = margin
+
+        pitchX = roomSize[0] + margin
+        pitchY = roomSize[1] + margin
+        self.index = SpatialIndex(4 * max(pitchX, pitchY))
+        self.rects = {}
+        self.bounds = pygame.Rect(0, 0, 0, 0)
+
+        for r, row in enumerate(grid):
+            for c, room in enumerate(row):
+                if room is None:
+                    continue
+                rect = pygame.Rect((c * pitchX, r * pitchY), roomSize)
+                self.rects[room] = rect
+                self.index.insert(room, rect)
+
+        if self.rects:
+            self.bounds = pygame.Rect(next(iter(self.rects.values()))).unionall(list(self.rects.values()))
+
+    @staticmethod
+    def signature_of(grid):
+        return tuple(tuple(row) for row in grid)
+
+    def visible(self, view):
+        '''
+        Rooms overlapping view, a Rect in plan coordinates.
+        '''
+        return self.index.query(view)
+
+    def room_at(self, point):
+        return self.index.hit(point)
+
+class LayoutCache(object):
+    '''
+    FloorLayout for each floor, only rebuilt when the floor's grid changes.
+    '''
+    def __init__(self, roomSize=(75, 75), margin=2):
+        self.roomSize = roomSize
+        self.margin = margin
+        self.layouts = {}
+        self.built = 0
+
+    def get(self, floor):
+        grid = floor.grid
+        layout = self.layouts.get(floor)
+        if layout is None or layout.signature != FloorLayout.signature_of(grid):
+            layout = FloorLayout(grid, self.roomSize, self.margin)
+            self.layouts[floor] = layout
+            self.built += 1
+        return layout
+
+    def discard(self, floor):
+        self.layouts.pop(floor, None)
@@ -0,0 +1,419 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+house.py: The house model: rooms, floors and the house itself
+
+Split off from main.py so the store and the hub can load houses
+without importing the app.
+'''
+import logging
+from collections import OrderedDict
+
+from device import Light
+from activitylog import ActivityLog
+from registry import DeviceRegistry
+from journal import ActivityHistory
+from pipeline import CommandPipeline
+
+log = logging.getLogger(__name__)
+
+
+# class Camera(Device):
+#     '''
+#     Example subclass of Device
+#     '''
+#     def __init__(self, name, icon):
+#         super()
+#         self.feed = '' # TODO: path to image representing camera feed.
+
+class Room(object):
+    '''
+    Stores a width and height in pixels.
+    Contains a list of devices.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.w = 20
+        self.h = 20
+        self.devices = []
+
+
+class Floor(object):
+    '''
+    Stores a number of rooms and their positions relative to eachother.
+    Contains three untitled rooms by default.
+    Can be rendered to screen.
+    
+    grid holds indexes into rooms, or None where there is no room.
+    '''
+    def __init__(self, name, rooms=None, grid=None):
+        self.name = name
+        if rooms is None:
+            rooms = [Room('Room 0'), Room('Room 1'), Room('Room 2')]
+            grid = [
+                [0, 1],
+                [None, 2]
+            ]
+        self.rooms = rooms
+        self.grid = grid
+
+    def contents(self):
+        '''
+        (rooms, grid), or None if they aren't loaded.
+        '''
+        return self.rooms, self.grid
+
+class LazyFloor(Floor):
+    '''
+    Handle for a floor saved in a HouseStore. Only the name and how many
+    devices it has are known until rooms or grid is used; then the house
+    loads it. The house can unload it again to save memory, and it'll be
+    loaded again the next time it's used.
+    
+    index is the floor's number in the store.
+    '''
+    def __init__(self, name, index, deviceCount):
+        self.name = name
+        self.index = index
+        self.deviceCount = deviceCount
+        self.house = None
+        self.loaded = None
+    
+    @property
+    def rooms(self):
+        return self.load()[0]
+    
+    @property
+    def grid(self):
+        return self.load()[1]
+    
+    def load(self):
+        if self.loaded is None:
+            self.house.load_floor(self)
+        else:
+            self.house.touch_floor(self)
+        return self.loaded
+    
+    def contents(self):
+        return self.loaded
+
+class DeviceBatch(object):
+    '''
+    Collects changes to many devices and applies them together.
+    
+    Nothing happens until commit(), which runs every mutation, writes a
+    single log entry covering all the devices, and tells the house's
+    listeners once. Used as a context manager it commits on a clean exit
+    and drops everything if an exception is raised.
+    
+    flush() runs the mutations queued so far without committing, for
+    when the devices might not stay loaded until the end. Those can't be
+    dropped any more.
+    '''
+    def __init__(self, house, desc):
+        self.house = house
+        self.desc = desc
+        self.changes = []
+        self.applied = 0
+    
+    def apply(self, device, room, mutation):
+        '''
+        Queues mutation(device). room is only used for the log entry.
+        '''
+        self.changes.append((device, room, mutation))
+    
+    def flush(self):
+        for device, room, mutation in self.changes[self.applied:]:
+            mutation(device)
+        self.applied = len(self.changes)
+    
+    def commit(self):
+        if not self.changes:
+            return
+        self.flush()
+        self.house.commit_batch(self)
+        self.changes = []
+        self.applied = 0
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, excType, exc, tb):
+        if excType is None:
+            self.commit()
+        else:
+            self.changes = []
+            self.applied = 0
+
+class House(object):
+    '''
+    Stores a collection of named floors.
+    By default, a house has one floor and one room.
+    '''
+
+    # Oldest log entries are dropped past this many
+    logCapacity = 10000
+
+    # Fastest a device is sent slider-type changes, in seconds
+    commandInterval = 0.1
+
+    # Most devices kept loaded from lazy floors. Least recently used
+    # floors are unloaded past this, except the selected one.
+    floorBudget = 20000
+
+    def __init__(self, journal=None, floors=None, backend=None, store=None):
+        '''
+        backend: DeviceBackend that device commands are sent through.
+        Without one, commands just change the devices' attributes.
+        store: HouseStore that LazyFloors in floors are loaded from.
+        '''
+        demo = floors is None
+        if demo:
+            floors = [Floor('Ground Floor'), Floor('First Floor')]
+        self.floors = floors
+        
+        # Every device by id, with columns for house-wide queries
+        self.registry = DeviceRegistry()
+        
+        # Lazy floors that are loaded, least recently used first
+        self.store = store
+        self.loadedFloors = OrderedDict()
+        for floor in floors:
+            if isinstance(floor, LazyFloor):
+                floor.house = self
+        
+        # Called with (floor, rooms) when a lazy floor is unloaded
+        self.floorListeners = []
+        
+        # Called with floor when a lazy floor has been loaded
+        self.loadListeners = []
+        
+        # Selected floor starts on ground floor
+        self.selected_floor = self.floors[0]
+        
+        # Selected room will be room 0 on ground floor
+        self.selected_room = self.selected_floor.rooms[0]
+        
+        # Called with the list of changed devices after every batch
+        self.listeners = []
+        
+        # Called with the description of every new log entry
+        self.logListeners = []
+        
+        self.backend = backend
+        self.pipeline = CommandPipeline(self.send, self.commandInterval)
+
+        # Create activity log, carrying on from the journal if there is one
+        self.log = ActivityLog(self.logCapacity)
+        self.journal = journal
+        self.history = self.log
+        if journal is not None:
+            tail = journal.tail(self.logCapacity)
+            self.log.skip_to(len(journal) - len(tail))
+            for when, desc in tail:
+                self.log.append(desc, when=when)
+            self.history = ActivityHistory(self.log, journal)
+
+        self.log_event('Application started')
+
+        # Append a test device
+        if demo:
+            self.add_device(Light('TestDevice', ''), self.floors[0].rooms[0], self.floors[0])
+    
+    def log_event(self, desc: str, device=None, room=None):
+        '''
+        Logs desc, optionally against a device and/or room so it can be
+        found with log.for_device / log.for_room.
+        '''
+        self.log.append(desc, device, room)
+        if self.journal is not None:
+            self.journal.append(desc)
+        for listener in self.logListeners:
+            listener(desc)
+
+    def close(self):
+        '''
+        Sends any waiting commands, stops the device backend and
+        flushes the journal to disk.
+        '''
+        self.pipeline.flush()
+        if self.backend is not None:
+            self.backend.close()
+        if self.journal is not None:
+            self.journal.close()
+
+    def add_device(self, device, room, floor):
+        room.devices.append(device)
+        self.registry.add(device, room, floor)
+        return device
+
+    def remove_device(self, device):
+        self.registry.room_of(device).devices.remove(device)
+        self.registry.remove(device)
+
+    def devices(self):
+        '''
+        Yields (device, room) for every loaded device in the house.
+        Use stream_devices to include floors that aren't loaded.
+        '''
+        return self.registry.items()
+
+    def load_floor(self, floor):
+        '''
+        Reads a LazyFloor's rooms and devices from the store and adds the
+        devices to the house. May unload other floors to stay in budget.
+        '''
+        loaded, placed = self.store.load_floor(floor.index)
+        floor.loaded = (loaded.rooms, loaded.grid)
+        self.loadedFloors[floor] = None
+        for device, room in placed:
+            self.add_device(device, room, floor)
+        self.store.track_floor(self, floor.index, floor)
+        log.debug('Loaded %s, %d devices', floor.name, len(placed))
+        self.evict_floors(keep=floor)
+        
+        for listener in self.loadListeners:
+            listener(floor)
+
+    def touch_floor(self, floor):
+        self.loadedFloors.move_to_end(floor)
+
+    def unload_floor(self, floor):
+        '''
+        Saves a LazyFloor's changes and drops its rooms and devices.
+        '''
+        self.pipeline.flush()
+        self.store.save(self)
+        
+        rooms = floor.loaded[0]
+        for room in rooms:
+            for device in room.devices:
+                self.store.untrack(device)
+                self.registry.remove(device)
+        floor.loaded = None
+        del self.loadedFloors[floor]
+        log.debug('Unloaded %s', floor.name)
+        
+        for listener in self.floorListeners:
+            listener(floor, rooms)
+
+    def evict_floors(self, keep=None):
+        '''
+        Unloads least recently used floors until the loaded devices fit
+        in floorBudget. Never unloads keep or the selected floor.
+        '''
+        byFloor = self.registry.byFloor
+        loaded = sum(len(byFloor.get(floor, ())) for floor in self.loadedFloors)
+        for floor in list(self.loadedFloors):
+            if loaded <= self.floorBudget:
+                break
+            if floor is keep or floor is self.selected_floor:
+                continue
+            loaded -= len(byFloor.get(floor, ()))
+            self.unload_floor(floor)
+
+    def stream_floors(self):
+        '''
+        Yields every floor, loading lazy ones as it gets to them, so
+        house-wide work never needs the whole house in memory at once.
+        A floor may be unloaded again once the next one is loaded.
+        '''
+        for floor in self.floors:
+            if floor.contents() is None:
+                self.load_floor(floor)
+            yield floor
+
+    def stream_devices(self):
+        '''
+        Yields (device, room) for every device in the house, floor by floor.
+        '''
+        registry = self.registry
+        for floor in self.stream_floors():
+            for id in sorted(registry.byFloor.get(floor, ())):
+                yield registry.devices[id], registry.rooms[id]
+
+    def command(self, device, attribute, value):
+        '''
+        Sets a device attribute the way the user asked for it. Goes
+        through the pipeline, so bursts of eg intensity changes are
+        coalesced and rate limited.
+        '''
+        self.pipeline.push(device, attribute, value)
+
+    def send(self, device, attribute, value):
+        '''
+        Sends a command through the backend if there is one. The new
+        value shows straight away either way.
+        '''
+        if self.backend is None:
+            device.attributes[attribute] = value
+        else:
+            self.backend.submit(device, attribute, value)
+
+    def device_result(self, event):
+        '''
+        Handles a DEVICE_RESULT event from the backend.
+        '''
+        if self.backend is None:
+            return
+        device = self.registry.get(event.device_id)
+        if self.backend.resolve(event, device):
+            self.log_event(f'{device.name} did not respond, {event.attribute} not changed',
+                           device, self.registry.room_of(device))
+
+    def batch(self, desc):
+        '''
+        Starts a DeviceBatch, eg:
+            with house.batch('Dimmed the lights') as batch:
+                batch.apply(light, room, lambda d: d.turn_off())
+        '''
+        return DeviceBatch(self, desc)
+
+    def commit_batch(self, batch):
+        pairs = [(device, room) for device, room, mutation in batch.changes]
+        
+        self.log.append_many(batch.desc, pairs)
+        if self.journal is not None:
+            self.journal.append(batch.desc)
+        for listener in self.logListeners:
+            listener(batch.desc)
+        
+        devices = [device for device, room in pairs]
+        for listener in self.listeners:
+            listener(devices)
+
+    def apply_bulk(self, ids, mutation, desc):
+        '''
+        Applies mutation to every device in ids as one batch. ids usually
+        comes from a registry query, eg registry.where('on', True).
+        Returns how many devices were changed.
+        '''
+        registry = self.registry
+        with self.batch(desc) as batch:
+            for id in ids:
+                batch.apply(registry.devices[id], registry.rooms[id], mutation)
+            count = len(batch.changes)
+        return count
+
+    def turn_off_all(self):
+        '''
+        One batch and log entry for the whole house, but applied a floor
+        at a time while that floor is loaded. Devices that are already
+        off are never touched.
+        '''
+        registry = self.registry
+        turn_off = lambda device: self.command(device, 'on', False)
+        with self.batch('Turned off all devices') as batch:
+            for floor in self.stream_floors():
+                for id in registry.where('on', True, registry.byFloor.get(floor, ())):
+                    batch.apply(registry.devices[id], registry.rooms[id], turn_off)
+                batch.flush()
+            count = len(batch.changes)
+        return count
@@ -0,0 +1,378 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+journal.py: Append-only on-disk activity journal
+
+The log is written to numbered segment files in a directory:
+    journal-000000.log   records: <timestamp double><length uint32><utf-8 text>
+    journal-000000.idx   sparse index: <timestamp double><offset uint64><record uint32>
+                         for every indexEvery-th record in the segment
+
+A background thread does all the writing, so House.log_event only
+puts the record on a queue.
+'''
+import mmap
+import os
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime
+from queue import Queue, Empty
+from time import time
+
+RECORD = struct.Struct('<dI')
+INDEX = struct.Struct('<dQI')
+
+class Segment(object):
+    '''
+    One journal file and its sparse index.
+    first is the journal-wide number of its first record.
+    '''
+    def __init__(self, path, number, first):
+        self.path = path
+        self.number = number
+        self.first = first
+        self.count = 0
+        self.size = 0
+        self.times = array('d')
+        self.offsets = array('Q')
+        self.records = array('L')
+
+    def logPath(self):
+        return os.path.join(self.path, f'journal-{self.number:06d}.log')
+
+    def idxPath(self):
+        return os.path.join(self.path, f'journal-{self.number:06d}.idx')
+
+class Journal(object):
+    '''
+    Persistent, append-only activity log.
+
+    append() is safe to call from the UI thread; it never touches the
+    disk. Records are numbered from 0 in the order they were appended,
+    across restarts, so a record number lines up with an ActivityLog seq.
+
+    Segments are read back through mmap, so scrolling far back in the
+    activity list only touches the pages it needs.
+    '''
+    def __init__(self, path, segmentSize=1 << 20, indexEvery=64,
+                 flushInterval=0.5, openMaps=4):
+        self.path = path
+        self.segmentSize = segmentSize
+        self.indexEvery = indexEvery
+        self.flushInterval = flushInterval
+        self.openMaps = openMaps
+
+        os.makedirs(path, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.segments = []
+        self.maps = OrderedDict()
+        self.load()
+
+        self.queue = Queue()
+        self.closing = threading.Event()
+        self.writer = threading.Thread(target=self.run, name='journal-writer', daemon=True)
+        self.writer.start()
+
+    # Startup
+
+    def load(self):
+        '''
+        Reads the sparse index of every segment and counts the records in
+        the last stretch of each one. Cuts off a half-written record left
+        by a crash.
+        '''
+        numbers = sorted(int(name[8:14]) for name in os.listdir(self.path)
+                         if name.startswith('journal-') and name.endswith('.log'))
+        first = 0
+        for number in numbers:
+            segment = Segment(self.path, number, first)
+            self.load_segment(segment)
+            self.segments.append(segment)
+            first += segment.count
+
+        if not self.segments:
+            self.segments.append(Segment(self.path, 0, 0))
+
+        last = self.segments[-1]
+        self.out = open(last.logPath(), 'ab')
+        self.idxOut = open(last.idxPath(), 'ab')
+
+    def load_segment(self, segment):
+        indexSize = 0
+        if os.path.exists(segment.idxPath()):
+            with open(segment.idxPath(), 'rb') as f:
+                data = f.read()
+            indexSize = len(data)
+            for when, offset, record in INDEX.iter_unpack(data[:len(data) - len(data) % INDEX.size]):
+                segment.times.append(when)
+                segment.offsets.append(offset)
+                segment.records.append(record)
+
+        # The index is flushed before the records it points to, so after a
+        # crash its last entries can be past the end of the log
+        size = os.path.getsize(segment.logPath())
+        self.drop_index_from(segment, size)
+        offset = segment.offsets[-1] if segment.offsets else 0
+        count = segment.records[-1] if segment.records else 0
+
+        with open(segment.logPath(), 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        pos = 0
+        while pos + RECORD.size <= len(data):
+            when, length = RECORD.unpack_from(data, pos)
+            if pos + RECORD.size + length > len(data):
+                break
+            pos += RECORD.size + length
+            count += 1
+
+        segment.count = count
+        segment.size = offset + pos
+        if segment.size < size:
+            with open(segment.logPath(), 'r+b') as f:
+                f.truncate(segment.size)
+
+        # An entry for a record that was cut off would be written again
+        self.drop_index_from(segment, segment.size)
+        if len(segment.offsets) * INDEX.size < indexSize:
+            with open(segment.idxPath(), 'r+b') as f:
+                f.truncate(len(segment.offsets) * INDEX.size)
+
+    @staticmethod
+    def drop_index_from(segment, size):
+        '''
+        Forgets index entries for records at or past offset size.
+        '''
+        while segment.offsets and segment.offsets[-1] >= size:
+            segment.times.pop()
+            segment.offsets.pop()
+            segment.records.pop()
+
+    def __len__(self):
+        with self.lock:
+            last = self.segments[-1]
+            return last.first + last.count
+
+    def tail(self, n):
+        '''
+        The last n records on disk as (timestamp, text), oldest first.
+        Only reads the segments they live in.
+        '''
+        end = len(self)
+        return list(self.records(max(0, end - n), end))
+
+    # Writing
+
+    def append(self, desc, when=None):
+        if when is None:
+            when = time()
+        self.queue.put((when, desc))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    break
+            if batch:
+                self.write(batch)
+            if item is None:
+                break
+            # Let a burst of events pile up into the next batch
+            self.closing.wait(self.flushInterval)
+
+    def write(self, batch):
+        '''
+        Writes a batch of records. Readers only see the new size and
+        count once the data has been flushed, so they never read past
+        what is actually in the file.
+        '''
+        segment = self.segments[-1]
+        size, count = segment.size, segment.count
+
+        for when, desc in batch:
+            data = desc.encode('utf-8')
+            if count % self.indexEvery == 0:
+                with self.lock:
+                    segment.times.append(when)
+                    segment.offsets.append(size)
+                    segment.records.append(count)
+                self.idxOut.write(INDEX.pack(when, size, count))
+
+            self.out.write(RECORD.pack(when, len(data)))
+            self.out.write(data)
+            size += RECORD.size + len(data)
+            count += 1
+
+            if size >= self.segmentSize:
+                self.publish(segment, size, count)
+                segment = self.rotate()
+                size, count = 0, 0
+
+        self.publish(segment, size, count)
+
+    def publish(self, segment, size, count):
+        self.out.flush()
+        self.idxOut.flush()
+        with self.lock:
+            segment.size = size
+            segment.count = count
+
+    def rotate(self):
+        '''
+        Closes the current segment and starts the next one.
+        '''
+        self.out.close()
+        self.idxOut.close()
+        last = self.segments[-1]
+        segment = Segment(self.path, last.number + 1, last.first + last.count)
+        with self.lock:
+            self.segments.append(segment)
+        self.out = open(segment.logPath(), 'ab')
+        self.idxOut = open(segment.idxPath(), 'ab')
+        return segment
+
+    def close(self):
+        '''
+        Writes out everything still queued and stops the writer thread.
+        '''
+        self.closing.set()
+        self.queue.put(None)
+        self.writer.join()
+        self.out.close()
+        self.idxOut.close()
+        for m in self.maps.values():
+            m.close()
+        self.maps.clear()
+
+    # Reading
+
+    def segment_for(self, record):
+        '''
+        Segment holding record number, or None.
+        '''
+        firsts = [s.first for s in self.segments]
+        i = bisect_right(firsts, record) - 1
+        if i < 0:
+            return None
+        segment = self.segments[i]
+        if record >= segment.first + segment.count:
+            return None
+        return segment
+
+    def data_for(self, segment):
+        '''
+        Segment contents through mmap. Maps are kept open in a small LRU
+        and remapped if the segment has grown since.
+        '''
+        m = self.maps.get(segment.number)
+        if m is not None and len(m) < segment.size:
+            del self.maps[segment.number]
+            m.close()
+            m = None
+
+        if m is None:
+            with open(segment.logPath(), 'rb') as f:
+                m = mmap.mmap(f.fileno(), segment.size, access=mmap.ACCESS_READ)
+            self.maps[segment.number] = m
+            if len(self.maps) > self.openMaps:
+                self.maps.popitem(last=False)[1].close()
+        else:
+            self.maps.move_to_end(segment.number)
+        return m
+
+    def records(self, start, end):
+        '''
+        Yields (timestamp, text) for record numbers start to end - 1.
+        Seeks with the sparse index then reads forward.
+        '''
+        record = start
+        while record < end:
+            with self.lock:
+                segment = self.segment_for(record)
+                if segment is None:
+                    return
+                data = self.data_for(segment)
+                local = record - segment.first
+                block = bisect_right(segment.records, local) - 1
+                pos = segment.offsets[block]
+                stop = min(end - segment.first, segment.count)
+
+            i = segment.records[block]
+            while i < stop:
+                when, length = RECORD.unpack_from(data, pos)
+                if i >= local:
+                    text = data[pos + RECORD.size:pos + RECORD.size + length]
+                    yield when, text.decode('utf-8')
+                pos += RECORD.size + length
+                i += 1
+            record = segment.first + stop
+
+    def read(self, record):
+        '''
+        A single record as (datetime, text), or None if it isn't on disk yet.
+        '''
+        for when, desc in self.records(record, record + 1):
+            return datetime.fromtimestamp(when), desc
+        return None
+
+    def seek_time(self, when):
+        '''
+        Number of the first record at or after timestamp when, using the
+        sparse index to narrow it down to indexEvery records.
+        '''
+        with self.lock:
+            segments = [s for s in self.segments if s.count]
+            starts = [s.times[0] for s in segments]
+        i = bisect_right(starts, when) - 1
+        if i < 0:
+            return 0
+        segment = segments[i]
+        block = max(0, bisect_right(segment.times, when) - 1)
+        record = segment.first + segment.records[block]
+        for t, desc in self.records(record, segment.first + segment.count):
+            if t >= when:
+                return record
+            record += 1
+        return record
+
+class ActivityHistory(object):
+    '''
+    Everything ever logged: the in-memory ActivityLog for recent
+    entries, and the Journal for anything older that has fallen out of
+    the ring buffer. Indexes like a list, oldest first.
+    '''
+    def __init__(self, log, journal):
+        self.log = log
+        self.journal = journal
+
+    def __len__(self):
+        return self.log.total
+
+    def __getitem__(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('history index out of range')
+        if i >= self.log.first:
+            return self.log.entry(i)
+        entry = self.journal.read(i)
+        if entry is None:
+            return (datetime.fromtimestamp(0), '')
+        return entry
@@ -8,83 +8,36 @@ for CSCI 310 at VIU
 
 started November 21st, 2024
 '''
+# Taken first so the startup report covers the imports below
+from time import perf_counter
+STARTED = perf_counter()
+
 # Built-in libraries
-from datetime import datetime
+import logging
+import os
+import threading
+from time import strftime, gmtime
 
 # Outside libraries
 import pygame
-import pygame_gui
-from pygame_gui.core import ObjectID
-
-# Modules in this project
-from screen import *
-from device import *
-
-
-# class Camera(Device):
-#     '''
-#     Example subclass of Device
-#     '''
-#     def __init__(self, name, icon):
-#         super()
-#         self.feed = '' # TODO: path to image representing camera feed.
-
-class Room(object):
-    '''
-    Stores a width and height in pixels.
-    Contains a list of devices.
-    '''
-    def __init__(self, name):
-        self.name = name
-        self.w = 20
-        self.h = 20
-        self.devices = []
-
-
-class Floor(object):
-    '''
-    Stores a number of rooms and their positions relative to eachother.
-    Contains two adjacent, untitled rooms by default.
-    Can be rendered to screen.
-    '''
-    def __init__(self, name):
-        self.name = name
-        self.rooms = [Room('Room 0'), Room('Room 1'), Room('Room 2')]
-        self.grid = [
-            [0, 1],
-            [None, 2]
-        ]
-
-class House(object):
-    '''
-    Stores a collection of named floors.
-    By default, a house has one floor and one room.
-    '''
-    def __init__(self):
-        self.floors = [Floor('Ground Floor'), Floor('First Floor')]
-        
-        # Selected floor starts on ground floor
-        self.selected_floor = self.floors[0]
-        
-        # Selected room will be room 0 on ground floor
-        self.selected_room = self.selected_floor.rooms[0]
-        
-        # Create activity log with startup event
-        self.log = [(datetime.now(), 'Application started')]
-
-        # Append a test device
-        self.floors[0].rooms[0].devices.append(Light('TestDevice', ''))
-    
-    def log_event(self, desc: str):
-        self.log.append((datetime.now(), desc))
-
-    def turn_off_all(self):
-        for floor in self.floors:
-            for room in floor.rooms:
-                for device in room.devices:
-                    device.turn_off()
-                    self.log_event(f'Turned off {device.name} in {room.name}')
 
+# Modules in this project. The ones that pull in pygame_gui or asyncio
+# (screen, textcache, backend) are imported by DashDemo.boot, so the
+# splash can be up before they load.
+from house import House
+from actions import *
+from render import DirtyTracker
+from journal import Journal
+from profiler import FrameTimings, ProfilerOverlay, Capture
+from store import HouseStore
+from floorplan import LayoutCache
+from startup import StartupTimings, ThemeCache, Splash
+from scheduler import Scheduler, SCHEDULE_DUE, load_scenes, save_scenes
+from rules import RuleEngine
+from telemetry import Telemetry, TELEMETRY_ROLLED
+from usage import Usage, USAGE_TICK
+
+log = logging.getLogger(__name__)
 
 class DashDemo(object):
     '''
@@ -103,256 +56,645 @@ class DashDemo(object):
     }
     screenDimensions = (300, 600)
 
-    def __init__(self):
+    # Max number of UI elements kept alive across all cached screens
+    screenBudget = 400
+
+    # 'idle' sleeps between input and redraws only dirty rects,
+    # 'full' redraws the whole window at activeFPS like before
+    renderMode = 'idle'
+    activeFPS = 60
+    idleFPS = 4
+
+    # Directory the activity journal is kept in
+    journalPath = 'journal'
+
+    # Snapshot the house is loaded from and saved to
+    housePath = 'house.snap'
+
+    # pygame_gui events that are routed through the screens' action
+    # registries, by name since pygame_gui is imported later on
+    dispatchedEvents = (
+        'UI_BUTTON_PRESSED',
+        'UI_HORIZONTAL_SLIDER_MOVED'
+    )
+
+    # Raw mouse events screens can use directly, eg to pan the floor plan
+    pointerEvents = (
+        pygame.MOUSEBUTTONDOWN,
+        pygame.MOUSEBUTTONUP,
+        pygame.MOUSEMOTION,
+        pygame.MOUSEWHEEL
+    )
+
+    # Phases of a frame timed by self.timings, in order. events includes
+    # any time spent waiting for input or for the frame cap.
+    phases = ('events', 'dispatch', 'update', 'draw', 'flip')
+
+    # F3 shows frame timings, F9 starts/stops a cProfile capture
+    overlayKey = pygame.K_F3
+    profileKey = pygame.K_F9
+    profilePath = 'profiles'
+
+    # 'splash' shows a plain frame straight away and loads the theme,
+    # fonts and house on a thread behind it. 'blocking' loads everything
+    # before the first frame.
+    startupMode = 'splash'
+
+    # Theme, and where its parsed form is cached between runs
+    themePath = 'home-dash.json'
+    themeCachePath = 'home-dash.json.cache'
+
+    # Fonts loaded up front besides the ones the theme names (those are
+    # loaded with the theme), in UIManager.preload_fonts format, eg
+    # {'name': 'sanfrancisco', 'point_size': 24, 'style': 'regular'}
+    preloadFonts = []
+
+    # Memory kept for rendered text, shared by every screen
+    textCacheBytes = 4 * 1024 * 1024
+
+    # Scenes the scheduler can apply, saved on exit
+    scenesPath = 'scenes.json'
+
+    # (hour, minute, scheduler.Action) to run every day, eg
+    # (23, 0, SetAll('on', False, Light, 'Lights off for the night'))
+    schedules = []
+
+    # rules.Rule automations to run, see rules.py for an example
+    rules = []
+
+    # Socket of a sync.py hub to share the house with other panels, or
+    # None for a house of this panel's own. With a hub, schedules and
+    # rules are set on sync.StateHub instead.
+    hubPath = None
+
+    # Where the status bar reads the battery from, None for the panel's
+    # own battery if it has one, eg statusbar.StubStatusProvider(50)
+    statusProvider = None
+
+    # Rendered before the first frame along with the clock and the names
+    # on the selected floor
+    warmText = ('Home', 'Rooms', 'Activity', 'Add New', 'Back', 'ON/OFF',
+                'on', 'off') + tuple(str(i) for i in range(101))
+
+    def __init__(self, renderMode=None, house=None, run=True, startupMode=None, hubPath=None):
+        '''
+        house: House to show. By default the house saved at housePath, or
+        the demo house the first time, with a journal.
+        run: go straight into mainLoop. Scripts that drive the app
+        themselves, eg benchmark.py, pass False and call step().
+        startupMode: overrides DashDemo.startupMode.
+        hubPath: overrides DashDemo.hubPath.
+        '''
+        if renderMode is not None:
+            self.renderMode = renderMode
+        if startupMode is not None:
+            self.startupMode = startupMode
+        if hubPath is not None:
+            self.hubPath = hubPath
+        # Only the first DashDemo in a process waited on the imports
+        global STARTED
+        self.startup = StartupTimings(STARTED)
+        if STARTED is not None:
+            self.startup.since_origin('imports')
+            STARTED = None
         self.state = self.states['home']
-        self.house = House()
-
-        pygame.init()
-        self.surf = pygame.display.set_mode(self.screenDimensions)
-        self.bg = pygame.Surface(self.screenDimensions)
-        self.bg.fill(pygame.Color('#FFFFFF'))
-        self.clock = pygame.time.Clock()
+        self.store = None
+        self.house = house
         self.running = True
+        self.idle = False
+
+        with self.startup.phase('display'):
+            pygame.init()
+            self.surf = pygame.display.set_mode(self.screenDimensions)
+            self.bg = pygame.Surface(self.screenDimensions)
+            self.bg.fill(pygame.Color('#FFFFFF'))
+            self.clock = pygame.time.Clock()
+
+        if self.startupMode == 'splash':
+            self.boot_behind_splash()
+        else:
+            self.boot()
 
-        self.manager = pygame_gui.UIManager(self.screenDimensions,
-            theme_path="home-dash.json")
+        with self.startup.phase('screens'):
+            self.build()
 
-        self.screen = HomeScreen(self.manager)
+        # Draw the first frame now rather than waiting on input
+        self.manager.update(0)
+        self.draw()
+        self.startup.mark('first frame')
+        log.info('%s', self.startup.format())
 
-        self.mainLoop()
+        if run:
+            self.mainLoop()
+
+    def boot(self):
+        '''
+        Loads everything the first screen needs that doesn't have to be
+        done on the main thread: pygame_gui, the theme and its fonts, the
+        house and the text cache. In splash mode this runs on a thread.
+        '''
+        startup = self.startup
+        with startup.phase('ui imports'):
+            import pygame_gui
+            import screen
+            from backend import DEVICE_RESULT
+            from textcache import TextCache, install
+        self.dispatched = frozenset(getattr(pygame_gui, name) for name in self.dispatchedEvents)
+        self.deviceResult = DEVICE_RESULT
+
+        # sync.py (and asyncio) only if there's a hub to talk to
+        self.hubUpdate = None
+        if self.hubPath is not None:
+            from sync import HUB_UPDATE
+            self.hubUpdate = HUB_UPDATE
+
+        with startup.phase('theme'):
+            themes = ThemeCache(self.themePath, self.themeCachePath)
+            theme = themes.load()
+            self.manager = pygame_gui.UIManager(self.screenDimensions, theme_path=theme)
+        log.debug('Theme cache %s', 'hit' if themes.hit else 'rebuilt')
+
+        with startup.phase('fonts'):
+            self.manager.preload_fonts(self.preloadFonts)
+
+        with startup.phase('house'):
+            if self.house is None:
+                self.house = self.load_house()
+
+        with startup.phase('text'):
+            self.text = TextCache(self.textCacheBytes)
+            install(self.manager, self.text)
+            self.warm_up()
+
+    def boot_behind_splash(self):
+        '''
+        Shows the splash and keeps it responsive while boot() runs on
+        its own thread. Closing the window meanwhile quits once booted.
+        '''
+        with self.startup.phase('splash'):
+            splash = Splash(self.surf, self.bg)
+            splash.draw(0)
+        booted = self.startup.done()
+
+        failed = []
+        def run():
+            try:
+                self.boot()
+            except BaseException as e:
+                failed.append(e)
+        thread = threading.Thread(target=run, name='boot', daemon=True)
+        thread.start()
+
+        # boot() records five phases. Redrawn about 30 times a second,
+        # but carries on as soon as the thread is done.
+        while True:
+            thread.join(1 / 30)
+            if not thread.is_alive():
+                break
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.running = False
+            splash.draw((self.startup.done() - booted) / 5)
+        if failed:
+            raise failed[0]
+
+    def build(self):
+        '''
+        Main thread part of startup, once boot() is done.
+        '''
+        from screen import CommonElements, ScreenCache
+        from statusbar import StatusBar
+
+        self.house.listeners.append(self.on_devices_changed)
+        self.house.floorListeners.append(self.on_floor_unloaded)
+
+        self.tracker = DirtyTracker(self.manager, self.screenDimensions)
+
+        self.timings = FrameTimings(self.phases)
+        self.overlay = ProfilerOverlay(self.timings)
+        self.capture = Capture(self.profilePath)
+
+        # Action type -> handler, see actions.py
+        self.handlers = {
+            Navigate:       self.handle_navigate,
+            ChangeFloor:    self.handle_floor_buttons,
+            OpenRoom:       self.handle_room_buttons,
+            OpenDevice:     self.handle_device_buttons,
+            Control:        self.handle_device_controls,
+            HouseCommand:   self.handle_house_command,
+            Zoom:           self.handle_zoom
+        }
+
+        # Room rectangles per floor for the rooms screen
+        self.layouts = LayoutCache()
+
+        # Navbar, clock and battery are built once and shared by all screens
+        self.common = CommonElements(self.manager)
+        self.screens = ScreenCache(self.manager, self.common, self.screenBudget)
+
+        # Updates the clock and battery by itself, outside any screen
+        self.status = StatusBar(self.common, self.statusProvider)
+        self.status.start()
+
+        # Daily schedules and rules run on the hub if there is one (see
+        # sync.StateHub), or every panel would fire them
+        schedules, rules = self.schedules, self.rules
+        if self.hubPath is not None:
+            if schedules or rules:
+                log.warning('Schedules and rules run on the hub, not on panels; ignoring them')
+            schedules, rules = (), ()
+
+        # Timed actions and scenes. Wakes the loop with SCHEDULE_DUE
+        # rather than being checked every frame.
+        self.scheduler = Scheduler(self.house)
+        self.scheduler.scenes = load_scenes(self.scenesPath)
+        for hour, minute, action in schedules:
+            self.scheduler.daily(hour, minute, action)
+
+        # Rules only run when a device they depend on changes
+        self.ruleEngine = RuleEngine(self.house)
+        for rule in rules:
+            self.ruleEngine.add(rule)
+
+        # History of every on/intensity change, rolled up on a thread
+        self.telemetry = Telemetry(self.house)
+        self.telemetry.start()
+
+        # Lights on, intensity and energy per room, floor and house
+        self.usage = Usage(self.house)
+        self.usage.start()
+
+        self.go_home(None)
     
+    def load_house(self):
+        '''
+        Loads the saved house, or saves the demo house if there isn't
+        one yet. Changes are saved when the app closes.
+        '''
+        if self.hubPath is not None:
+            return self.load_hub_house()
+
+        from backend import DeviceBackend, SimulatedTransport
+
+        journal = Journal(self.journalPath)
+        backend = DeviceBackend(SimulatedTransport())
+
+        self.store = HouseStore(self.housePath)
+        if self.store.exists():
+            house = self.store.load_house(lazy=True, journal=journal, backend=backend)
+        else:
+            house = House(journal, backend=backend)
+            self.store.write_snapshot(house)
+        self.store.track(house)
+        return house
+
+    def load_hub_house(self):
+        '''
+        Loads the house shared through the hub at hubPath. It's the same
+        snapshot the hub loaded, read but never written, since the hub
+        owns the house; changes come from the hub instead.
+        '''
+        from sync import HubClient
+
+        client = HubClient(self.hubPath)
+        self.store = HouseStore(self.housePath)
+        self.store.readOnly = True
+        if self.store.exists():
+            house = self.store.load_house(lazy=True, backend=client)
+            self.store.track(house)
+        else:
+            house = House(backend=client)
+        client.attach(house)
+        return house
+
+    def warm_up(self):
+        '''
+        Renders the text the first screens will want into self.text, so
+        building them doesn't have to.
+        '''
+        from textcache import warm_up
+
+        strings = list(self.warmText)
+        strings.append(strftime('%H:%M', gmtime()))
+        strings.extend(floor.name for floor in self.house.floors)
+        for room in self.house.selected_floor.rooms:
+            strings.append(room.name)
+            strings.extend(device.name for device in room.devices)
+        count = warm_up(self.manager, strings)
+        log.debug('Warmed text cache with %d renders: %s', count, self.text.stats())
+
     def draw_floor(self):
         '''
-        It's not pretty but it'll have to do. 这个太脏了！！！
-        
-        Because drawing the rectangles is pygame and not pygame_gui,
-        we're going to do it here in the DashDemo class and then tell
-        the RoomsScreen class to write the labels... and see how that works.
-        
-        EDIT: Actually removed the drawing logic and just made the labels
-        into buttons and this is probably going to work.
-        
+        Shows the selected floor's rooms on the RoomsScreen. The room
+        rectangles come from self.layouts, so they're only worked out
+        again if the floor's grid has changed.
         '''
-        grid = self.house.selected_floor.grid
-                
-        startPos = (20, 100)
-        roomSize = (75, 75)
-        margin = 2
-        
-        roomInfo = {}
-        
-        for r, row in enumerate(grid):
-            for c, col in enumerate(grid[r]):
-                if col is not None:
-                    # Compute the position of the room to place the label
-                    roomPos = (
-                        20 + c*(roomSize[0]+margin), 
-                        100 + r*(roomSize[1]+margin)
-                    )
-                    # Pack up the room index, name, x, y for sending to RoomsScreen
-                    roomInfo[col] = (self.house.selected_floor.rooms[col].name, r, c)
-                    # pygame.draw.rect(
-                    #     self.bg,
-                    #     "black",
-                    #     pygame.Rect(roomPos, roomSize), 
-                    #     width=2
-                    # )
-        
-        self.screen.label_rooms(roomInfo)
+        floor = self.house.selected_floor
+        self.screen.show_floor(self.layouts.get(floor), [room.name for room in floor.rooms])
     
     def clear(self):
-        # Destroy elements drawn with pygame_gui
+        from screen import CommonElements
+        
+        # Destroy elements drawn with pygame_gui, cached screens included
+        self.screens.clear()
         self.manager.clear_and_reset()
+        self.common = CommonElements(self.manager)
+        self.screens.common = self.common
+        self.status.attach(self.common)
         
         # Draw elements drawn with just pygame (room squares, mostly)
         self.bg.fill(pygame.Color('#FFFFFF'))
+        self.tracker.mark()
     
-    def handle_room_buttons(self, event):
+    def handle_room_buttons(self, event, action):
         '''
         Handles opening a room on the view rooms screen.
         '''
-        roomButtons = {v: k for k, v in self.screen.elems.items() if 'roombutton' in k}
-        
-        if event.ui_element not in roomButtons:
-            return
-        
-        id = int(
-            ''.join(
-                [c for c in roomButtons[event.ui_element] 
-                 if c.isdigit()]
-            )
-        )
-        
-        self.house.selected_room = self.house.selected_floor.rooms[id]
-        self.go_room(event, id)
+        self.house.selected_room = self.house.selected_floor.rooms[action.room_id]
+        self.go_room(event, action.room_id)
 
-    def handle_floor_buttons(self, event):
+    def handle_floor_buttons(self, event, action):
         '''
         Handle buttons to go to prev/next floor on view rooms screen.
         '''
         nFloors = len(self.house.floors)
         i = self.house.floors.index(self.house.selected_floor)
+        log.debug('Leaving floor %d', i)
         
-        print(i)
-        
-        if event.ui_element == self.screen.elems['prevfloor']:
-            if i > 0 and nFloors > 1:
-                i -= 1
-        elif event.ui_element == self.screen.elems['nextfloor']:
-            if i < nFloors - 1:
-                i += 1
+        i = max(0, min(nFloors - 1, i + action.step))
         
         self.house.selected_floor = self.house.floors[i]
         self.go_rooms(event)
 
-    def handle_device_buttons(self, event):
+    def handle_device_buttons(self, event, action):
         '''
         Handle buttons to inspect a device.
         '''
-        deviceButtons = {v:k for k,v in self.screen.elems.items() if 'device' in k}
-        
-        if event.ui_element not in deviceButtons:
-            return
-        
-        id = int(
-            ''.join(
-                [c for c in deviceButtons[event.ui_element] 
-                 if c.isdigit()]
-            )
-        )
-        
-        print(f'{id}, {deviceButtons}')
         self.go_device(event)
 
-    def handle_device_controls(self, event):
+    def handle_device_controls(self, event, action):
         '''
         Handles controls for different devices eg power buttons
         '''
-        elementNames = {v: k for k,v in self.screen.elems.items() }
-        print(elementNames)
+        device = self.house.registry.get(action.device_id)
+        
+        if action.attribute == 'power':
+            self.house.command(device, 'on', not device.attributes['on'])
+        elif action.attribute == 'intensity':
+            self.house.command(device, 'intensity', int(event.ui_element.get_current_value()))
+        
+        # Controls are only on the device screen; graph what was touched
+        self.screen.show_history(self.telemetry, device)
 
-        if event.ui_element not in elementNames:
-            print('not in elem names')
-            return
+    def handle_zoom(self, event, action):
+        self.screen.zoom(action.factor)
 
-        print(f'found control: {elementNames[event.ui_element]}')
+    def handle_house_command(self, event, action):
+        if action.name == 'turnoffall':
+            self.house.turn_off_all()
 
-        controlName = elementNames[event.ui_element]
-        
-        # All control names have a dot . in them. 
-        # Nothing else does, so this distinguishes device controls from other
-        # gui elements.
-        # TODO: STUPID HACK!!
-        if '.' not in controlName:
-            return
-        
-        device, attr = controlName.split('.')
-        
-        devNum = int(''.join([c for c in device if c.isdigit()]))
-        
-        if attr == 'power':
-            self.house.selected_room.devices[devNum].toggle_power()
-        elif attr == 'intensity':
-            print('intensity changed')
-            self.house.selected_room.devices[devNum].attributes['intensity'] = event.ui_element.get_current_value()
-            print(f'set to {event.ui_element.get_current_value()}')
-        
-        self.screen.update_labels(self.house.selected_room)
+    def handle_key(self, event):
+        '''
+        Profiling hotkeys.
+        '''
+        if event.key == self.overlayKey:
+            self.tracker.mark(self.overlay.toggle())
+        elif event.key == self.profileKey:
+            self.capture.toggle()
+
+    def on_devices_changed(self, devices):
+        '''
+        Called by House once per committed batch of device changes.
+        '''
+        self.screen.devices_changed(self.house, devices)
+
+    def on_floor_unloaded(self, floor, rooms):
+        '''
+        Drops cached screens for the rooms of a floor the house unloaded.
+        They'll be rebuilt from the new rooms if the floor is loaded again.
+        '''
+        self.screens.discard_for(rooms)
 
     def set_state(self, state: str):
         self.state = self.states[state]
-        self.clear()
+
+    def show_screen(self, screenClass, *params):
+        '''
+        Switches to the cached screen for screenClass and params.
+        Returns True if the screen was just created and needs filling in.
+        '''
+        self.screen, created = self.screens.show(screenClass, *params)
+        return created
 
     def go_home(self, event):
+        from screen import HomeScreen
         self.set_state('home')
-        self.screen = HomeScreen(self.manager)
+        self.show_screen(HomeScreen)
+        self.screen.draw_recent(self.house.log)
+        self.screen.draw_usage(self.usage, self.house.selected_floor)
 
     def go_rooms(self, event):
+        from screen import RoomsScreen
         self.set_state('rooms')
-        self.screen = RoomsScreen(self.manager)
-        self.screen.update(self.house.selected_floor)
+        floor = self.house.selected_floor
+        if self.show_screen(RoomsScreen, floor):
+            self.screen.update(floor)
         self.draw_floor()
         
     def go_room(self, event, id):
+        from screen import RoomScreen
         self.set_state('room')
-        self.screen = RoomScreen(self.manager)
-        self.screen.update(self.house.selected_floor.rooms[id])
+        room = self.house.selected_floor.rooms[id]
+        if self.show_screen(RoomScreen, room):
+            self.screen.update(room)
 
     def go_device(self, event):
+        from screen import DeviceScreen
         self.set_state('viewdevice')
-        self.screen = DeviceScreen(self.manager)
-        self.screen.update(self.house.selected_room)
+        room = self.house.selected_room
+        if self.show_screen(DeviceScreen, room):
+            self.screen.update(room)
+        self.screen.show_history(self.telemetry)
 
     def go_activity(self, event):
+        from screen import ActivityScreen
         self.set_state('activity')
-        self.screen = ActivityScreen(self.manager)
-        self.screen.draw_logs(self.house.log)
+        self.show_screen(ActivityScreen)
+        self.screen.draw_logs(self.house.history)
 
     def go_addnew(self, event):
+        from screen import AddNewScreen
         self.set_state('addnew')
-        self.screen = AddNewScreen(self.manager)
+        self.show_screen(AddNewScreen)
 
-    def handle_common_elements(self, event):
-        if event.ui_element == self.screen.elems['home']:
+    def handle_navigate(self, event, action):
+        if action.target == 'home':
             self.go_home(event)
-        elif event.ui_element == self.screen.elems['rooms']:
+        elif action.target == 'rooms':
             self.go_rooms(event)
-        elif event.ui_element == self.screen.elems['activity']:
+        elif action.target == 'room':
+            rooms = self.house.selected_floor.rooms
+            self.go_room(event, rooms.index(self.house.selected_room))
+        elif action.target == 'activity':
             self.go_activity(event)
-        elif event.ui_element == self.screen.elems['addnew']:
+        elif action.target == 'addnew':
             self.go_addnew(event)
 
-    def mainLoop(self):
-        while self.running:
-            
-            self.td = self.clock.tick(60) / 1000.0
-
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    print(f'self.screen.elems at shutdown:{self.screen.elems}')
-                    self.running = False
+    def dispatch(self, event):
+        '''
+        Looks up the action registered for the element behind this event
+        and calls its handler. Elements without an action are ignored.
+        '''
+        action = self.screen.actions.get(event.ui_element)
+        if action is None:
+            action = self.common.actions.get(event.ui_element)
+        if action is None:
+            return
+        
+        self.handlers[type(action)](event, action)
 
-                if event.type == pygame_gui.UI_BUTTON_PRESSED:
-                    # Common elements first, then state-specific
-                    self.handle_common_elements(event)
-                    
-                    if self.state == self.states['home']:
-                        if event.ui_element == self.screen.elems['turnoffall']:
-                            self.house.turn_off_all()
-                        elif event.ui_element == self.screen.elems['viewall']:
-                            self.go_activity(event)
-                        elif event.ui_element == self.screen.elems['viewroomsbutton']:
-                            self.go_rooms(event)
-                    
-                    if self.state == self.states['rooms']:
-                        print(f'Handling rooms buttons. State is {self.state}')
-                        self.handle_room_buttons(event)
-                        
-                        # Check if state changed after this handler function.
-                        if self.state != self.states['rooms']:
-                            break
-                        
-                        self.handle_floor_buttons(event)
-                    
-                    if self.state == self.states['room']:
-                        if event.ui_element == self.screen.elems['backbutton']:
-                            self.go_rooms(event)
-                        self.handle_device_buttons(event)
-
-                    if self.state == self.states['viewdevice']:
-                        self.handle_device_controls(event)
-
-                self.manager.process_events(event)
-
-            self.manager.update(self.td)
+    def get_events(self):
+        '''
+        In idle render mode with nothing changing, sleeps until input
+        arrives or the idle frame is due. Otherwise runs at activeFPS.
+        '''
+        if self.renderMode == 'idle' and self.idle:
+            first = pygame.event.wait(1000 // self.idleFPS)
+            self.td = self.clock.tick() / 1000.0
+            if first.type == pygame.NOEVENT:
+                return []
+            return [first] + pygame.event.get()
+        
+        self.td = self.clock.tick(self.activeFPS) / 1000.0
+        return pygame.event.get()
 
+    def draw(self):
+        '''
+        Full mode redraws the whole window every frame. Idle mode redraws
+        the area around the rects the tracker reports as dirty, once, and
+        flips just those rects.
+        '''
+        timings = self.timings
+        if self.renderMode == 'full':
             self.surf.blit(self.bg, (0, 0))
             self.manager.draw_ui(self.surf)
-
+            self.overlay.draw(self.surf)
+            timings.lap('draw')
             pygame.display.update()
+            timings.lap('flip')
+            self.tracker.frames_drawn += 1
+            return
+        
+        dirty = self.tracker.collect()
+        if not dirty:
+            timings.lap('draw')
+            timings.lap('flip')
+            self.tracker.frames_skipped += 1
+            return
+        
+        # One pass over the union of the dirty rects; only they're flipped
+        area = dirty[0].unionall(dirty[1:])
+        self.surf.set_clip(area)
+        self.surf.blit(self.bg, area, area)
+        self.manager.draw_ui(self.surf)
+        self.overlay.draw(self.surf)
+        self.surf.set_clip(None)
+        timings.lap('draw')
+        
+        pygame.display.update(dirty)
+        timings.lap('flip')
+        self.tracker.frames_drawn += 1
+        self.idle = False
+
+    def mainLoop(self):
+        while self.running:
+            self.step()
+
+        if self.capture.running:
+            self.capture.stop()
+        self.status.close()
+        self.scheduler.close()
+        self.telemetry.close()
+        self.usage.close()
+        if self.scheduler.scenes:
+            save_scenes(self.scheduler.scenes, self.scenesPath)
+        self.house.close()
+        if self.store is not None:
+            self.store.save(self.house)
+            self.store.close()
+
+    def step(self):
+        '''
+        One frame: input, handlers, UI update and drawing.
+        '''
+        timings = self.timings
+        timings.start()
+        events = self.get_events()
+        timings.lap('events')
+
+        # Stays idle only if this frame has no input, draws nothing and
+        # has no commands waiting to go out
+        self.idle = not events
+
+        for event in events:
+            if event.type == pygame.QUIT:
+                log.info('Elements at shutdown: %s', self.screen.elems)
+                log.info('Frames: %s', self.tracker.stats())
+                log.info('Commands: %s', self.house.pipeline.stats())
+                log.info('Text cache: %s', self.text.stats())
+                log.info('Status bar: %s', self.status.stats())
+                log.info('Scheduler: %s', self.scheduler.stats())
+                log.info('Rules: %s', self.ruleEngine.stats())
+                log.info('Telemetry: %s', self.telemetry.stats())
+                log.info('Usage: %s', self.usage.stats())
+                self.running = False
+            elif event.type == pygame.KEYDOWN:
+                self.handle_key(event)
+            elif event.type == self.deviceResult:
+                self.house.device_result(event)
+            elif event.type in self.status.events:
+                self.status.handle(event)
+            elif event.type == SCHEDULE_DUE:
+                self.scheduler.run_due()
+            elif event.type == TELEMETRY_ROLLED:
+                self.screen.history_changed()
+            elif event.type == USAGE_TICK:
+                self.usage.tick()
+                self.screen.usage_changed()
+            elif event.type == self.hubUpdate:
+                self.house.backend.apply(event)
+
+            if event.type in self.dispatched:
+                self.dispatch(event)
+            elif event.type in self.pointerEvents:
+                self.screen.handle_input(event)
+
+            self.manager.process_events(event)
+
+        pipeline = self.house.pipeline
+        pipeline.poll()
+        if pipeline.pending:
+            self.idle = False
+        timings.lap('dispatch')
+
+        self.manager.update(self.td)
+        timings.lap('update')
+
+        rect = self.overlay.update()
+        if rect is not None:
+            self.tracker.mark(rect)
+
+        self.draw()
+        timings.end()
 
 def main():
-    demo = DashDemo()
+    # eg HOME_DASH_LOG=DEBUG python main.py
+    logging.basicConfig(
+        level=os.environ.get('HOME_DASH_LOG', 'WARNING').upper(),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+    # eg HOME_DASH_HUB=home-dash.sock python main.py, see sync.py
+    demo = DashDemo(hubPath=os.environ.get('HOME_DASH_HUB'))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
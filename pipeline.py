@@ -0,0 +1,146 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+pipeline.py: Coalescing, rate limited device commands
+'''
+from collections import OrderedDict
+from time import monotonic
+
+class CommandPipeline(object):
+    '''
+    Sits between the controls and the devices so a dragged slider
+    doesn't turn into a command per pixel.
+
+    Commands to throttled attributes are coalesced per (device,
+    attribute): only the latest value waiting is kept. Each device sends
+    at most once per interval seconds (intervals can be set per device).
+    leading sends the first command of a burst straight away, trailing
+    sends the last value waiting once the interval is up; with trailing
+    off, values that arrive during the interval are dropped.
+
+    Other attributes, eg power, go straight through, since their new
+    value usually depends on the current one.
+
+    poll() must be called regularly (every frame) to send trailing
+    values. Everything runs on the UI thread.
+    '''
+    def __init__(self, send, interval=0.1, leading=True, trailing=True,
+                 throttled=('intensity',), clock=monotonic):
+        self.send = send
+        self.interval = interval
+        self.leading = leading
+        self.trailing = trailing
+        self.throttled = set(throttled)
+        self.clock = clock
+
+        # device id -> seconds, for devices that aren't on interval
+        self.intervals = {}
+
+        # device id -> time it last sent
+        self.lastSent = {}
+
+        # device id -> (device, OrderedDict attribute -> value)
+        self.waiting = {}
+
+        self.counts = {
+            'received':     0,
+            'sent':         0,
+            'coalesced':    0,
+            'suppressed':   0,
+            'unchanged':    0
+        }
+
+    def set_interval(self, device, seconds):
+        '''
+        Rate limit for one device, None to go back to the default.
+        '''
+        if seconds is None:
+            self.intervals.pop(device.id, None)
+        else:
+            self.intervals[device.id] = seconds
+
+    def push(self, device, attribute, value):
+        self.counts['received'] += 1
+        if attribute not in self.throttled:
+            self.emit(device, attribute, value)
+            return
+
+        now = self.clock()
+        last = self.lastSent.get(device.id)
+        interval = self.intervals.get(device.id, self.interval)
+        due = last is None or now - last >= interval
+
+        if due and self.leading and device.id not in self.waiting:
+            self.lastSent[device.id] = now
+            self.emit(device, attribute, value)
+            return
+
+        if not self.trailing:
+            # Inside the interval with nothing to send it at the end
+            self.counts['suppressed'] += 1
+            return
+
+        entry = self.waiting.get(device.id)
+        if entry is None:
+            entry = self.waiting[device.id] = (device, OrderedDict())
+            if last is None or not self.leading:
+                # Nothing sent yet, so the interval starts now
+                self.lastSent[device.id] = now
+        values = entry[1]
+        if attribute in values:
+            self.counts['coalesced'] += 1
+        values[attribute] = value
+
+    def poll(self):
+        '''
+        Sends values whose device's interval is up.
+        '''
+        if not self.waiting:
+            return
+        now = self.clock()
+        for id in list(self.waiting):
+            interval = self.intervals.get(id, self.interval)
+            if now - self.lastSent[id] < interval:
+                continue
+            device, values = self.waiting.pop(id)
+            self.lastSent[id] = now
+            for attribute, value in values.items():
+                self.emit(device, attribute, value)
+
+    def flush(self):
+        '''
+        Sends everything waiting now, ignoring the rate limit.
+        '''
+        now = self.clock()
+        for id, (device, values) in list(self.waiting.items()):
+            self.lastSent[id] = now
+            for attribute, value in values.items():
+                self.emit(device, attribute, value)
+        self.waiting.clear()
+
+    def emit(self, device, attribute, value):
+        if device.attributes[attribute] == value:
+            self.counts['unchanged'] += 1
+            return
+        self.counts['sent'] += 1
+        self.send(device, attribute, value)
+
+    @property
+    def pending(self):
+        return len(self.waiting)
+
+    def stats(self):
+        '''
+        Command counts. Dropped is everything received that never got
+        sent: replaced by a newer value, suppressed or already set.
+        '''
+        stats = dict(self.counts)
+        stats['dropped'] = stats['coalesced'] + stats['suppressed'] + stats['unchanged']
+        return stats
@@ -0,0 +1,184 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+profiler.py: Per-frame phase timings, FPS overlay and cProfile capture
+'''
+import cProfile
+import logging
+import os
+import pstats
+from array import array
+from datetime import datetime
+from io import StringIO
+from time import perf_counter
+
+import pygame
+
+log = logging.getLogger(__name__)
+
+class FrameTimings(object):
+    '''
+    How long each phase of the last size frames took, in seconds.
+
+    Every phase has a flat ring buffer indexed by frame. The main loop
+    calls start() at the top of a frame, lap(phase) as each phase ends
+    and end() once the frame is done, so the cost per frame is one
+    perf_counter() and one array store per phase.
+    '''
+    def __init__(self, phases, size=240):
+        self.phases = phases
+        self.size = size
+        self.columns = {phase: array('d', [0.0]) * size for phase in phases}
+        self.totals = array('d', [0.0]) * size
+        self.frames = 0
+        self.slot = 0
+        self.began = self.last = perf_counter()
+
+    def start(self):
+        self.slot = self.frames % self.size
+        self.began = self.last = perf_counter()
+
+    def lap(self, phase):
+        now = perf_counter()
+        self.columns[phase][self.slot] = now - self.last
+        self.last = now
+
+    def end(self):
+        self.totals[self.slot] = perf_counter() - self.began
+        self.frames += 1
+
+    def __len__(self):
+        return min(self.frames, self.size)
+
+    def summary(self):
+        '''
+        Mean and max milliseconds per phase over the buffered frames,
+        plus 'fps' worked out from the frame totals.
+        '''
+        n = len(self)
+        if n == 0:
+            return {'fps': 0.0}
+        out = {}
+        for phase in self.phases:
+            column = self.columns[phase][:n]
+            out[phase] = (sum(column) / n * 1000, max(column) * 1000)
+        total = sum(self.totals[:n])
+        out['fps'] = n / total if total else 0.0
+        return out
+
+class ProfilerOverlay(object):
+    '''
+    Small box in the corner with FPS and per-phase milliseconds.
+
+    Drawn straight onto the window after the UI so it doesn't add
+    elements to the manager. The text is only re-rendered every
+    interval seconds, which is also the only time it asks for a redraw,
+    so idle mode can still sleep between updates.
+    '''
+    interval = 0.5
+
+    def __init__(self, timings, pos=(0, 0)):
+        self.timings = timings
+        self.pos = pos
+        self.visible = False
+        self.surface = None
+        self.rect = pygame.Rect(pos, (0, 0))
+        self.due = 0.0
+        self.font = None
+
+    def toggle(self):
+        '''
+        Shows/hides the overlay. Returns the rect that needs redrawing.
+        '''
+        self.visible = not self.visible
+        rect = self.rect
+        self.due = 0.0
+        if self.visible:
+            rect = self.update()
+        return rect
+
+    def update(self):
+        '''
+        Re-renders the text if it is due. Returns the rect to redraw, or
+        None if nothing changed.
+        '''
+        now = perf_counter()
+        if not self.visible or now < self.due:
+            return None
+        self.due = now + self.interval
+
+        if self.font is None:
+            self.font = pygame.font.Font(None, 16)
+
+        summary = self.timings.summary()
+        lines = [f"{summary['fps']:5.1f} fps"]
+        for phase in self.timings.phases:
+            if phase in summary:
+                mean, worst = summary[phase]
+                lines.append(f'{phase:<8} {mean:5.2f} {worst:6.2f} ms')
+
+        rendered = [self.font.render(line, True, pygame.Color('#FFFFFF')) for line in lines]
+        width = max(s.get_width() for s in rendered) + 8
+        height = sum(s.get_height() for s in rendered) + 6
+
+        self.surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        self.surface.fill((0, 0, 0, 180))
+        y = 3
+        for s in rendered:
+            self.surface.blit(s, (4, y))
+            y += s.get_height()
+
+        # Cover the old box too in case this one is smaller
+        old = self.rect
+        self.rect = pygame.Rect(self.pos, (width, height))
+        return self.rect.union(old)
+
+    def draw(self, surf):
+        if self.visible and self.surface is not None:
+            surf.blit(self.surface, self.rect)
+
+class Capture(object):
+    '''
+    Starts and stops a cProfile run. Each run is written to
+    path/frame-<time>.prof and the top functions are logged.
+    '''
+    def __init__(self, path='profiles', top=15):
+        self.path = path
+        self.top = top
+        self.profile = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def toggle(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            log.info('Profiling started')
+            return None
+        return self.stop()
+
+    def stop(self):
+        '''
+        Ends the run and returns the path it was saved to.
+        '''
+        self.profile.disable()
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, f"frame-{datetime.now():%Y%m%d-%H%M%S}.prof")
+        self.profile.dump_stats(path)
+
+        if log.isEnabledFor(logging.INFO):
+            text = StringIO()
+            pstats.Stats(self.profile, stream=text).sort_stats('cumulative').print_stats(self.top)
+            log.info('Profile saved to %s\n%s', path, text.getvalue())
+
+        self.profile = None
+        return path
@@ -0,0 +1,192 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+registry.py: Central registry of every device in the house
+'''
+from array import array
+from itertools import compress
+
+class DeviceRegistry(object):
+    '''
+    Every device in the house by a stable integer id, plus where it is.
+
+    Hot attributes are mirrored into flat columns indexed by id, so
+    house-wide questions like "which lights are on" are answered from
+    the columns without touching the device objects or walking floors
+    and rooms. The columns follow the devices by subscribing to their
+    attribute changes.
+
+    Ids are never reused, so an id stays valid for as long as the app
+    runs; removed devices just leave an empty row.
+    '''
+    def __init__(self):
+        self.devices = []
+        self.rooms = []
+        self.floors = []
+        self.alive = bytearray()
+
+        # attribute -> column, plus the value stored for devices without it
+        self.columns = {
+            'on':           bytearray(),
+            'intensity':    array('h')
+        }
+        self.missing = {
+            'on':           0,
+            'intensity':    -1
+        }
+
+        self.byRoom = {}
+        self.byFloor = {}
+        self.byType = {}
+
+        # Called with (device, attribute, value, previous) on every change,
+        # after the columns are updated. previous is the value the column
+        # had, or None for attributes without a column.
+        self.watchers = []
+
+        # Called with no arguments once a change, and any changes the
+        # watchers made in turn, has reached every watcher. Work that can
+        # load or unload floors belongs here rather than in a watcher.
+        self.settled = []
+        self.notifying = 0
+
+    def add(self, device, room, floor):
+        '''
+        Registers device and gives it its id.
+        '''
+        id = len(self.devices)
+        device.id = id
+        self.devices.append(device)
+        self.rooms.append(room)
+        self.floors.append(floor)
+        self.alive.append(1)
+
+        for attribute, column in self.columns.items():
+            if attribute in device.attributes:
+                column.append(int(device.attributes[attribute]))
+            else:
+                column.append(self.missing[attribute])
+
+        self.byRoom.setdefault(room, []).append(id)
+        self.byFloor.setdefault(floor, set()).add(id)
+        self.byType.setdefault(type(device), set()).add(id)
+
+        device.attributes.subscribe(self.changed)
+        return id
+
+    def remove(self, device):
+        id = device.id
+        device.attributes.unsubscribe(self.changed)
+
+        self.byRoom[self.rooms[id]].remove(id)
+        self.byFloor[self.floors[id]].discard(id)
+        self.byType[type(device)].discard(id)
+
+        self.devices[id] = None
+        self.rooms[id] = None
+        self.floors[id] = None
+        self.alive[id] = 0
+        for attribute, column in self.columns.items():
+            column[id] = self.missing[attribute]
+
+    def changed(self, device, attribute, value):
+        '''
+        Attribute subscriber that keeps the columns up to date.
+        '''
+        column = self.columns.get(attribute)
+        previous = None
+        if column is not None:
+            previous = column[device.id]
+            column[device.id] = int(value)
+        self.notifying += 1
+        try:
+            for watcher in self.watchers:
+                watcher(device, attribute, value, previous)
+        finally:
+            self.notifying -= 1
+        if not self.notifying:
+            for hook in self.settled:
+                hook()
+
+    def get(self, id):
+        return self.devices[id]
+
+    def __len__(self):
+        return self.alive.count(1)
+
+    def __iter__(self):
+        return compress(self.devices, self.alive)
+
+    def items(self):
+        '''
+        Yields (device, room) for every device.
+        '''
+        return compress(zip(self.devices, self.rooms), self.alive)
+
+    def room_of(self, device):
+        return self.rooms[device.id]
+
+    def floor_of(self, device):
+        return self.floors[device.id]
+
+    def in_room(self, room):
+        return [self.devices[id] for id in self.byRoom.get(room, ())]
+
+    def in_floor(self, floor):
+        return [self.devices[id] for id in sorted(self.byFloor.get(floor, ()))]
+
+    def of_type(self, deviceClass):
+        '''
+        Devices of deviceClass, subclasses included.
+        '''
+        ids = set()
+        for cls, members in self.byType.items():
+            if issubclass(cls, deviceClass):
+                ids |= members
+        return [self.devices[id] for id in sorted(ids)]
+
+    def where(self, attribute, value, ids=None):
+        '''
+        Ids of the devices whose attribute equals value, optionally only
+        among ids. Without ids the on column is scanned in C.
+        '''
+        column = self.columns[attribute]
+        value = int(value)
+
+        if ids is not None:
+            # Usually a floor or room, much smaller than the whole house
+            alive = self.alive
+            return sorted(id for id in ids if column[id] == value and alive[id])
+
+        if attribute == 'on':
+            if value:
+                mask = column
+            else:
+                # alive and not on, done on the columns as big ints
+                n = len(column)
+                bits = int.from_bytes(self.alive, 'little') & ~int.from_bytes(column, 'little')
+                mask = bits.to_bytes(n, 'little')
+            found = compress(range(len(column)), mask)
+        else:
+            found = (id for id, v in enumerate(column) if v == value and self.alive[id])
+        return list(found)
+
+    def count(self, attribute, value):
+        '''
+        How many devices have attribute equal to value.
+        '''
+        column = self.columns[attribute]
+        value = int(value)
+        n = column.count(value)
+        if value == self.missing[attribute]:
+            # Don't count removed devices or ones without the attribute
+            n -= sum(1 for id in range(len(column))
+                     if not self.alive[id] or attribute not in self.devices[id].attributes)
+        return n
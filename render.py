@@ -0,0 +1,92 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+render.py: Dirty rectangle tracking for the idle-aware render loop
+
+pygame_gui redraws every element every frame and doesn't say what
+changed, so DirtyTracker compares what the manager's sprite group is
+about to blit against the previous frame.
+'''
+import pygame
+
+class DirtyTracker(object):
+    '''
+    Works out which parts of the window changed since the last frame.
+
+    A sprite counts as changed if it appeared, disappeared, moved, or
+    swapped its image surface. pygame_gui builds a new surface whenever
+    an element's look changes (hover, text, state) so this catches
+    nearly everything. Anything else can be flagged with mark().
+
+    Also counts frames drawn versus frames skipped.
+    '''
+    # Past this many rectangles it's cheaper to redraw their union once
+    maxRects = 8
+
+    def __init__(self, manager, size):
+        self.manager = manager
+        self.screenRect = pygame.Rect((0, 0), size)
+        # id(blit_data) -> (image, rect tuple) as of the last frame.
+        # Holding the image itself stops its id being reused underneath us.
+        self.last = {}
+        self.marked = [self.screenRect.copy()]
+        self.frames_drawn = 0
+        self.frames_skipped = 0
+
+    def mark(self, rect=None):
+        '''
+        Flags a rect as dirty for the next frame. No rect means everything.
+        '''
+        if rect is None:
+            rect = self.screenRect
+        self.marked.append(pygame.Rect(rect))
+
+    def collect(self):
+        '''
+        Returns the list of rects that need redrawing this frame, clipped
+        to the window. Empty list means nothing changed.
+        '''
+        dirty = self.marked
+        self.marked = []
+
+        current = {}
+        for blitData in self.manager.get_sprite_group().visible:
+            image, rect = blitData[0], blitData[1]
+            state = (image, tuple(rect))
+            key = id(blitData)
+            current[key] = state
+
+            old = self.last.get(key)
+            if old is not None and old[0] is image and old[1] == state[1]:
+                continue
+            dirty.append(pygame.Rect(rect))
+            if old is not None:
+                dirty.append(pygame.Rect(old[1]))
+
+        # Sprites that were hidden or killed since last frame
+        for key, old in self.last.items():
+            if key not in current:
+                dirty.append(pygame.Rect(old[1]))
+
+        self.last = current
+
+        dirty = [r.clip(self.screenRect) for r in dirty]
+        dirty = list({tuple(r): r for r in dirty if r.w > 0 and r.h > 0}.values())
+
+        if len(dirty) > self.maxRects:
+            dirty = [dirty[0].unionall(dirty[1:])]
+
+        return dirty
+
+    def stats(self):
+        return {
+            'drawn': self.frames_drawn,
+            'skipped': self.frames_skipped
+        }
@@ -0,0 +1,336 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+rules.py: Automations that react to device changes
+
+    Rule('Hallway light at night',
+         [Term(frontDoor, 'on', '==', True), TimeBetween('19:30', '06:00')],
+         [Set(hallwayLight, 'on', True), Set(hallwayLight, 'intensity', 60)])
+
+A rule fires when all its conditions become true. RuleEngine indexes
+rules by the (device, attribute) pairs their conditions read, so a
+change only evaluates the rules that depend on it.
+'''
+import logging
+import operator
+from collections import deque
+from datetime import datetime
+from time import monotonic, perf_counter
+
+log = logging.getLogger(__name__)
+
+OPERATORS = {
+    '==':   operator.eq,
+    '!=':   operator.ne,
+    '<':    operator.lt,
+    '<=':   operator.le,
+    '>':    operator.gt,
+    '>=':   operator.ge
+}
+
+def locate(house, device):
+    '''
+    (floor index, room index, position in room) of a loaded device.
+    Unlike registry ids these stay the same when lazy floors are
+    unloaded and loaded again. Goes through the registry's columns and
+    the floor's loaded contents, so it never loads a floor or counts
+    as using one.
+    '''
+    registry = house.registry
+    floor = registry.floors[device.id]
+    room = registry.rooms[device.id]
+    rooms = floor.contents()[0]
+    return (house.floors.index(floor), rooms.index(room), room.devices.index(device))
+
+class Term(object):
+    '''
+    Condition on one device attribute, eg Term(door, 'on', '==', True).
+    device is a loaded Device or a locate() tuple.
+    '''
+    def __init__(self, device, attribute, op, value):
+        if op not in OPERATORS:
+            raise ValueError(f'Unknown operator {op}')
+        self.device = device
+        self.attribute = attribute
+        self.op = op
+        self.value = value
+
+    def __str__(self):
+        return f'{self.attribute} {self.op} {self.value!r}'
+
+class TimeBetween(object):
+    '''
+    Condition on the local time, 'HH:MM' to 'HH:MM', wrapping past
+    midnight if end is earlier. Doesn't trigger a rule by itself.
+    '''
+    def __init__(self, start, end, clock=datetime.now):
+        self.start = self.minutes(start)
+        self.end = self.minutes(end)
+        self.clock = clock
+
+    @staticmethod
+    def minutes(text):
+        hour, minute = text.split(':')
+        return int(hour) * 60 + int(minute)
+
+    def __call__(self):
+        now = self.clock()
+        minute = now.hour * 60 + now.minute
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end
+
+class Set(object):
+    '''
+    Action: sets a device attribute. device as for Term.
+    '''
+    def __init__(self, device, attribute, value):
+        self.device = device
+        self.attribute = attribute
+        self.value = value
+
+class Rule(object):
+    '''
+    conditions are Terms and callables (eg TimeBetween) that must all
+    be true; actions are Sets, run when the conditions go from not all
+    true to all true.
+    '''
+    def __init__(self, name, conditions, actions):
+        self.name = name
+        self.conditions = conditions
+        self.actions = actions
+
+        # Compiled by RuleEngine.add
+        self.check = None
+        self.keys = ()
+        self.last = False
+
+        self.evaluations = 0
+        self.fired = 0
+        self.suppressed = 0
+        self.seconds = 0.0
+        self.recent = deque()
+
+    def stats(self):
+        return {
+            'evaluations':  self.evaluations,
+            'fired':        self.fired,
+            'suppressed':   self.suppressed,
+            'eval_us':      round(self.seconds * 1e6 / self.evaluations, 2) if self.evaluations else 0.0
+        }
+
+class RuleEngine(object):
+    '''
+    Runs Rules against a House.
+
+    Watches every attribute change through the house's registry and
+    looks up the rules indexed under (device id, attribute). Devices are
+    kept as locate() tuples and the index is rebuilt when a lazy floor
+    is loaded or unloaded, since ids change then.
+
+    Rules are evaluated once the registry has told every watcher about
+    the change, not from the watcher itself, since reading a device on
+    a lazy floor can load it and unload others.
+
+    Cascades, where actions change devices that trigger more rules, are
+    run breadth first after the change that started them, and limited:
+    past maxDepth levels, or a rule firing twice in one cascade, the
+    rest is dropped with a warning. A rule firing more than maxRate
+    times in a second is also dropped, which catches loops that go
+    through the command pipeline and so span several cascades.
+    '''
+    maxDepth = 8
+    maxRate = 10
+
+    def __init__(self, house, clock=monotonic):
+        self.house = house
+        self.clock = clock
+        self.rules = []
+        self.index = {}
+
+        # locate() tuple -> registry id, for devices that are loaded
+        self.ids = {}
+
+        # (rules, depth) waiting to be evaluated, and (rule, depth) to fire
+        self.pending = deque()
+        self.queue = deque()
+        self.depth = 0
+        self.draining = False
+        self.firedInCascade = set()
+
+        house.registry.watchers.append(self.changed)
+        house.registry.settled.append(self.settle)
+        house.floorListeners.append(self.floor_changed)
+        house.loadListeners.append(self.floor_changed)
+
+    def close(self):
+        self.house.registry.watchers.remove(self.changed)
+        self.house.registry.settled.remove(self.settle)
+        self.house.floorListeners.remove(self.floor_changed)
+        self.house.loadListeners.remove(self.floor_changed)
+
+    def add(self, rule):
+        '''
+        Compiles rule and starts watching what it depends on.
+        '''
+        for item in rule.conditions + rule.actions:
+            if isinstance(item, (Term, Set)) and not isinstance(item.device, tuple):
+                item.device = locate(self.house, item.device)
+        rule.check = self.compile(rule)
+        rule.keys = {(term.device, term.attribute) for term in rule.conditions if isinstance(term, Term)}
+        self.rules.append(rule)
+        self.reindex()
+        rule.last = self.evaluate(rule)
+        return rule
+
+    def remove(self, rule):
+        self.rules.remove(rule)
+        self.reindex()
+
+    def compile(self, rule):
+        '''
+        One function that checks all of rule's conditions, device terms
+        first, stopping at the first one that's false.
+        '''
+        read = self.read
+        tests = []
+        for term in rule.conditions:
+            if isinstance(term, Term):
+                compare = OPERATORS[term.op]
+                tests.append(lambda t=term, compare=compare: compare(read(t.device, t.attribute), t.value))
+        tests.extend(term for term in rule.conditions if not isinstance(term, Term))
+        return lambda: all(test() for test in tests)
+
+    def device(self, where):
+        '''
+        Device at a locate() tuple, loading its floor if need be. None if
+        it isn't there any more.
+        '''
+        id = self.ids.get(where)
+        if id is not None:
+            return self.house.registry.devices[id]
+        f, r, d = where
+        try:
+            return self.house.floors[f].rooms[r].devices[d]
+        except IndexError:
+            return None
+
+    def read(self, where, attribute):
+        device = self.device(where)
+        if device is None:
+            return None
+        return device.attributes.get(attribute)
+
+    def reindex(self):
+        '''
+        Works out registry ids for every device the rules use, from the
+        floors that are loaded, and rebuilds the index.
+        '''
+        house = self.house
+        self.ids = {}
+        self.index = {}
+        for rule in self.rules:
+            for where, attribute in rule.keys:
+                if where not in self.ids:
+                    f, r, d = where
+                    contents = house.floors[f].contents() if f < len(house.floors) else None
+                    if contents is None:
+                        continue
+                    rooms = contents[0]
+                    if r < len(rooms) and d < len(rooms[r].devices):
+                        self.ids[where] = rooms[r].devices[d].id
+                id = self.ids.get(where)
+                if id is not None:
+                    self.index.setdefault((id, attribute), []).append(rule)
+
+    def floor_changed(self, floor, rooms=None):
+        self.reindex()
+
+    def evaluate(self, rule):
+        start = perf_counter()
+        result = rule.check()
+        rule.seconds += perf_counter() - start
+        rule.evaluations += 1
+        return result
+
+    def changed(self, device, attribute, value, previous=None):
+        '''
+        Registry watcher, called for every attribute change. Only notes
+        which rules to evaluate; settle() evaluates them.
+        '''
+        rules = self.index.get((device.id, attribute))
+        if rules:
+            self.pending.append((rules, self.depth + 1))
+
+    def settle(self):
+        '''
+        Registry hook, called once a change has reached every watcher.
+        '''
+        if self.pending and not self.draining:
+            self.drain()
+
+    def drain(self):
+        self.draining = True
+        try:
+            while self.pending or self.queue:
+                while self.pending:
+                    rules, depth = self.pending.popleft()
+                    for rule in rules:
+                        result = self.evaluate(rule)
+                        if result and not rule.last:
+                            self.queue.append((rule, depth))
+                        rule.last = result
+                if not self.queue:
+                    break
+                rule, depth = self.queue.popleft()
+                if depth > self.maxDepth:
+                    self.suppress(rule, f'cascade deeper than {self.maxDepth}')
+                elif rule in self.firedInCascade:
+                    self.suppress(rule, 'already fired in this cascade')
+                elif not self.within_rate(rule):
+                    self.suppress(rule, f'fired over {self.maxRate} times in a second')
+                else:
+                    self.firedInCascade.add(rule)
+                    self.depth = depth
+                    self.fire(rule)
+        finally:
+            self.draining = False
+            self.depth = 0
+            self.firedInCascade.clear()
+
+    def within_rate(self, rule):
+        now = self.clock()
+        recent = rule.recent
+        while recent and now - recent[0] >= 1.0:
+            recent.popleft()
+        if len(recent) >= self.maxRate:
+            return False
+        recent.append(now)
+        return True
+
+    def suppress(self, rule, why):
+        rule.suppressed += 1
+        log.warning('Rule %s not run: %s', rule.name, why)
+
+    def fire(self, rule):
+        house = self.house
+        registry = house.registry
+        rule.fired += 1
+        for action in rule.actions:
+            device = self.device(action.device)
+            if device is None:
+                log.warning('Rule %s: device at %s is gone', rule.name, action.device)
+                continue
+            house.command(device, action.attribute, action.value)
+            house.log_event(f'{rule.name}: {device.name} {action.attribute} set to {action.value}',
+                            device, registry.room_of(device))
+
+    def stats(self):
+        return {rule.name: rule.stats() for rule in self.rules}
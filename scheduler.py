@@ -0,0 +1,391 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+scheduler.py: Timed device actions and scenes
+
+Timers sit in a heap ordered by deadline. Nothing is checked per frame:
+the scheduler arms a one-shot pygame timer for the earliest deadline and
+the main loop calls run_due() when SCHEDULE_DUE arrives. Everything due
+at once is applied through House.batch, one batch per description, so
+a thousand lights going off at 23:00 is one log entry and one redraw.
+'''
+import heapq
+import json
+import logging
+from datetime import datetime, timedelta
+from time import time
+
+import pygame
+
+log = logging.getLogger(__name__)
+
+# Posted by the pygame timer when the earliest deadline comes up
+SCHEDULE_DUE = pygame.event.custom_type()
+
+class Action(object):
+    '''
+    Something a timer does. fire() queues mutations on batch (a
+    DeviceBatch) and returns seconds until it wants to fire again, or
+    None. Actions with the same desc that are due together share a
+    batch.
+    '''
+    desc = 'Scheduled action'
+
+    def fire(self, house, batch):
+        raise NotImplementedError
+
+def command(house, attribute, value):
+    return lambda device: house.command(device, attribute, value)
+
+class Command(Action):
+    '''
+    Sets one attribute of one device. Holds the device itself, so it's
+    for devices that stay loaded; use a Scene for anything saved.
+    '''
+    def __init__(self, device, attribute, value, desc=None):
+        self.device = device
+        self.attribute = attribute
+        self.value = value
+        self.desc = desc or f'Set {device.name} {attribute} to {value}'
+
+    def fire(self, house, batch):
+        device = self.device
+        if device.attributes.get(self.attribute) != self.value:
+            batch.apply(device, house.registry.room_of(device),
+                        command(house, self.attribute, self.value))
+
+def house_ids(house, floor, deviceClass, attribute):
+    '''
+    Ids on a loaded floor of deviceClass (None for any) that have
+    attribute.
+    '''
+    registry = house.registry
+    ids = registry.byFloor.get(floor, ())
+    if deviceClass is not None:
+        ofType = set()
+        for cls, members in registry.byType.items():
+            if issubclass(cls, deviceClass):
+                ofType |= members
+        ids = ofType.intersection(ids)
+    devices = registry.devices
+    return sorted(id for id in ids if attribute in devices[id].attributes)
+
+class SetAll(Action):
+    '''
+    Sets attribute to value on every device of deviceClass in the house,
+    eg every light off. Floors are loaded one at a time; devices that
+    already have the value aren't touched.
+    '''
+    def __init__(self, attribute, value, deviceClass=None, desc=None):
+        self.attribute = attribute
+        self.value = value
+        self.deviceClass = deviceClass
+        self.desc = desc or f'Set {attribute} to {value} everywhere'
+
+    def fire(self, house, batch):
+        registry = house.registry
+        mutation = command(house, self.attribute, self.value)
+        column = registry.columns.get(self.attribute)
+        for floor in house.stream_floors():
+            ids = house_ids(house, floor, self.deviceClass, self.attribute)
+            if column is not None:
+                same = set(registry.where(self.attribute, self.value, ids))
+                ids = [id for id in ids if id not in same]
+            else:
+                ids = [id for id in ids if registry.devices[id].attributes[self.attribute] != self.value]
+            for id in ids:
+                batch.apply(registry.devices[id], registry.rooms[id], mutation)
+            batch.flush()
+
+class Fade(Action):
+    '''
+    Moves attribute towards target over duration seconds in steps, eg
+    dimming to 30% over 10 minutes. Each step covers an equal share of
+    what's left, so a device that was changed by hand meanwhile still
+    ends up at target on time.
+    '''
+    def __init__(self, attribute, target, duration, steps=10, deviceClass=None, desc=None):
+        self.attribute = attribute
+        self.target = target
+        self.interval = duration / steps
+        self.steps = steps
+        self.left = steps
+        self.deviceClass = deviceClass
+        self.desc = desc or f'Fading {attribute} to {target}'
+
+    def fire(self, house, batch):
+        registry = house.registry
+        left = self.left
+        for floor in house.stream_floors():
+            for id in house_ids(house, floor, self.deviceClass, self.attribute):
+                device = registry.devices[id]
+                current = device.attributes[self.attribute]
+                value = round(current + (self.target - current) / left)
+                if value != current:
+                    batch.apply(device, registry.rooms[id], command(house, self.attribute, value))
+            batch.flush()
+        self.left -= 1
+        if self.left:
+            return self.interval
+        # Ready for the next run, eg the next day's with Scheduler.daily
+        self.left = self.steps
+        return None
+
+class Scene(Action):
+    '''
+    Stored attribute values for particular devices, eg "Movie night".
+
+    diffs is {floor index: [(room index, device index, device name,
+    {attribute: value}), ...]}. Devices are found by position rather
+    than registry id because ids change when a lazy floor is loaded
+    again; the name is checked to catch rooms that were rearranged.
+    Only floors with something in the scene are loaded.
+    '''
+    def __init__(self, name, diffs=None):
+        self.name = name
+        self.diffs = diffs if diffs is not None else {}
+
+    @property
+    def desc(self):
+        return f'Scene {self.name}'
+
+    @classmethod
+    def capture(cls, name, house, attributes=('on', 'intensity')):
+        '''
+        Scene that puts every device back how it is now.
+        '''
+        scene = cls(name)
+        for f, floor in enumerate(house.stream_floors()):
+            for r, room in enumerate(floor.rooms):
+                for d, device in enumerate(room.devices):
+                    values = {attribute: device.attributes[attribute]
+                              for attribute in attributes if attribute in device.attributes}
+                    if values:
+                        scene.diffs.setdefault(f, []).append((r, d, device.name, values))
+        return scene
+
+    def set(self, house, device, **values):
+        '''
+        Adds values for a loaded device to the scene.
+        '''
+        registry = house.registry
+        floor = registry.floor_of(device)
+        room = registry.room_of(device)
+        f = house.floors.index(floor)
+        r = floor.rooms.index(room)
+        d = room.devices.index(device)
+        entries = self.diffs.setdefault(f, [])
+        for er, ed, name, existing in entries:
+            if (er, ed) == (r, d):
+                existing.update(values)
+                return
+        entries.append((r, d, device.name, dict(values)))
+
+    def fire(self, house, batch):
+        for f in sorted(self.diffs):
+            rooms = house.floors[f].rooms
+            for r, d, name, values in self.diffs[f]:
+                try:
+                    room = rooms[r]
+                    device = room.devices[d]
+                except IndexError:
+                    device = None
+                if device is None or device.name != name:
+                    log.warning('%s: no device %s at floor %d room %d #%d', self.desc, name, f, r, d)
+                    continue
+                for attribute, value in values.items():
+                    if device.attributes.get(attribute) != value:
+                        batch.apply(device, room, command(house, attribute, value))
+            batch.flush()
+
+    def to_json(self):
+        return {'name': self.name,
+                'diffs': {str(f): [list(entry) for entry in entries] for f, entries in self.diffs.items()}}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data['name'], {int(f): [tuple(entry) for entry in entries]
+                                  for f, entries in data['diffs'].items()})
+
+def load_scenes(path):
+    '''
+    {name: Scene} saved by save_scenes, empty if there's no file.
+    '''
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    return {entry['name']: Scene.from_json(entry) for entry in data}
+
+def save_scenes(scenes, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump([scene.to_json() for scene in scenes.values()], f)
+
+def next_daily(hour, minute, after):
+    '''
+    The next hour:minute local time after the timestamp after.
+    '''
+    now = datetime.fromtimestamp(after)
+    when = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if when <= now:
+        when += timedelta(days=1)
+    return when.timestamp()
+
+class Timer(object):
+    '''
+    A scheduled action. repeat, if set, takes the deadline just fired
+    and returns the next one.
+    '''
+    __slots__ = ('when', 'action', 'repeat', 'cancelled')
+
+    def __init__(self, when, action, repeat=None):
+        self.when = when
+        self.action = action
+        self.repeat = repeat
+        self.cancelled = False
+
+class Scheduler(object):
+    '''
+    Runs Actions at wall clock times.
+
+    Timers are kept in a heap of (deadline, seq, timer). Cancelling only
+    flags the timer; flagged ones are skipped when they reach the top,
+    and the heap is rebuilt without them once they're over half of it.
+
+    arm(seconds) is called whenever the earliest deadline changes, with
+    None when there's nothing left. By default it sets a one-shot pygame
+    timer that posts SCHEDULE_DUE.
+    '''
+    # pygame timers take milliseconds as a C int; longer waits just
+    # wake up, find nothing due and arm again
+    longestWait = 3600.0
+
+    def __init__(self, house, clock=time, arm=None):
+        self.house = house
+        self.clock = clock
+        self.arm = arm if arm is not None else self.arm_pygame
+        self.heap = []
+        self.seq = 0
+        self.cancelled = 0
+        self.armedFor = None
+        self.scenes = {}
+        self.counts = {'scheduled': 0, 'cancelled': 0, 'fired': 0, 'batches': 0, 'failed': 0}
+
+    def __len__(self):
+        return len(self.heap) - self.cancelled
+
+    def at(self, when, action, repeat=None):
+        timer = Timer(when, action, repeat)
+        self.push(timer)
+        self.counts['scheduled'] += 1
+        if self.armedFor is None or when < self.armedFor:
+            self.rearm()
+        return timer
+
+    def after(self, delay, action, repeat=None):
+        return self.at(self.clock() + delay, action, repeat)
+
+    def every(self, interval, action):
+        return self.after(interval, action, lambda when: when + interval)
+
+    def daily(self, hour, minute, action):
+        '''
+        Fires every day at hour:minute local time.
+        '''
+        repeat = lambda when: next_daily(hour, minute, when)
+        return self.at(repeat(self.clock()), action, repeat)
+
+    def push(self, timer):
+        self.seq += 1
+        heapq.heappush(self.heap, (timer.when, self.seq, timer))
+
+    def cancel(self, timer):
+        if timer.cancelled:
+            return
+        timer.cancelled = True
+        self.cancelled += 1
+        self.counts['cancelled'] += 1
+        if self.cancelled > len(self.heap) // 2:
+            self.heap = [entry for entry in self.heap if not entry[2].cancelled]
+            heapq.heapify(self.heap)
+            self.cancelled = 0
+
+    def next_deadline(self):
+        heap = self.heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+            self.cancelled -= 1
+        return heap[0][0] if heap else None
+
+    def run_due(self, now=None):
+        '''
+        Fires every timer that's due, sharing a batch between actions
+        with the same desc. Returns how many fired.
+        '''
+        if now is None:
+            now = self.clock()
+        due = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            timer = heapq.heappop(heap)[2]
+            if timer.cancelled:
+                self.cancelled -= 1
+                continue
+            due.append(timer)
+
+        byDesc = {}
+        for timer in due:
+            byDesc.setdefault(timer.action.desc, []).append(timer)
+
+        for desc, timers in byDesc.items():
+            with self.house.batch(desc) as batch:
+                for timer in timers:
+                    again = None
+                    try:
+                        again = timer.action.fire(self.house, batch)
+                    except Exception:
+                        self.counts['failed'] += 1
+                        log.exception('Scheduled action %s failed', desc)
+                    if again is not None:
+                        timer.when = now + again
+                        self.push(timer)
+                    elif timer.repeat is not None:
+                        # From now if we're late, so missed days aren't
+                        # all caught up on at once
+                        timer.when = timer.repeat(max(timer.when, now))
+                        self.push(timer)
+            self.counts['batches'] += 1
+        self.counts['fired'] += len(due)
+
+        self.rearm()
+        return len(due)
+
+    def rearm(self):
+        deadline = self.next_deadline()
+        self.armedFor = deadline
+        if deadline is None:
+            self.arm(None)
+        else:
+            self.arm(min(self.longestWait, max(0.0, deadline - self.clock())))
+
+    def arm_pygame(self, seconds):
+        if seconds is None:
+            pygame.time.set_timer(SCHEDULE_DUE, 0)
+        else:
+            pygame.time.set_timer(SCHEDULE_DUE, max(1, int(seconds * 1000) + 1), 1)
+
+    def close(self):
+        self.arm(None)
+
+    def stats(self):
+        stats = dict(self.counts)
+        stats['pending'] = len(self)
+        return stats
@@ -14,32 +14,43 @@ Screen classes
 
 Split off Nov 24
 '''
+import logging
+
 import pygame
 import pygame_gui
 from pygame_gui.core import ObjectID
-from pygame_gui.elements import UIButton, UILabel, UIScrollingContainer
+from pygame_gui.elements import UIButton, UILabel
 
-from time import strftime, gmtime
+from collections import OrderedDict
 
-class Screen(object):
+from actions import Navigate, ChangeFloor, OpenRoom, OpenDevice, Control, HouseCommand, Zoom
+from widgets import VirtualList, DeviceList, FloorPlanView, Sparkline
+
+log = logging.getLogger(__name__)
+
+class CommonElements(object):
     '''
-    Creates UI elements, which will be discarded when the GC
-    discards this object.
+    Clock, battery and navbar shared by every screen.
+    Created once when the app starts rather than once per screen.
+    The clock and battery are kept up to date by statusbar.StatusBar.
     '''
     def __init__(self, manager):
         self.manager = manager
         self.elems = {}
-        self.createCommonElements()
+        self.actions = {}
         self.create()
-    
-    def createCommonElements(self):
+
+    def register(self, elem, action):
+        self.actions[elem] = action
+
+    def create(self):
         self.elems["clock"] = UILabel(
             relative_rect=pygame.Rect((0, 0), (100, 50)),
-            text=strftime('%H:%M', gmtime())
+            text=''
         )
         self.elems["battery"] = UILabel(
             relative_rect=pygame.Rect((240, 0), (50, 50)),
-            text='98%'
+            text=''
         )
 
         navbar_x, navbar_y = 0, 525
@@ -72,9 +83,172 @@ class Screen(object):
             object_id = ObjectID(class_id='@navbar_button')
         )
 
+        for target in ('home', 'rooms', 'activity', 'addnew'):
+            self.register(self.elems[target], Navigate(target))
+
+class Screen(object):
+    '''
+    Creates UI elements. Screens are kept around by ScreenCache and
+    hidden/shown when navigating; destroy() kills their elements.
+
+    The clock, battery and navbar live in a CommonElements object which
+    is shared by all screens and is not part of self.elems.
+
+    Interactive elements are registered in self.actions with a typed
+    action from actions.py, which DashDemo uses to dispatch clicks.
+    '''
+    def __init__(self, manager, common):
+        self.manager = manager
+        self.common = common
+        self.elems = {}
+        self.actions = {}
+        self.visible = True
+        self.create()
+
+    def register(self, elem, action):
+        self.actions[elem] = action
+
     def create(self):
         raise NotImplementedError('Screen is an abstract class!')
 
+    def show(self):
+        self.visible = True
+        for elem in self.elems.values():
+            elem.show()
+
+    def hide(self):
+        self.visible = False
+        for elem in self.elems.values():
+            elem.hide()
+
+    def devices_changed(self, house, devices):
+        '''
+        Called once after a batch of device changes commits while this
+        screen is showing. Screens that show device state override this.
+        '''
+        pass
+
+    def history_changed(self):
+        '''
+        Called when telemetry has rolled up new history. Screens that
+        graph history override this.
+        '''
+        pass
+
+    def usage_changed(self):
+        '''
+        Called every usage.Usage.tickInterval. Screens that show usage
+        totals override this.
+        '''
+        pass
+
+    def handle_input(self, event):
+        '''
+        Raw mouse events, for screens with widgets that need them.
+        '''
+        pass
+
+    def destroy(self):
+        for elem in self.elems.values():
+            elem.kill()
+        self.elems = {}
+        self.actions = {}
+
+    def element_count(self):
+        # Lists count the rows they've built
+        return sum(elem.element_count() if hasattr(elem, 'element_count') else 1
+                   for elem in self.elems.values())
+
+class ScreenCache(object):
+    '''
+    Keeps screens alive between visits, keyed by screen class and the
+    parameters it was built for (floor, room).
+
+    The active screen is shown and every other cached screen is hidden.
+    When the total number of elements goes over budget, the least recently
+    shown screens are destroyed until it fits again.
+    '''
+    def __init__(self, manager, common, budget=400):
+        self.manager = manager
+        self.common = common
+        self.budget = budget
+        self.screens = OrderedDict()
+        self.active = None
+
+        # The active screen was discarded, so destroy it once it's replaced
+        self.activeDiscarded = False
+
+    def show(self, screenClass, *params):
+        '''
+        Shows the screen for screenClass and params, creating it if needed.
+        Returns (screen, created) so the caller knows whether to fill it in.
+        '''
+        key = (screenClass,) + params
+        screen = self.screens.get(key)
+        created = screen is None
+
+        if self.active is not None and self.active is not screen:
+            if self.activeDiscarded:
+                self.active.destroy()
+            else:
+                self.active.hide()
+        self.activeDiscarded = False
+
+        if created:
+            screen = screenClass(self.manager, self.common)
+            self.screens[key] = screen
+        else:
+            self.screens.move_to_end(key)
+            screen.show()
+
+        self.active = screen
+        self.evict()
+        return screen, created
+
+    def element_count(self):
+        return sum(screen.element_count() for screen in self.screens.values())
+
+    def evict(self):
+        '''
+        Destroys least recently used screens until under budget.
+        Never evicts the active screen.
+        '''
+        while self.element_count() > self.budget:
+            key = next(iter(self.screens))
+            if self.screens[key] is self.active:
+                break
+            self.screens.pop(key).destroy()
+
+    def discard(self, screenClass, *params):
+        '''
+        Forgets a screen. The active screen stays up until show() replaces
+        it, and is destroyed then.
+        '''
+        screen = self.screens.pop((screenClass,) + params, None)
+        if screen is None:
+            return
+        if screen is self.active:
+            self.activeDiscarded = True
+        else:
+            screen.destroy()
+
+    def discard_for(self, params):
+        '''
+        Discards every screen built for any of params, eg a list of rooms.
+        '''
+        params = set(params)
+        for key in [key for key in self.screens if params.intersection(key[1:])]:
+            self.discard(*key)
+
+    def clear(self):
+        for screen in self.screens.values():
+            screen.destroy()
+        if self.activeDiscarded:
+            self.active.destroy()
+        self.screens.clear()
+        self.active = None
+        self.activeDiscarded = False
+
 class HomeScreen(Screen):
     def create(self):
         
@@ -90,6 +264,7 @@ class HomeScreen(Screen):
             manager=self.manager,
             object_id = ObjectID(class_id='@turnoffall_button')
         )
+        self.register(self.elems["viewroomsbutton"], Navigate('rooms'))
 
         # Quick access section
         self.elems["quickaccess"] = UILabel(
@@ -131,6 +306,17 @@ class HomeScreen(Screen):
             manager=self.manager,
             object_id = ObjectID(class_id='@quickdevice')
         )
+        self.register(self.elems["viewall"], Navigate('activity'))
+
+        self.elems["recent0"] = UILabel(
+            relative_rect=pygame.Rect((20, 290), (260, 30)),
+            text=''
+        )
+        self.elems["recent1"] = UILabel(
+            relative_rect=pygame.Rect((20, 320), (260, 30)),
+            text=''
+        )
+
         # Master switch section
         self.elems["masterswitch"] = UILabel(
             relative_rect=pygame.Rect((20, 350), (100, 50)),
@@ -143,8 +329,65 @@ class HomeScreen(Screen):
             manager=self.manager,
             object_id = ObjectID(class_id='@turnoffall_button')
         )
+        self.register(self.elems["turnoffall"], HouseCommand('turnoffall'))
 
+        # Usage section, filled in by draw_usage
+        self.elems["floorusage"] = UILabel(
+            relative_rect=pygame.Rect((20, 455), (260, 30)),
+            text=''
+        )
+        self.elems["houseusage"] = UILabel(
+            relative_rect=pygame.Rect((20, 485), (260, 30)),
+            text=''
+        )
+        self.usage = None
+        self.floor = None
+
+    def devices_changed(self, house, devices):
+        self.draw_recent(house.log)
+        self.usage_changed()
+
+    def draw_usage(self, usage, floor):
+        '''
+        Shows lights on for floor and power and energy for the house, read
+        straight from usage.Usage's totals.
+        '''
+        self.usage = usage
+        self.floor = floor
+        self.usage_changed()
+
+    def usage_changed(self):
+        usage = self.usage
+        if usage is None or not self.visible:
+            return
+        totals = usage.floor(self.floor)
+        if totals is None:
+            text = f'{self.floor.name}: not loaded'
+        else:
+            text = f'{self.floor.name}: {totals.on} on'
+            if totals.lit:
+                text += f', avg {totals.average_intensity():.0f}%'
+        self.set_label("floorusage", text)
+
+        total = usage.house_totals()
+        text = f'{total.on} on, {total.watts:.0f} W, {total.energy_wh(usage.clock()) / 1000:.2f} kWh'
+        if not usage.complete():
+            text = 'Loaded floors: ' + text
+        self.set_label("houseusage", text)
 
+    def set_label(self, name, text):
+        label = self.elems[name]
+        if label.text != text:
+            label.set_text(text)
+
+    def draw_recent(self, log):
+        '''
+        Fills the Recent Activity rows with the newest log entries.
+        '''
+        recent = log.newest(2)
+        for i in range(2):
+            text = recent[i][1] if i < len(recent) else ''
+            self.elems[f"recent{i}"].set_text(text)
 
 class AddNewScreen(Screen):
     def create(self):
@@ -152,13 +395,13 @@ class AddNewScreen(Screen):
             relative_rect=pygame.Rect((100, 20), (100, 50)),
             text='Add New'
         )
-        self.elems["turnoffall"] = UIButton(
+        self.elems["newroom"] = UIButton(
             relative_rect=pygame.Rect((50, 200), (200, 80)),
             text='New Room',
             manager=self.manager,
             object_id = ObjectID(class_id='@turnoffall_button')
         )
-        self.elems["turnoffall"] = UIButton(
+        self.elems["newdevice"] = UIButton(
             relative_rect=pygame.Rect((50, 400), (200, 80)),
             text='New Device',
             manager=self.manager,
@@ -190,22 +433,17 @@ class ActivityScreen(Screen):
             text='Activity Log'
         )
 
-        self.elems["log"] = UIScrollingContainer(
+        # Only builds rows for what fits in the view, see widgets.py
+        self.elems["log"] = VirtualList(
             relative_rect=pygame.Rect((25, 100), (250, 400)),
-            manager=self.manager,
-            allow_scroll_x = False
+            manager=self.manager
         )
-        self.elems["log"].set_scrollable_area_dimensions((200, 800))
         
     def draw_logs(self, log):
-        i = 0
-        for time, desc in reversed(log):
-            self.elems[f'logitem{i}'] = UIButton(
-                relative_rect=pygame.Rect((10, 20 + (i* 30)), (250, 30)),
-                text=desc,
-                container = self.elems["log"]
-            )
-            i += 1
+        '''
+        Shows log newest first. Only the visible rows are read.
+        '''
+        self.elems["log"].bind(len(log), lambda i: log[-1 - i][1])
 
 class RoomsScreen(Screen):
     def create(self):
@@ -224,23 +462,52 @@ class RoomsScreen(Screen):
             text='>>'
         )
 
+        self.register(self.elems["prevfloor"], ChangeFloor(-1))
+        self.register(self.elems["nextfloor"], ChangeFloor(1))
+
+        self.elems["zoomout"] = UIButton(
+            relative_rect=pygame.Rect((235, 50), (30, 30)),
+            text='-'
+        )
+        self.elems["zoomin"] = UIButton(
+            relative_rect=pygame.Rect((265, 50), (30, 30)),
+            text='+'
+        )
+        self.register(self.elems["zoomout"], Zoom(0.8))
+        self.register(self.elems["zoomin"], Zoom(1.25))
+
+        # Room buttons are made by the plan for the rooms in view
+        self.layout = None
+        self.names = None
+        self.elems["plan"] = FloorPlanView(
+            relative_rect=pygame.Rect((20, 100), (260, 410)),
+            manager=self.manager,
+            onBind=self.room_bound
+        )
+
     def update(self, floor):
         self.elems["floortitle"].set_text(floor.name)
-        print(f'Set floor title to {floor.name}.')
+        log.debug('Set floor title to %s.', floor.name)
     
-    def label_rooms(self, roomInfo):
-        startPos = (20, 100)
-        roomSize = (75, 75)
-        margin = 2
-        
-        for roomi, v in roomInfo.items():
-            name, gx, gy = v
-            x = startPos[0] + gy*(roomSize[0]+margin)
-            y = startPos[1] + gx*(roomSize[1]+margin)
-            self.elems[f"roombutton{roomi}"] = UIButton(
-                relative_rect=pygame.Rect((x, y), roomSize),
-                text=name
-            )
+    def show_floor(self, layout, names):
+        '''
+        Shows a FloorLayout, names[i] being room i's name. Does nothing if
+        it's already showing the same layout.
+        '''
+        if layout is self.layout and names == self.names:
+            return
+        self.layout = layout
+        self.names = names
+        self.elems["plan"].bind(layout, names)
+
+    def room_bound(self, room, button):
+        self.register(button, OpenRoom(room))
+
+    def zoom(self, factor):
+        self.elems["plan"].zoom_at(factor)
+
+    def handle_input(self, event):
+        self.elems["plan"].handle_input(event)
 
 class RoomScreen(Screen):
     def create(self):
@@ -250,6 +517,7 @@ class RoomScreen(Screen):
             manager=self.manager
             # object_id = ObjectID(class_id='@turnoffall_button')
         )
+        self.register(self.elems["backbutton"], Navigate('rooms'))
         
         self.elems["room"] = UIButton(
             relative_rect=pygame.Rect((50, 100), (200, 200)),
@@ -297,8 +565,14 @@ class RoomScreen(Screen):
                     iconSize),
                 text=device.name[:2]
             )
+            self.register(self.elems[f"devicelabel{i}"], OpenDevice(device.id))
+            self.register(self.elems[f"deviceicon{i}"], OpenDevice(device.id))
 
 class DeviceScreen(Screen):
+    # Seconds of history in the graph, and how many columns it has
+    historyWindow = 3600
+    historyPoints = 60
+
     def create(self):
         self.elems["backbutton"] = UIButton(
             relative_rect=pygame.Rect((20, 50), (80, 40)),
@@ -306,63 +580,121 @@ class DeviceScreen(Screen):
             manager=self.manager
             # object_id = ObjectID(class_id='@turnoffall_button')
         )
+        self.register(self.elems["backbutton"], Navigate('room'))
+        self.elems["historylabel"] = UILabel(
+            relative_rect=pygame.Rect((20, 100), (260, 30)),
+            text=''
+        )
+        self.elems["history"] = Sparkline(
+            relative_rect=pygame.Rect((20, 135), (260, 150)),
+            manager=self.manager
+        )
         self.elems["attributelist"] = UILabel(
             relative_rect=pygame.Rect((50, 300), (100, 50)),
             text='Attribute List'
         )
+
+        # Rows are built as they scroll into view, see widgets.py
+        self.elems["devicelist"] = DeviceList(
+            relative_rect=pygame.Rect((20, 345), (260, 175)),
+            manager=self.manager,
+            onBind=self.row_bound
+        )
+
+        self.devices = []
+        self.telemetry = None
+        self.historyDevice = None
         
     def update(self, room):
         '''
         room: Room object. Should only ever be DashDemo.house.selected_room
         
-        For all devices in the room:
-            - Draws an icon and a label.
-            - Get modifier, use it to draws controls and attribute labels
-                - Add all those controls to elems for handling.
+        Shows a row for every device in the room with its name, controls
+        and attribute labels. The device list only builds the rows in view.
         '''
+        for device in self.devices:
+            device.attributes.unsubscribe(self.attribute_changed)
         
-        # Draw device attributes list
-        # TODO: This only supports one device right now
-        startingPos = (150, 340)
-        labelSize = (150, 50)
-        margin = 2
-        
-        for id, device in enumerate(room.devices):
+        self.devices = list(room.devices)
+        for device in self.devices:
+            # Labels follow the device from now on, see attribute_changed
+            device.attributes.subscribe(self.attribute_changed)
         
-            for i, attribute in enumerate(device.attributes):
-                self.elems[f"label{device.name}-{i}"] = UILabel(
-                    relative_rect=pygame.Rect(
-                        (startingPos[0] + (id + i)*(labelSize[0]+margin),
-                        (startingPos[1]+ (id + i)*(startingPos[1]+margin))),
-                        labelSize),
-                    text=self.attr_text(device.attributes[attribute])
-                )
- 
-            # Draw device controls
-            # TODO: This only supports one control right now
-            modifier = device.get_modifier()
-            modifier.linkManager(self.manager)
-            print(f'linked {device.name}')
-            i=0
-            
-            for name, elem in modifier.uiElements.items():
-                print('set up ' + 'dev' + str(id) + '.' + name)
-                self.elems['dev' + str(id) + '.' + name] = elem
-                elem.set_position((50, 350 + i*(50)))
-                i += 1
-    
-    def attr_text(self, attr):
-        if isinstance(attr, bool):
-            if attr:
-                return 'on'
-            else:
-                return 'off'
-        else:
-            return str(attr)
+        self.elems["devicelist"].bind(self.devices)
     
+    def row_bound(self, modifier):
+        '''
+        Called when the list points a row at a device. Registers the
+        row's controls against that device.
+        '''
+        for name, elem in modifier.uiElements.items():
+            self.register(elem, Control(modifier.device.id, name))
+
+    def attribute_changed(self, device, attribute, value):
+        '''
+        Subscriber for device attribute changes. Only touches the one
+        label that shows the changed attribute, and only if its row is
+        in view. Rows out of view catch up when they're bound.
+        '''
+        if not self.visible:
+            return
+        modifier = self.elems["devicelist"].modifier_for(device)
+        if modifier is not None:
+            modifier.refresh(attribute)
+        if device is self.historyDevice:
+            self.history_changed()
+
+    def show_history(self, telemetry, device=None):
+        '''
+        Graphs device from telemetry, by default the device already shown
+        or the first one in the room with a history.
+        '''
+        self.telemetry = telemetry
+        if device is not None:
+            self.historyDevice = device
+        if self.historyDevice not in self.devices:
+            self.historyDevice = next((device for device in self.devices
+                                       if any(attribute in device.attributes for attribute in telemetry.attributes)),
+                                      None)
+        self.history_changed()
+
+    def history_changed(self):
+        '''
+        Redraws the graph from the rollups, eg after a rollup pass. Only
+        reads about historyPoints buckets, however long the window.
+        '''
+        device = self.historyDevice
+        if not self.visible or device is None or self.telemetry is None:
+            return
+        telemetry = self.telemetry
+        now = telemetry.clock()
+        start = now - self.historyWindow
+        attribute = 'intensity' if 'intensity' in device.attributes else 'on'
+        columns = telemetry.history(device, attribute, start, now, self.historyPoints)
+        self.elems["history"].plot(columns, 0, 100 if attribute == 'intensity' else 1)
+
+        text = f'{device.name} {attribute}'
+        if 'on' in device.attributes:
+            summary = telemetry.summary(device, 'on', start, now)
+            if summary is not None:
+                text = f'{device.name}: on {summary[2]:.0%} of the last hour'
+        if self.elems["historylabel"].text != text:
+            self.elems["historylabel"].set_text(text)
+
+    def show(self):
+        super().show()
+        # Changes that came in while hidden
+        self.elems["devicelist"].refresh()
+        self.history_changed()
+
+    def destroy(self):
+        for device in self.devices:
+            device.attributes.unsubscribe(self.attribute_changed)
+        self.devices = []
+        super().destroy()
+
     def update_labels(self, room):
-        
-        for id, device in enumerate(room.devices):
-            for i, attribute in enumerate(device.attributes):
-                self.elems[f'label{device.name}-{i}'].set_text(self.attr_text(device.attributes[attribute]))
-                print(f'modified text on label{device.name}-{i}')
\ No newline at end of file
+        '''
+        Sets every label in view from scratch.
+        '''
+        self.elems["devicelist"].refresh()
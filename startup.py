@@ -0,0 +1,210 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+startup.py: Getting to the first frame quickly
+
+Only needs pygame, so it can be used before pygame_gui is imported.
+'''
+import json
+import logging
+import os
+import pickle
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+import pygame
+
+log = logging.getLogger(__name__)
+
+class StartupTimings(object):
+    '''
+    When each phase of startup began and ended, in seconds from origin
+    (a perf_counter() reading). Phases can overlap, eg loading on the
+    boot thread while the splash is up, so each keeps its own start.
+    '''
+    def __init__(self, origin=None):
+        self.origin = perf_counter() if origin is None else origin
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def add(self, name, start, end):
+        with self.lock:
+            self.phases.append((name, start - self.origin, end - self.origin))
+
+    @contextmanager
+    def phase(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, start, perf_counter())
+
+    def since_origin(self, name):
+        '''
+        Records a phase from origin until now, eg imports.
+        '''
+        self.add(name, self.origin, perf_counter())
+
+    def mark(self, name):
+        '''
+        Records a moment rather than a phase, eg the first frame.
+        '''
+        now = perf_counter()
+        self.add(name, now, now)
+
+    def done(self):
+        return len(self.phases)
+
+    def report(self):
+        '''
+        [{'phase', 'start_ms', 'ms'}] in the order phases started.
+        '''
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        return [{'phase': name, 'start_ms': round(start * 1000, 2), 'ms': round((end - start) * 1000, 2)}
+                for name, start, end in phases]
+
+    def format(self):
+        lines = ['Startup:']
+        for row in self.report():
+            lines.append(f"  {row['start_ms']:8.1f} ms  {row['ms']:8.1f} ms  {row['phase']}")
+        return '\n'.join(lines)
+
+class ThemeCache(object):
+    '''
+    The theme file parsed and checked once, with its font files made
+    absolute paths, pickled at cachePath. Loaded from there as long as
+    the theme and the fonts it names have the same mtimes, so pygame_gui
+    gets a ready theme dict instead of reading the JSON itself.
+    '''
+    # Bump when what's cached changes
+    version = 1
+
+    fontPaths = ('regular_path', 'bold_path', 'italic_path', 'bold_italic_path')
+
+    def __init__(self, path, cachePath=None):
+        self.path = path
+        self.cachePath = cachePath if cachePath is not None else path + '.cache'
+        self.hit = False
+
+    @staticmethod
+    def mtimes(paths):
+        found = {}
+        for path in paths:
+            try:
+                found[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                found[path] = None
+        return found
+
+    def load(self):
+        cached = self.read_cache()
+        if cached is not None:
+            self.hit = True
+            return cached
+
+        try:
+            theme, sources = self.compile()
+        except OSError as e:
+            # Same as pygame_gui: carry on with its default theme
+            log.warning('Could not read theme %s: %s', self.path, e)
+            return None
+        try:
+            self.write_cache(theme, sources)
+        except OSError as e:
+            log.warning('Could not write theme cache %s: %s', self.cachePath, e)
+        return theme
+
+    def read_cache(self):
+        try:
+            with open(self.cachePath, 'rb') as f:
+                record = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+            return None
+        if not isinstance(record, dict) or record.get('version') != self.version:
+            return None
+        sources = record['sources']
+        if self.mtimes(sources) != sources:
+            return None
+        return record['theme']
+
+    def write_cache(self, theme, sources):
+        record = {'version': self.version, 'sources': sources, 'theme': theme}
+        temp = self.cachePath + '.tmp'
+        with open(temp, 'wb') as f:
+            pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp, self.cachePath)
+
+    def compile(self):
+        '''
+        Returns (theme dict, {source path: mtime}). Font paths are
+        resolved against the theme's directory; ones that don't exist
+        are dropped with a warning so pygame_gui falls back to its
+        default font.
+        '''
+        sources = [os.path.abspath(self.path)]
+        with open(self.path, encoding='utf-8') as f:
+            theme = json.load(f)
+        if not isinstance(theme, dict):
+            raise ValueError(f'{self.path}: theme must be a JSON object')
+
+        base = os.path.dirname(sources[0])
+        for element, block in theme.items():
+            if not isinstance(block, dict):
+                raise ValueError(f'{self.path}: "{element}" must be an object')
+            fonts = block.get('font')
+            if isinstance(fonts, dict):
+                fonts = [fonts]
+            for font in fonts or ():
+                for key in self.fontPaths:
+                    if key not in font:
+                        continue
+                    path = os.path.join(base, font[key])
+                    if not os.path.isfile(path):
+                        log.warning('%s: font file %s for "%s" not found', self.path, path, element)
+                        del font[key]
+                        continue
+                    font[key] = path
+                    sources.append(path)
+        return theme, self.mtimes(sources)
+
+class Splash(object):
+    '''
+    Plain pygame frame shown while everything else loads: the home icon
+    and a bar that fills as loading phases finish.
+    '''
+    icon = 'assets/home.png'
+    barColour = pygame.Color('#4A4F56')
+
+    def __init__(self, surface, background):
+        self.surface = surface
+        self.background = background
+        try:
+            self.image = pygame.image.load(self.icon)
+        except (pygame.error, FileNotFoundError):
+            self.image = None
+
+    def draw(self, progress):
+        '''
+        progress is from 0 to 1.
+        '''
+        surface = self.surface
+        width, height = surface.get_size()
+        surface.blit(self.background, (0, 0))
+        if self.image is not None:
+            surface.blit(self.image, self.image.get_rect(center=(width // 2, height // 2 - 40)))
+        bar = pygame.Rect(0, 0, width // 2, 6)
+        bar.center = (width // 2, height // 2 + 40)
+        pygame.draw.rect(surface, self.barColour, bar, 1)
+        filled = bar.inflate(-2, -2)
+        filled.width = int(filled.width * max(0.0, min(1.0, progress)))
+        surface.fill(self.barColour, filled)
+        pygame.display.update()
@@ -0,0 +1,211 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+statusbar.py: Clock and battery at the top of every screen
+
+The labels themselves are part of CommonElements. StatusBar keeps them
+up to date without a frame having to ask: a pygame timer fires on each
+minute boundary for the clock, and a thread polls a StatusProvider for
+the battery and posts an event when it changes. Setting the label text
+swaps its image, which DirtyTracker picks up as a dirty rect, so only
+the label is redrawn.
+'''
+import logging
+import os
+import threading
+from collections import namedtuple
+from time import time, strftime, gmtime
+
+import pygame
+
+log = logging.getLogger(__name__)
+
+# Fired once per minute boundary, re-armed every time
+CLOCK_TICK = pygame.event.custom_type()
+
+# Posted from the polling thread with a status field when it changes
+STATUS_CHANGED = pygame.event.custom_type()
+
+# battery is a percentage or None if there's no battery to read
+Status = namedtuple('Status', ['battery', 'charging'])
+
+class StatusProvider(object):
+    '''
+    Where battery/system status comes from. read() is called on the
+    polling thread, so it can block.
+    '''
+    def read(self):
+        raise NotImplementedError
+
+class StubStatusProvider(StatusProvider):
+    '''
+    Made up status for running without a battery, eg on a desktop.
+    Drains by drain percent per read, down to 0.
+    '''
+    def __init__(self, battery=98, charging=False, drain=0):
+        self.battery = battery
+        self.charging = charging
+        self.drain = drain
+
+    def read(self):
+        status = Status(self.battery, self.charging)
+        self.battery = max(0, self.battery - self.drain)
+        return status
+
+class SysfsStatusProvider(StatusProvider):
+    '''
+    Reads the first battery under /sys/class/power_supply, as on the
+    Linux panels.
+    '''
+    root = '/sys/class/power_supply'
+
+    def __init__(self, root=None):
+        if root is not None:
+            self.root = root
+        self.path = self.find()
+
+    def find(self):
+        try:
+            names = sorted(os.listdir(self.root))
+        except OSError:
+            return None
+        for name in names:
+            path = os.path.join(self.root, name)
+            if self.field(path, 'type') == 'Battery':
+                return path
+        return None
+
+    @staticmethod
+    def field(path, name):
+        try:
+            with open(os.path.join(path, name)) as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def read(self):
+        if self.path is None:
+            return Status(None, False)
+        capacity = self.field(self.path, 'capacity')
+        state = self.field(self.path, 'status')
+        battery = int(capacity) if capacity is not None and capacity.isdigit() else None
+        return Status(battery, state == 'Charging')
+
+def default_provider():
+    '''
+    The panel's own battery. With no battery it reads Status(None,
+    False) and the label stays empty; use StubStatusProvider explicitly
+    to fake one.
+    '''
+    return SysfsStatusProvider()
+
+class StatusBar(object):
+    '''
+    Keeps the clock and battery labels of a CommonElements current.
+
+    start() arms the clock timer and starts polling; the main loop
+    passes CLOCK_TICK and STATUS_CHANGED events to handle(). attach()
+    points it at new labels, eg after DashDemo.clear().
+    '''
+    clockFormat = '%H:%M'
+
+    # Seconds between battery reads
+    pollInterval = 30.0
+
+    # Timers can fire a little early; aim this far past the boundary
+    slackMs = 5
+
+    events = (CLOCK_TICK, STATUS_CHANGED)
+
+    def __init__(self, common, provider=None, post=None, clock=time):
+        self.provider = provider if provider is not None else default_provider()
+        self.post = post if post is not None else pygame.event.post
+        self.clock = clock
+        self.status = None
+        self.stopping = threading.Event()
+        self.thread = None
+        self.counts = {'ticks': 0, 'clock_updates': 0, 'polls': 0, 'changes': 0}
+        self.attach(common)
+
+    def attach(self, common):
+        self.clockLabel = common.elems['clock']
+        self.batteryLabel = common.elems['battery']
+        self.update_clock()
+        self.update_battery()
+
+    def start(self):
+        self.arm()
+        self.thread = threading.Thread(target=self.poll, name='status', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        pygame.time.set_timer(CLOCK_TICK, 0)
+        if self.thread is not None:
+            self.thread.join()
+
+    def arm(self):
+        '''
+        Sets the clock timer for the next minute boundary.
+        '''
+        now = self.clock()
+        ms = int((60 - now % 60) * 1000) + self.slackMs
+        pygame.time.set_timer(CLOCK_TICK, ms, 1)
+
+    def handle(self, event):
+        if event.type == CLOCK_TICK:
+            self.counts['ticks'] += 1
+            self.update_clock()
+            self.arm()
+        elif event.type == STATUS_CHANGED:
+            self.status = event.status
+            self.update_battery()
+
+    def update_clock(self):
+        text = strftime(self.clockFormat, gmtime(self.clock()))
+        if self.clockLabel.text != text:
+            self.clockLabel.set_text(text)
+            self.counts['clock_updates'] += 1
+
+    def battery_text(self):
+        status = self.status
+        if status is None or status.battery is None:
+            return ''
+        text = f'{status.battery}%'
+        if status.charging:
+            text += '+'
+        return text
+
+    def update_battery(self):
+        text = self.battery_text()
+        if self.batteryLabel.text != text:
+            self.batteryLabel.set_text(text)
+
+    def poll(self):
+        '''
+        Polling thread. Reads straight away, then every pollInterval.
+        '''
+        last = None
+        while True:
+            try:
+                status = self.provider.read()
+                self.counts['polls'] += 1
+            except Exception as e:
+                log.warning('Reading status failed: %s', e)
+                status = last
+            if status != last:
+                last = status
+                self.counts['changes'] += 1
+                self.post(pygame.event.Event(STATUS_CHANGED, status=status))
+            if self.stopping.wait(self.pollInterval):
+                return
+
+    def stats(self):
+        return dict(self.counts)
@@ -0,0 +1,508 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+store.py: Saving and loading the house
+
+A house is kept as a binary snapshot plus a change log next to it:
+    house.snap          header, device types, floor directory, then one
+                        block per floor, so a floor can be read alone
+    house.snap.changes  attribute edits since the snapshot, appended on
+                        save so saving doesn't rewrite the whole house
+
+Devices are addressed by (floor, room, position in room) in both files.
+Once the change log gets big compared to the snapshot, saving writes a
+new snapshot instead.
+
+Snapshot layout (little endian, str = u16 length + utf-8):
+    'HDSN' u16 version u16 floors
+    u16 types, per type: str class name, u16 attributes, str each
+    per floor: str name, u64 offset, u32 length, u32 devices
+    floor blocks, offsets from the end of the header:
+        u16 rows, u16 cols, i16 grid cell (-1 for no room) each
+        u16 rooms, per room: str name, u16 w, u16 h, u32 devices
+            per device: u16 type, u16 name length, u16 icon length,
+                        name, icon, a value per type attribute, u16 extras,
+                        per extra: str name, value
+    value = u8 tag + payload, see VALUE_* below
+'''
+import mmap
+import os
+import struct
+
+from device import Device, Light
+from house import House, Floor, LazyFloor, Room
+
+MAGIC = b'HDSN'
+VERSION = 1
+
+HEADER = struct.Struct('<4sHH')
+ROWS_COLS = struct.Struct('<HH')
+FLOOR = struct.Struct('<QII')
+ROOM = struct.Struct('<HHI')
+DEVICE = struct.Struct('<HHH')
+CHANGE = struct.Struct('<HHI')
+
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+I16 = struct.Struct('<h')
+I64 = struct.Struct('<q')
+F64 = struct.Struct('<d')
+
+VALUE_NONE = 0
+VALUE_FALSE = 1
+VALUE_TRUE = 2
+VALUE_INT = 3
+VALUE_FLOAT = 4
+VALUE_STR = 5
+
+class Writer(object):
+    '''
+    Packs the snapshot's field types into a bytearray.
+    '''
+    def __init__(self):
+        self.data = bytearray()
+
+    def pack(self, fmt, *values):
+        self.data += fmt.pack(*values)
+
+    def str(self, text):
+        data = text.encode('utf-8')
+        self.data += U16.pack(len(data))
+        self.data += data
+
+    def value(self, value):
+        if value is None:
+            self.pack(U8, VALUE_NONE)
+        elif value is True:
+            self.pack(U8, VALUE_TRUE)
+        elif value is False:
+            self.pack(U8, VALUE_FALSE)
+        elif isinstance(value, int):
+            self.pack(U8, VALUE_INT)
+            self.pack(I64, value)
+        elif isinstance(value, float):
+            self.pack(U8, VALUE_FLOAT)
+            self.pack(F64, value)
+        elif isinstance(value, str):
+            self.pack(U8, VALUE_STR)
+            self.str(value)
+        else:
+            raise TypeError(f'Cannot save attribute value {value!r}')
+
+class Reader(object):
+    '''
+    Reads the snapshot's field types from a buffer, moving forward.
+    '''
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def unpack(self, fmt):
+        values = fmt.unpack_from(self.data, self.pos)
+        self.pos += fmt.size
+        return values
+
+    def one(self, fmt):
+        return self.unpack(fmt)[0]
+
+    def str(self):
+        n = self.one(U16)
+        if self.pos + n > len(self.data):
+            raise ValueError(f'String runs past the end of the data at {self.pos}')
+        text = bytes(self.data[self.pos:self.pos + n]).decode('utf-8')
+        self.pos += n
+        return text
+
+    def value(self):
+        tag = self.one(U8)
+        if tag == VALUE_NONE:
+            return None
+        if tag == VALUE_TRUE:
+            return True
+        if tag == VALUE_FALSE:
+            return False
+        if tag == VALUE_INT:
+            return self.one(I64)
+        if tag == VALUE_FLOAT:
+            return self.one(F64)
+        if tag == VALUE_STR:
+            return self.str()
+        raise ValueError(f'Bad value tag {tag} at {self.pos - 1}')
+
+class HouseStore(object):
+    '''
+    Snapshot and change log for one house.
+
+    open() only reads the header and the change log; load_floor() reads
+    one floor's block when it's needed. track() watches a house's
+    devices so save() only has to write the attributes that changed.
+    '''
+
+    # Device classes that can be saved, by class name
+    deviceTypes = {cls.__name__: cls for cls in (Device, Light)}
+
+    # Change log size, as a fraction of the snapshot, that makes save()
+    # write a new snapshot instead
+    compactRatio = 0.5
+
+    # With readOnly, save() keeps changes in memory for floors loaded
+    # later but never writes, eg for panels that share a hub's snapshot
+    readOnly = False
+
+    def __init__(self, path='house.snap'):
+        self.path = path
+        self.changesPath = path + '.changes'
+
+        self.data = None
+        self.types = []
+        self.floorNames = []
+        self.floorIndex = []
+
+        # floor -> [(room, position, attribute, value)] from the change log
+        self.changes = {}
+
+        # device id -> (floor, room, position) for tracked devices
+        self.addresses = {}
+        self.dirty = {}
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    # Reading
+
+    def open(self):
+        '''
+        Reads the header and the change log. Floors aren't read yet.
+        '''
+        self.close()
+        with open(self.path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        reader = Reader(self.data)
+        magic, version, nFloors = reader.unpack(HEADER)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.path} is not a version {VERSION} house snapshot')
+
+        self.types = []
+        for t in range(reader.one(U16)):
+            name = reader.str()
+            names = [reader.str() for a in range(reader.one(U16))]
+            deviceClass = self.deviceTypes[name]
+            # Schema position of each saved attribute, None if the class
+            # no longer has it in its schema
+            slots = [deviceClass.schema.index.get(name) for name in names]
+            self.types.append((deviceClass, names, slots))
+
+        self.floorNames = []
+        self.floorIndex = []
+        for f in range(nFloors):
+            self.floorNames.append(reader.str())
+            self.floorIndex.append(reader.unpack(FLOOR))
+        self.start = reader.pos
+
+        self.read_changes()
+
+    def read_changes(self):
+        '''
+        Groups the change log by floor. Cuts off a half-written record
+        left by a crash.
+        '''
+        self.changes = {}
+        if not os.path.exists(self.changesPath):
+            return
+        with open(self.changesPath, 'rb') as f:
+            data = f.read()
+
+        reader = Reader(data)
+        good = 0
+        while reader.pos < len(data):
+            try:
+                floor, room, position = reader.unpack(CHANGE)
+                attribute = reader.str()
+                value = reader.value()
+            except (struct.error, ValueError, UnicodeDecodeError):
+                break
+            self.changes.setdefault(floor, []).append((room, position, attribute, value))
+            good = reader.pos
+
+        if good < len(data):
+            with open(self.changesPath, 'r+b') as f:
+                f.truncate(good)
+
+    def __len__(self):
+        return len(self.floorIndex)
+
+    def device_count(self, floor=None):
+        '''
+        Devices on one floor, or in the house, without loading anything.
+        '''
+        if floor is None:
+            return sum(count for offset, length, count in self.floorIndex)
+        return self.floorIndex[floor][2]
+
+    def load_floor(self, index):
+        '''
+        Builds floor number index from its block and applies the change
+        log to it. Returns (floor, [(device, room), ...]); the rooms are
+        empty until the devices are added to a house with add_device.
+        '''
+        offset, length, count = self.floorIndex[index]
+        reader = Reader(self.data, self.start + offset)
+
+        rows, cols = reader.unpack(ROWS_COLS)
+        cells = reader.unpack(struct.Struct(f'<{rows * cols}h')) if rows * cols else ()
+        grid = [[cell if cell >= 0 else None for cell in cells[r * cols:(r + 1) * cols]]
+                for r in range(rows)]
+
+        data = self.data
+        rooms = []
+        roomDevices = []
+        placed = []
+        for r in range(reader.one(U16)):
+            room = Room(reader.str())
+            room.w, room.h, nDevices = reader.unpack(ROOM)
+            # The common cases are decoded inline, this runs per device
+            pos = reader.pos
+            for d in range(nDevices):
+                typeId, nameLength, iconLength = DEVICE.unpack_from(data, pos)
+                pos += DEVICE.size
+                name = str(data[pos:pos + nameLength], 'utf-8')
+                pos += nameLength
+                icon = str(data[pos:pos + iconLength], 'utf-8')
+                pos += iconLength
+
+                deviceClass, names, slots = self.types[typeId]
+                device = deviceClass(name, icon)
+                attributes = device.attributes
+                values = attributes.values
+                for name, i in zip(names, slots):
+                    tag = data[pos]
+                    if tag == VALUE_TRUE:
+                        value = True
+                        pos += 1
+                    elif tag == VALUE_FALSE:
+                        value = False
+                        pos += 1
+                    elif tag == VALUE_INT:
+                        value = I64.unpack_from(data, pos + 1)[0]
+                        pos += 1 + I64.size
+                    else:
+                        reader.pos = pos
+                        value = reader.value()
+                        pos = reader.pos
+                    if i is not None:
+                        values[i] = value
+                    else:
+                        attributes[name] = value
+
+                reader.pos = pos
+                for e in range(reader.one(U16)):
+                    name = reader.str()
+                    attributes[name] = reader.value()
+                pos = reader.pos
+                placed.append((device, room))
+            rooms.append(room)
+            roomDevices.append(placed[len(placed) - nDevices:])
+
+        for r, position, attribute, value in self.changes.get(index, ()):
+            roomDevices[r][position][0].attributes[attribute] = value
+
+        # Nothing loaded counts as changed
+        for device, room in placed:
+            device.attributes.take_dirty()
+
+        return Floor(self.floorNames[index], rooms, grid), placed
+
+    def load_house(self, floors=None, lazy=False, **houseArgs):
+        '''
+        Builds a House from the snapshot. floors is the floor numbers to
+        load, all of them by default. With lazy, the house gets LazyFloor
+        handles and only loads a floor when it's used. houseArgs go to
+        House, eg journal.
+        '''
+        if self.data is None:
+            self.open()
+
+        if lazy:
+            handles = [LazyFloor(self.floorNames[f], f, self.device_count(f))
+                       for f in range(len(self))]
+            return House(floors=handles, store=self, **houseArgs)
+
+        if floors is None:
+            floors = range(len(self))
+
+        loaded = [self.load_floor(f) for f in floors]
+        house = House(floors=[floor for floor, placed in loaded], **houseArgs)
+        for floor, placed in loaded:
+            for device, room in placed:
+                house.add_device(device, room, floor)
+        return house
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+
+    # Writing
+
+    def write_snapshot(self, house):
+        '''
+        Writes the whole house to a new snapshot and empties the change
+        log. The old snapshot is only replaced once the new one is on disk.
+        '''
+        typeIds = {}
+        types = Writer()
+        blocks = []
+        for floor in house.floors:
+            contents = floor.contents()
+            if contents is None:
+                # Unloaded lazy floor, copied over through the old snapshot
+                # so its changes are included
+                copy, placed = self.load_floor(floor.index)
+                for device, room in placed:
+                    room.devices.append(device)
+                contents = copy.rooms, copy.grid
+            rooms, grid = contents
+
+            block = Writer()
+            grid = grid or []
+            cols = max((len(row) for row in grid), default=0)
+            block.pack(ROWS_COLS, len(grid), cols)
+            for row in grid:
+                for c in range(cols):
+                    cell = row[c] if c < len(row) else None
+                    block.pack(I16, -1 if cell is None else cell)
+
+            count = 0
+            block.pack(U16, len(rooms))
+            for room in rooms:
+                block.str(room.name)
+                block.pack(ROOM, room.w, room.h, len(room.devices))
+                for device in room.devices:
+                    deviceClass = type(device)
+                    typeId = typeIds.get(deviceClass)
+                    if typeId is None:
+                        typeId = typeIds[deviceClass] = len(typeIds)
+                        types.str(deviceClass.__name__)
+                        types.pack(U16, len(deviceClass.schema.names))
+                        for name in deviceClass.schema.names:
+                            types.str(name)
+
+                    attributes = device.attributes
+                    name = device.name.encode('utf-8')
+                    icon = device.icon.encode('utf-8')
+                    block.pack(DEVICE, typeId, len(name), len(icon))
+                    block.data += name
+                    block.data += icon
+                    for value in attributes.values:
+                        block.value(value)
+                    extra = attributes.extra or {}
+                    block.pack(U16, len(extra))
+                    for name, value in extra.items():
+                        block.str(name)
+                        block.value(value)
+                    count += 1
+            blocks.append((floor.name, block.data, count))
+
+        header = Writer()
+        header.pack(HEADER, MAGIC, VERSION, len(blocks))
+        header.pack(U16, len(typeIds))
+        header.data += types.data
+        offset = 0
+        for name, data, count in blocks:
+            header.str(name)
+            header.pack(FLOOR, offset, len(data), count)
+            offset += len(data)
+
+        reopen = self.data is not None
+        self.close()
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header.data)
+            for name, data, count in blocks:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        if os.path.exists(self.changesPath):
+            os.remove(self.changesPath)
+        self.changes = {}
+        if reopen:
+            self.open()
+
+    def track(self, house):
+        '''
+        Starts recording which of house's devices change, so save() can
+        write just those. Call after the house is loaded. Lazy floors are
+        tracked by the house as it loads them.
+        '''
+        for f, floor in enumerate(house.floors):
+            if floor.contents() is not None and floor not in house.loadedFloors:
+                self.track_floor(house, f, floor)
+
+    def track_floor(self, house, f, floor):
+        for r, room in enumerate(floor.rooms):
+            for position, device in enumerate(room.devices):
+                self.addresses[device.id] = (f, r, position)
+                device.attributes.take_dirty()
+                device.attributes.subscribe(self.changed)
+
+    def untrack(self, device):
+        '''
+        Stops tracking a device, eg when its floor is unloaded. Save first.
+        '''
+        device.attributes.unsubscribe(self.changed)
+        self.addresses.pop(device.id, None)
+        self.dirty.pop(device.id, None)
+
+    def changed(self, device, attribute, value):
+        self.dirty[device.id] = device
+
+    def save(self, house):
+        '''
+        Appends the attributes changed since the last save to the change
+        log, or writes a new snapshot if the log has grown too big.
+        Returns the number of attributes written to the log (or kept in
+        memory, if readOnly).
+        '''
+        if not self.dirty:
+            return 0
+
+        out = Writer()
+        records = []
+        for id, device in self.dirty.items():
+            address = self.addresses.get(id)
+            dirty = device.attributes.take_dirty()
+            if address is None:
+                continue
+            floor, room, position = address
+            for attribute in dirty:
+                value = device.attributes[attribute]
+                out.pack(CHANGE, *address)
+                out.str(attribute)
+                out.value(value)
+                records.append((floor, (room, position, attribute, value)))
+        self.dirty = {}
+
+        if not self.readOnly:
+            size = os.path.getsize(self.changesPath) if os.path.exists(self.changesPath) else 0
+            if size + len(out.data) > self.compactRatio * os.path.getsize(self.path):
+                self.write_snapshot(house)
+                return 0
+
+            with open(self.changesPath, 'ab') as f:
+                f.write(out.data)
+                f.flush()
+                os.fsync(f.fileno())
+
+        # So floors loaded from now on get them too
+        for floor, change in records:
+            self.changes.setdefault(floor, []).append(change)
+        return len(records)
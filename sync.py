@@ -0,0 +1,759 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+sync.py: Sharing one house between several panels
+
+A hub process owns the House and serves panels over a Unix domain
+socket:
+    python sync.py --socket home-dash.sock
+    HOME_DASH_HUB=home-dash.sock python main.py
+
+Panels send their commands and log entries to the hub. Every tick the
+hub sends every panel one DELTA frame holding the device attributes
+that changed (the last value of each) and the new log entries. Deltas
+are kept in a backlog, so a panel that reconnects gets the ones it
+missed; if they're gone, or the hub restarted, it gets a SNAPSHOT.
+
+Frames are <u32 payload length><u8 kind><payload>, little endian,
+with values and strings packed as in store.py:
+    HELLO     panel -> hub  u64 epoch, u64 last seq, u32 layout, u32 panel, str name
+    WELCOME   hub -> panel  u64 epoch, u64 seq, u8 snapshot follows
+    SNAPSHOT  hub -> panel  body, every attribute of every device
+    DELTA     hub -> panel  body
+    COMMAND   panel -> hub  change
+    LOG       panel -> hub  str description
+    ERROR     hub -> panel  str why, the hub then hangs up
+    body    = u64 seq, u32 changes, change each, u16 entries,
+              per entry: f64 time, u32 panel (0 for the hub), str description
+    change  = u16 floor, u16 room, u32 position, u8 attribute, [str name
+              if attribute is OTHER], value
+Devices are addressed by position, like the store and rules, since
+every panel loads the same house but registry ids differ between them.
+'''
+import argparse
+import asyncio
+import logging
+import os
+import random
+import struct
+import threading
+import zlib
+from collections import deque, OrderedDict
+from time import time, monotonic
+
+import pygame
+
+from rules import RuleEngine, locate
+from scheduler import Scheduler
+from store import Writer, Reader, CHANGE, U8, U16
+
+log = logging.getLogger(__name__)
+
+# Posted on the panel with changes, logs and snapshot fields for
+# HubClient.apply() to run on the UI thread
+HUB_UPDATE = pygame.event.custom_type()
+
+FRAME = struct.Struct('<IB')
+HELLO_HEAD = struct.Struct('<QQII')
+WELCOME_HEAD = struct.Struct('<QQB')
+BODY_HEAD = struct.Struct('<QI')
+ENTRY = struct.Struct('<dI')
+
+HELLO = 1
+WELCOME = 2
+SNAPSHOT = 3
+DELTA = 4
+COMMAND = 5
+LOG = 6
+ERROR = 7
+
+# Attributes sent as a one byte code, anything else by name
+ATTRIBUTES = ('on', 'intensity')
+OTHER = 255
+
+class HubRefused(Exception):
+    '''
+    The hub sent an ERROR, eg because the panel's house is different.
+    '''
+
+def layout_id(house):
+    '''
+    Checksum of the floor names and device counts, so a panel with a
+    different house can't apply changes to the wrong devices. Doesn't
+    load lazy floors.
+    '''
+    registry = house.registry
+    out = Writer()
+    for floor in house.floors:
+        count = getattr(floor, 'deviceCount', None)
+        if count is None:
+            count = len(registry.byFloor.get(floor, ()))
+        out.str(floor.name)
+        out.pack(CHANGE, 0, 0, count)
+    return zlib.crc32(out.data)
+
+def frame(kind, payload=b''):
+    return FRAME.pack(len(payload), kind) + payload
+
+async def read_frame(reader):
+    length, kind = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return kind, await reader.readexactly(length)
+
+def write_change(out, where, attribute, value):
+    out.pack(CHANGE, *where)
+    if attribute in ATTRIBUTES:
+        out.pack(U8, ATTRIBUTES.index(attribute))
+    else:
+        out.pack(U8, OTHER)
+        out.str(attribute)
+    out.value(value)
+
+def read_change(reader):
+    where = reader.unpack(CHANGE)
+    code = reader.one(U8)
+    attribute = reader.str() if code == OTHER else ATTRIBUTES[code]
+    return where, attribute, reader.value()
+
+def write_body(seq, changes, entries):
+    '''
+    changes is [(where, attribute, value)], entries [(time, panel, desc)].
+    '''
+    out = Writer()
+    out.pack(BODY_HEAD, seq, len(changes))
+    for where, attribute, value in changes:
+        write_change(out, where, attribute, value)
+    out.pack(U16, len(entries))
+    for when, panel, desc in entries:
+        out.pack(ENTRY, when, panel)
+        out.str(desc)
+    return bytes(out.data)
+
+def read_body(payload):
+    reader = Reader(payload)
+    seq, count = reader.unpack(BODY_HEAD)
+    changes = [read_change(reader) for i in range(count)]
+    entries = []
+    for i in range(reader.one(U16)):
+        when, panel = reader.unpack(ENTRY)
+        entries.append((when, panel, reader.str()))
+    return seq, changes, entries
+
+class Places(object):
+    '''
+    Registry id -> locate() position, worked out once per device and
+    forgotten when a lazy floor is loaded or unloaded.
+    '''
+    def __init__(self, house):
+        self.house = house
+        self.byId = {}
+        house.floorListeners.append(self.forget)
+        house.loadListeners.append(self.forget)
+
+    def forget(self, floor, rooms=None):
+        self.byId = {}
+
+    def __call__(self, device):
+        where = self.byId.get(device.id)
+        if where is None:
+            where = self.byId[device.id] = locate(self.house, device)
+        return where
+
+    def device(self, where):
+        '''
+        Device at a position on a loaded floor, None if there isn't one.
+        '''
+        f, r, d = where
+        floors = self.house.floors
+        contents = floors[f].contents() if f < len(floors) else None
+        if contents is None:
+            return None
+        rooms = contents[0]
+        if r < len(rooms) and d < len(rooms[r].devices):
+            return rooms[r].devices[d]
+        return None
+
+class Panel(object):
+    '''
+    One connected panel, on the hub.
+    '''
+    def __init__(self, id, name, writer):
+        self.id = id
+        self.name = name
+        self.writer = writer
+        self.sent = 0
+
+class StateHub(object):
+    '''
+    Owns a House and keeps panels in sync with it. Everything runs on
+    one asyncio loop, the house included.
+
+    Changes are collected from the registry as they happen and only the
+    last value per device attribute is kept until the next tick. Each
+    tick's DELTA is encoded once and the same bytes are written to every
+    panel without waiting on any of them, so a tick costs about the same
+    for one panel or fifty. A panel that falls more than maxBuffered
+    bytes behind is disconnected rather than slowing the others down;
+    it catches up from the backlog when it reconnects.
+
+    Automations run here and only here, so a rule fires once however
+    many panels there are. Device results come back to the hub too: the
+    house's backend posts them through device_result(), and a rollback
+    reaches the panels as a change like any other.
+    '''
+    tickInterval = 1 / 30
+
+    # rules.Rule automations, and (hour, minute, scheduler.Action) to run
+    # every day. Panels connected to a hub don't run their own.
+    rules = []
+    schedules = []
+
+    # DELTAs kept for panels that reconnect
+    backlogFrames = 10000
+    backlogBytes = 8 * 1024 * 1024
+
+    # Bytes waiting to go out to one panel before it's dropped
+    maxBuffered = 1024 * 1024
+
+    # Log entries sent with a snapshot
+    snapshotEntries = 20
+
+    # Seconds between saves of the house to its store, if it has one
+    saveInterval = 60.0
+
+    helloTimeout = 5.0
+
+    def __init__(self, house, path, store=None):
+        self.house = house
+        self.path = path
+        self.store = store
+
+        # Tells panels whether their last seq means anything here
+        self.epoch = random.getrandbits(63)
+        self.seq = 0
+        self.layout = layout_id(house)
+        self.places = Places(house)
+
+        # (where, attribute) -> value, and (time, panel, desc), since the
+        # last tick
+        self.changes = OrderedDict()
+        self.entries = []
+        self.origin = 0
+
+        self.backlog = deque()
+        self.backlogSize = 0
+        self.snapshotCache = None
+
+        self.panels = {}
+        # Every open socket's writer -> the task serving it, panels or not
+        self.connections = {}
+        self.server = None
+        self.ticker = None
+        self.loop = None
+        self.ruleEngine = None
+        self.scheduler = None
+        self.due = None
+        self.lastSave = monotonic()
+        self.counts = {'ticks': 0, 'deltas': 0, 'bytes': 0, 'snapshots': 0,
+                       'resumes': 0, 'commands': 0, 'dropped': 0}
+
+        house.registry.watchers.append(self.changed)
+        house.logListeners.append(self.logged)
+
+    async def start(self, tick=True):
+        '''
+        Starts serving. tick=False leaves calling tick() to the caller,
+        eg a benchmark.
+        '''
+        self.loop = asyncio.get_running_loop()
+
+        self.ruleEngine = RuleEngine(self.house)
+        for rule in self.rules:
+            self.ruleEngine.add(rule)
+        self.scheduler = Scheduler(self.house, arm=self.arm)
+        for hour, minute, action in self.schedules:
+            self.scheduler.daily(hour, minute, action)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self.serve, path=self.path)
+        if tick:
+            self.ticker = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        if self.ticker is not None:
+            self.ticker.cancel()
+        if self.scheduler is not None:
+            self.scheduler.close()
+            self.ruleEngine.close()
+        if self.server is not None:
+            self.server.close()
+            for writer in list(self.connections):
+                writer.close()
+            # Each connection's task ends once it sees the socket close
+            await asyncio.gather(*self.connections.values(), return_exceptions=True)
+            await self.server.wait_closed()
+        self.tick()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tickInterval)
+            try:
+                self.tick()
+            except Exception:
+                log.exception('Hub tick failed')
+
+    def arm(self, seconds):
+        '''
+        Scheduler callback, wakes the loop for the next due timer.
+        '''
+        if self.due is not None:
+            self.due.cancel()
+            self.due = None
+        if seconds is not None:
+            self.due = self.loop.call_later(seconds, self.scheduler.run_due)
+
+    def device_result(self, event):
+        '''
+        DeviceBackend post, called on the backend's thread.
+        '''
+        self.loop.call_soon_threadsafe(self.house.device_result, event)
+
+    def changed(self, device, attribute, value, previous=None):
+        '''
+        Registry watcher, called for every attribute change.
+        '''
+        key = (self.places(device), attribute)
+        changes = self.changes
+        if key in changes:
+            del changes[key]
+        changes[key] = value
+
+    def logged(self, desc):
+        self.entries.append((time(), self.origin, desc))
+
+    def tick(self):
+        '''
+        Sends everything that changed since the last tick as one DELTA.
+        '''
+        house = self.house
+        house.pipeline.poll()
+        self.counts['ticks'] += 1
+        if self.store is not None and monotonic() - self.lastSave >= self.saveInterval:
+            self.lastSave = monotonic()
+            self.store.save(house)
+
+        if not self.changes and not self.entries:
+            return
+        self.seq += 1
+        changes = [(where, attribute, value) for (where, attribute), value in self.changes.items()]
+        data = frame(DELTA, write_body(self.seq, changes, self.entries))
+        self.changes = OrderedDict()
+        self.entries = []
+
+        self.backlog.append((self.seq, data))
+        self.backlogSize += len(data)
+        while len(self.backlog) > self.backlogFrames or self.backlogSize > self.backlogBytes:
+            self.backlogSize -= len(self.backlog.popleft()[1])
+
+        for panel in list(self.panels.values()):
+            self.send(panel, data)
+        self.counts['deltas'] += 1
+        self.counts['bytes'] += len(data)
+
+    def send(self, panel, data):
+        writer = panel.writer
+        if writer.is_closing():
+            return
+        writer.write(data)
+        panel.sent += len(data)
+        if writer.transport.get_write_buffer_size() > self.maxBuffered:
+            log.warning('Panel %s is too far behind, disconnecting it', panel.name)
+            self.counts['dropped'] += 1
+            self.panels.pop(panel.id, None)
+            writer.transport.abort()
+
+    def snapshot(self):
+        '''
+        SNAPSHOT frame with every device attribute, loading lazy floors
+        one at a time. Reused until the next DELTA.
+        '''
+        if self.snapshotCache is not None and self.snapshotCache[0] == self.seq:
+            return self.snapshotCache[1]
+        house = self.house
+        changes = []
+        for f, floor in enumerate(house.stream_floors()):
+            for r, room in enumerate(floor.rooms):
+                for d, device in enumerate(room.devices):
+                    attributes = device.attributes
+                    for attribute in attributes:
+                        changes.append(((f, r, d), attribute, attributes[attribute]))
+        entries = [(when.timestamp(), 0, desc)
+                   for when, desc in reversed(house.log.newest(self.snapshotEntries))]
+        data = frame(SNAPSHOT, write_body(self.seq, changes, entries))
+        self.snapshotCache = (self.seq, data)
+        return data
+
+    async def serve(self, reader, writer):
+        panel = None
+        self.connections[writer] = asyncio.current_task()
+        try:
+            kind, payload = await asyncio.wait_for(read_frame(reader), self.helloTimeout)
+            if kind != HELLO:
+                return
+            epoch, last, layout, id = HELLO_HEAD.unpack_from(payload)
+            name = Reader(payload, HELLO_HEAD.size).str()
+            if layout != self.layout:
+                log.warning('Panel %s has a different house, refusing it', name)
+                out = Writer()
+                out.str("Panel's house is not the hub's house")
+                writer.write(frame(ERROR, bytes(out.data)))
+                await writer.drain()
+                return
+
+            # Nothing is awaited from here until the panel is added, so
+            # no tick can come in between catching up and going live
+            backlog = self.backlog
+            resume = epoch == self.epoch and last <= self.seq and (
+                last == self.seq or backlog and backlog[0][0] <= last + 1)
+            writer.write(frame(WELCOME, WELCOME_HEAD.pack(self.epoch, self.seq, not resume)))
+            if resume:
+                for seq, data in backlog:
+                    if seq > last:
+                        writer.write(data)
+                self.counts['resumes'] += 1
+            else:
+                writer.write(self.snapshot())
+                self.counts['snapshots'] += 1
+            panel = self.panels[id] = Panel(id, name, writer)
+            log.info('Panel %s connected, %s', name, 'resumed' if resume else 'sent snapshot')
+
+            while True:
+                kind, payload = await read_frame(reader)
+                if kind == COMMAND:
+                    self.command(*read_change(Reader(payload)))
+                elif kind == LOG:
+                    self.origin = id
+                    try:
+                        self.house.log_event(Reader(payload).str())
+                    finally:
+                        self.origin = 0
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            if panel is not None and self.panels.get(panel.id) is panel:
+                del self.panels[panel.id]
+                log.info('Panel %s disconnected', panel.name)
+            del self.connections[writer]
+            writer.close()
+
+    def command(self, where, attribute, value):
+        '''
+        Runs a panel's command like one from the hub's own UI would be.
+        '''
+        f, r, d = where
+        try:
+            device = self.house.floors[f].rooms[r].devices[d]
+        except IndexError:
+            log.warning('Command for missing device at floor %d room %d #%d', f, r, d)
+            return
+        self.counts['commands'] += 1
+        self.house.command(device, attribute, value)
+
+    def stats(self):
+        stats = dict(self.counts)
+        stats['panels'] = len(self.panels)
+        stats['seq'] = self.seq
+        stats['backlog'] = len(self.backlog)
+        if self.ruleEngine is not None:
+            stats['rules'] = self.ruleEngine.stats()
+            stats['scheduler'] = self.scheduler.stats()
+        return stats
+
+class HubClient(object):
+    '''
+    The panel's end. Stands in for DeviceBackend as the House's backend:
+    submit() shows the new value straight away and sends the command to
+    the hub, whose DELTA then has the value everyone agrees on. The hub
+    owns the real devices, so results are resolved there; a command the
+    device rejected is rolled back on the hub and the rollback comes
+    back in a DELTA.
+
+    Connects from an asyncio loop on its own thread once attach() is
+    called, and keeps reconnecting with backoff. Frames from the hub are
+    decoded there and posted as HUB_UPDATE events; apply() runs them on
+    the UI thread. Commands made while disconnected are kept, the last
+    value per device attribute, and sent on reconnecting.
+
+    Changes for lazy floors that aren't loaded are put in the store's
+    change list, which is applied when the floor is loaded.
+    '''
+    retryMin = 0.2
+    retryMax = 5.0
+
+    def __init__(self, path, name=None, post=None):
+        self.path = path
+        self.name = name if name is not None else f'panel-{os.getpid()}'
+        self.post = post if post is not None else pygame.event.post
+
+        # Marks this panel's log entries, so they aren't logged twice
+        self.panelId = random.getrandbits(31) + 1
+
+        self.house = None
+        self.places = None
+        self.layout = 0
+
+        # Loop thread only
+        self.epoch = 0
+        self.seq = 0
+        self.writer = None
+        self.queue = OrderedDict()
+        self.logQueue = deque(maxlen=100)
+        self.session = None
+
+        # Time of the newest hub log entry shown, so entries sent again
+        # with a snapshot aren't logged twice
+        self.lastEntry = 0.0
+
+        self.counts = {'updates': 0, 'snapshots': 0, 'changes': 0, 'sent': 0, 'connects': 0}
+
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='hub-client', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+
+    def attach(self, house):
+        '''
+        Starts syncing house with the hub.
+        '''
+        self.house = house
+        self.places = Places(house)
+        self.layout = layout_id(house)
+        house.logListeners.append(self.logged)
+        self.session = asyncio.run_coroutine_threadsafe(self.connect(), self.loop)
+
+    # UI thread
+
+    def submit(self, device, attribute, value):
+        current = device.attributes[attribute]
+        if current == value:
+            return None
+        device.attributes[attribute] = value
+        self.loop.call_soon_threadsafe(self.send_command, self.places(device), attribute, value)
+        return None
+
+    def logged(self, desc):
+        self.loop.call_soon_threadsafe(self.send_log, desc)
+
+    def apply(self, event):
+        '''
+        Applies a HUB_UPDATE to the house.
+        '''
+        house = self.house
+        store = house.store
+        changes = event.changes
+        self.counts['updates'] += 1
+        self.counts['changes'] += len(changes)
+
+        if event.snapshot:
+            self.counts['snapshots'] += 1
+            if store is not None:
+                # The snapshot has everything for floors that aren't loaded
+                for f, floor in enumerate(house.floors):
+                    if floor.contents() is None:
+                        store.changes[f] = []
+
+        changed = []
+        for where, attribute, value in changes:
+            device = self.places.device(where)
+            if device is None:
+                f, r, d = where
+                if store is not None and f < len(house.floors):
+                    store.changes.setdefault(f, []).append((r, d, attribute, value))
+                continue
+            attributes = device.attributes
+            if attributes.get(attribute) != value:
+                attributes[attribute] = value
+                changed.append(device)
+        for when, panel, desc in event.entries:
+            if when <= self.lastEntry and event.snapshot:
+                continue
+            self.lastEntry = max(self.lastEntry, when)
+            if panel != self.panelId:
+                house.log.append(desc, when=when)
+
+        if changed or event.entries:
+            for listener in house.listeners:
+                listener(changed)
+
+    def resolve(self, event, device):
+        '''
+        Panels never get DEVICE_RESULTs, see above. Returns False like
+        DeviceBackend.resolve for a command that went through.
+        '''
+        return False
+
+    def pending(self):
+        return 0
+
+    def close(self):
+        future = asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+        try:
+            future.result(2.0)
+        except Exception as e:
+            log.warning('Closing hub connection failed: %s', e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    # Loop thread
+
+    def send_command(self, where, attribute, value):
+        if self.writer is None:
+            key = (where, attribute)
+            if key in self.queue:
+                del self.queue[key]
+            self.queue[key] = value
+            return
+        out = Writer()
+        write_change(out, where, attribute, value)
+        self.writer.write(frame(COMMAND, bytes(out.data)))
+        self.counts['sent'] += 1
+
+    def send_log(self, desc):
+        if self.writer is None:
+            self.logQueue.append(desc)
+            return
+        out = Writer()
+        out.str(desc)
+        self.writer.write(frame(LOG, bytes(out.data)))
+
+    async def connect(self):
+        delay = self.retryMin
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                log.debug('Hub at %s not there: %s', self.path, e)
+                await asyncio.sleep(delay)
+                delay = min(self.retryMax, delay * 2)
+                continue
+            try:
+                await self.listen(reader, writer)
+            except HubRefused as e:
+                log.error('Hub refused this panel: %s', e)
+                return
+            except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+                log.warning('Lost the hub: %s', e or type(e).__name__)
+            finally:
+                self.writer = None
+                writer.close()
+            delay = self.retryMin
+            await asyncio.sleep(delay)
+
+    async def listen(self, reader, writer):
+        out = Writer()
+        out.pack(HELLO_HEAD, self.epoch, self.seq, self.layout, self.panelId)
+        out.str(self.name)
+        writer.write(frame(HELLO, bytes(out.data)))
+
+        kind, payload = await read_frame(reader)
+        if kind == ERROR:
+            raise HubRefused(Reader(payload).str())
+        self.epoch, seq, snapshot = WELCOME_HEAD.unpack(payload)
+        self.counts['connects'] += 1
+        log.info('Connected to hub at %s', self.path)
+
+        self.writer = writer
+        queue, self.queue = self.queue, OrderedDict()
+        for (where, attribute), value in queue.items():
+            self.send_command(where, attribute, value)
+        while self.logQueue:
+            self.send_log(self.logQueue.popleft())
+
+        while True:
+            kind, payload = await read_frame(reader)
+            if kind not in (SNAPSHOT, DELTA):
+                continue
+            seq, changes, entries = read_body(payload)
+            self.seq = seq
+            self.post(pygame.event.Event(HUB_UPDATE, changes=changes, entries=entries,
+                                         snapshot=kind == SNAPSHOT, seq=seq))
+
+    async def shutdown(self):
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self):
+        stats = dict(self.counts)
+        stats['seq'] = self.seq
+        stats['connected'] = self.writer is not None
+        return stats
+
+def main():
+    from backend import DeviceBackend, SimulatedTransport
+    from house import House
+    from journal import Journal
+    from store import HouseStore
+
+    parser = argparse.ArgumentParser(description='Serve one house to several panels')
+    parser.add_argument('--socket', default='home-dash.sock')
+    parser.add_argument('--house', default='house.snap', help='snapshot to load, created if missing')
+    parser.add_argument('--journal', default='journal')
+    parser.add_argument('--tick', type=float, default=StateHub.tickInterval, help='seconds between deltas')
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=os.environ.get('HOME_DASH_LOG', 'INFO').upper(),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+    )
+
+    journal = Journal(args.journal)
+    backend = DeviceBackend(SimulatedTransport())
+    store = HouseStore(args.house)
+    if store.exists():
+        house = store.load_house(lazy=True, journal=journal, backend=backend)
+    else:
+        house = House(journal, backend=backend)
+        store.write_snapshot(house)
+    store.track(house)
+
+    async def serve():
+        hub = StateHub(house, args.socket, store)
+        hub.tickInterval = args.tick
+        backend.post = hub.device_result
+        await hub.start()
+        print(f'Serving {len(house.floors)} floors on {args.socket}')
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await hub.close()
+            log.info('Hub: %s', hub.stats())
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        house.close()
+        store.save(house)
+        store.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,444 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+telemetry.py: History of device attributes for graphs
+
+Every on/intensity change is appended to flat array columns for its
+device. A background thread rolls the raw samples up into minute
+buckets, minutes into hours and hours into days, each bucket holding
+the min, max and time-weighted average of the value plus the value it
+ended on. Values hold until the next change, so the average of 'on'
+over an hour is the share of the hour the device was on.
+
+Only buckets with a change in them are stored. A gap means the value
+stayed at the previous bucket's last value, so a device nobody touches
+costs nothing.
+'''
+import logging
+import math
+import threading
+from array import array
+from bisect import bisect_left
+from time import time, perf_counter
+
+import pygame
+
+from rules import locate
+
+log = logging.getLogger(__name__)
+
+# Posted from the rollup thread after a pass that added buckets
+TELEMETRY_ROLLED = pygame.event.custom_type()
+
+class Buckets(object):
+    '''
+    Columns for one resolution of one series, ordered by start. Raw
+    samples are buckets of width 0 whose min, max, average and last
+    value are all the same array.
+    '''
+    __slots__ = ('width', 'starts', 'mins', 'maxs', 'avgs', 'lasts')
+
+    def __init__(self, width):
+        self.width = width
+        self.starts = array('d')
+        if width:
+            self.mins = array('d')
+            self.maxs = array('d')
+            self.avgs = array('d')
+            self.lasts = array('d')
+        else:
+            self.mins = self.maxs = self.avgs = self.lasts = array('d')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def append(self, start, low, high, average, last):
+        self.starts.append(start)
+        self.mins.append(low)
+        self.maxs.append(high)
+        self.avgs.append(average)
+        self.lasts.append(last)
+
+    def sample(self, when, value):
+        self.starts.append(when)
+        self.lasts.append(value)
+
+    def trim(self, before):
+        '''
+        Drops buckets that start before before.
+        '''
+        n = bisect_left(self.starts, before)
+        if n:
+            del self.starts[:n]
+            if self.width:
+                del self.mins[:n]
+                del self.maxs[:n]
+                del self.avgs[:n]
+            del self.lasts[:n]
+        return n
+
+class Fold(object):
+    '''
+    Combines consecutive buckets, finer ones and raw samples included,
+    into one covering from start. carry is the value at start, None if
+    it isn't known.
+    '''
+    __slots__ = ('pos', 'value', 'integral', 'covered', 'low', 'high')
+
+    def __init__(self, start, carry):
+        self.pos = start
+        self.value = carry
+        self.integral = 0.0
+        self.covered = 0.0
+        self.low = math.inf
+        self.high = -math.inf
+
+    def hold(self, until):
+        value = self.value
+        if value is not None and until > self.pos:
+            self.integral += value * (until - self.pos)
+            self.covered += until - self.pos
+            if value < self.low:
+                self.low = value
+            if value > self.high:
+                self.high = value
+
+    def add(self, buckets, lo, hi):
+        width = buckets.width
+        starts, mins, maxs, avgs, lasts = buckets.starts, buckets.mins, buckets.maxs, buckets.avgs, buckets.lasts
+        for k in range(lo, hi):
+            start = starts[k]
+            self.hold(start)
+            if width:
+                self.integral += avgs[k] * width
+                self.covered += width
+            if mins[k] < self.low:
+                self.low = mins[k]
+            if maxs[k] > self.high:
+                self.high = maxs[k]
+            self.pos = start + width
+            self.value = lasts[k]
+
+    def result(self, end):
+        '''
+        (min, max, average, last) up to end, or None if nothing is known.
+        '''
+        self.hold(end)
+        self.pos = max(self.pos, end)
+        if self.value is None:
+            return None
+        average = self.integral / self.covered if self.covered else self.value
+        return (self.low, self.high, average, self.value)
+
+class Series(object):
+    '''
+    History of one attribute of one device: raw samples not rolled up
+    yet, and Buckets per resolution. rolled[i] is how far resolution i
+    is complete and carry[i] the value there.
+    '''
+    __slots__ = ('raw', 'levels', 'rolled', 'carry')
+
+    def __init__(self, widths, first):
+        self.raw = Buckets(0)
+        self.levels = [Buckets(width) for width in widths]
+        self.rolled = [math.floor(first / width) * width for width in widths]
+        self.carry = [None] * len(widths)
+
+    def segments(self, level):
+        '''
+        [(buckets, from, until)] covering all time, using level up to
+        where it's complete, then each finer resolution, then raw.
+        '''
+        rolled = self.rolled
+        segments = [(self.levels[level], -math.inf, rolled[level])]
+        for i in range(level - 1, -1, -1):
+            segments.append((self.levels[i], rolled[i + 1], rolled[i]))
+        segments.append((self.raw, rolled[0], math.inf))
+        return segments
+
+    def settled(self):
+        '''
+        True once every sample has made it into the coarsest resolution.
+        '''
+        if len(self.raw):
+            return False
+        for buckets, rolled in zip(self.levels, self.rolled[1:]):
+            if len(buckets) and buckets.starts[-1] >= rolled:
+                return False
+        return True
+
+    def value_at(self, segments, when):
+        '''
+        Value held at when, from the last bucket or sample before it.
+        '''
+        value = None
+        for buckets, start, until in segments:
+            if start >= when:
+                break
+            starts = buckets.starts
+            k = bisect_left(starts, min(when, until)) - 1
+            if k >= 0 and starts[k] >= start:
+                value = buckets.lasts[k]
+        return value
+
+class Telemetry(object):
+    '''
+    Records the history of device attributes in a House and answers
+    history() queries from the rollups.
+
+    Watches every change through the house's registry. Series are keyed
+    by rules.locate() position, like rules and scenes, so they carry on
+    when a lazy floor is unloaded and loaded again. start() runs rollups
+    every rollupInterval on a thread, which also enforces retention.
+    '''
+    attributes = ('on', 'intensity')
+
+    # (name, bucket seconds, seconds kept), finest first. Each width
+    # divides the next, so buckets nest.
+    resolutions = (
+        ('minute',  60,         2 * 86400),
+        ('hour',    3600,       90 * 86400),
+        ('day',     86400,      5 * 365 * 86400)
+    )
+
+    # Seconds between rollups
+    rollupInterval = 15.0
+
+    # Seconds between retention sweeps of series that haven't changed
+    sweepInterval = 3600.0
+
+    def __init__(self, house, clock=time, post=None):
+        self.house = house
+        self.clock = clock
+        self.post = post if post is not None else pygame.event.post
+        self.widths = tuple(width for name, width, kept in self.resolutions)
+        self.started = clock()
+
+        # (locate() tuple, attribute) -> Series
+        self.series = {}
+
+        # registry id -> locate() tuple for devices seen so far
+        self.places = {}
+
+        # Keys of series with samples not rolled all the way up yet
+        self.dirty = set()
+        self.swept = self.started
+
+        # Samples come in on the UI thread, rollups run on their own
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.counts = {'samples': 0, 'rollups': 0, 'buckets': 0, 'trimmed': 0, 'rollup_ms': 0.0}
+
+        house.registry.watchers.append(self.changed)
+        house.floorListeners.append(self.floor_changed)
+        house.loadListeners.append(self.floor_changed)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='telemetry', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.house.registry.watchers.remove(self.changed)
+        self.house.floorListeners.remove(self.floor_changed)
+        self.house.loadListeners.remove(self.floor_changed)
+
+    def floor_changed(self, floor, rooms=None):
+        # Ids aren't reused, but a reloaded floor's devices get new ones
+        self.places = {}
+
+    def place(self, device):
+        where = self.places.get(device.id)
+        if where is None:
+            where = self.places[device.id] = locate(self.house, device)
+        return where
+
+    def changed(self, device, attribute, value, previous=None):
+        '''
+        Registry watcher, called for every attribute change. A device's
+        first change also records what it was before, back to when
+        telemetry started, since it can't have changed in between.
+        '''
+        if attribute not in self.attributes:
+            return
+        key = (self.place(device), attribute)
+        now = self.clock()
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = Series(self.widths, self.started)
+                if previous is not None:
+                    series.raw.sample(self.started, float(previous))
+            series.raw.sample(now, float(value))
+            self.dirty.add(key)
+        self.counts['samples'] += 1
+
+    def run(self):
+        while not self.stopping.wait(self.rollupInterval):
+            try:
+                if self.rollup():
+                    self.post(pygame.event.Event(TELEMETRY_ROLLED))
+            except Exception:
+                log.exception('Telemetry rollup failed')
+
+    def rollup(self, now=None):
+        '''
+        Rolls everything complete by now into each resolution and drops
+        what's past retention. Only series that changed are looked at,
+        except for a retention sweep every sweepInterval. Returns how
+        many buckets were added.
+        '''
+        if now is None:
+            now = self.clock()
+        start = perf_counter()
+        added = trimmed = 0
+        with self.lock:
+            if now - self.swept >= self.sweepInterval:
+                self.swept = now
+                keys = list(self.series)
+            else:
+                keys = list(self.dirty)
+        for key in keys:
+            with self.lock:
+                series = self.series[key]
+                source = series.raw
+                cutoff = now
+                for i, width in enumerate(self.widths):
+                    cutoff = math.floor(cutoff / width) * width
+                    added += self.roll(series, i, source, cutoff)
+                    source = series.levels[i]
+                    cutoff = series.rolled[i]
+                trimmed += series.raw.trim(series.rolled[0])
+                for buckets, (name, width, kept) in zip(series.levels, self.resolutions):
+                    trimmed += buckets.trim(now - kept)
+                if series.settled():
+                    self.dirty.discard(key)
+        self.counts['rollups'] += 1
+        self.counts['buckets'] += added
+        self.counts['trimmed'] += trimmed
+        self.counts['rollup_ms'] = (perf_counter() - start) * 1000
+        return added
+
+    def roll(self, series, i, source, cutoff):
+        '''
+        Adds buckets to resolution i from source up to cutoff, one for
+        each bucket width with something in it.
+        '''
+        width = self.widths[i]
+        buckets = series.levels[i]
+        bucket = series.rolled[i]
+        if cutoff <= bucket:
+            return 0
+        starts = source.starts
+        lo = bisect_left(starts, bucket)
+        end = bisect_left(starts, cutoff)
+        carry = series.carry[i]
+        added = 0
+        while lo < end:
+            bucket = math.floor(starts[lo] / width) * width
+            hi = bisect_left(starts, bucket + width, lo, end)
+            fold = Fold(bucket, carry)
+            fold.add(source, lo, hi)
+            low, high, average, carry = fold.result(bucket + width)
+            buckets.append(bucket, low, high, average, carry)
+            added += 1
+            lo = hi
+        series.rolled[i] = cutoff
+        series.carry[i] = carry
+        return added
+
+    def level_for(self, start):
+        '''
+        Finest resolution still kept as far back as start.
+        '''
+        now = self.clock()
+        for i, (name, width, kept) in enumerate(self.resolutions):
+            if now - kept <= start:
+                return i
+        return len(self.resolutions) - 1
+
+    @staticmethod
+    def fold(segments, start, end, carry):
+        fold = Fold(start, carry)
+        for buckets, begin, until in segments:
+            if until <= start or begin >= end:
+                continue
+            starts = buckets.starts
+            lo = bisect_left(starts, max(start, begin))
+            hi = bisect_left(starts, min(end, until), lo)
+            fold.add(buckets, lo, hi)
+        return fold.result(end)
+
+    def history(self, device, attribute, start, end, points):
+        '''
+        The value of attribute on a loaded device from start to end, in
+        about points equal columns: [(column start, (min, max, average,
+        last) or None if unknown)]. Uses the finest resolution still kept
+        for start, with the raw samples only for the part not rolled up
+        yet. A device with no changes recorded has had its current value
+        since telemetry started.
+        '''
+        level = self.level_for(start)
+        width = self.widths[level]
+        step = max(width, math.ceil((end - start) / points / width) * width)
+        origin = math.floor(start / width) * width
+        columns = []
+        where = self.place(device)
+
+        with self.lock:
+            series = self.series.get((where, attribute))
+            if series is None:
+                value = float(device.attributes[attribute])
+                for k in range(math.ceil((end - origin) / step)):
+                    at = origin + k * step
+                    known = at + step > self.started
+                    columns.append((at, (value, value, value, value) if known else None))
+                return columns
+
+            segments = series.segments(level)
+            carry = series.value_at(segments, origin)
+            at = origin
+            while at < end:
+                result = self.fold(segments, at, min(at + step, end), carry)
+                columns.append((at, result))
+                if result is not None:
+                    carry = result[3]
+                at += step
+        return columns
+
+    def summary(self, device, attribute, start, end):
+        '''
+        (min, max, average, last) of attribute over start to end, or None
+        if unknown, eg the average of 'on' is the share of the time the
+        device was on. Accurate to a bucket of the resolution used.
+        '''
+        where = self.place(device)
+        with self.lock:
+            series = self.series.get((where, attribute))
+            if series is None:
+                if end <= self.started:
+                    return None
+                value = float(device.attributes[attribute])
+                return (value, value, value, value)
+            segments = series.segments(self.level_for(start))
+            return self.fold(segments, start, end, series.value_at(segments, start))
+
+    def stats(self):
+        stats = dict(self.counts)
+        with self.lock:
+            stats['series'] = len(self.series)
+            stats['dirty'] = len(self.dirty)
+            stats['raw'] = sum(len(series.raw) for series in self.series.values())
+            for i, (name, width, kept) in enumerate(self.resolutions):
+                stats[name] = sum(len(series.levels[i]) for series in self.series.values())
+        return stats
@@ -0,0 +1,33 @@
+import os
+import sys
+
+# Run headless, and import the app's modules from the repo root
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture
+def lazy_house(tmp_path):
+    '''
+    Makes a house of floors floors, one room and two lights (off) each,
+    saved and loaded back lazily with a budget of one other floor.
+    '''
+    from device import Light
+    from house import House, Floor, Room
+    from store import HouseStore
+
+    def make(floors=3):
+        house = House(floors=[Floor(f'Floor {f}', [Room('Room')], [[0]]) for f in range(floors)])
+        for floor in house.floors:
+            for d in range(2):
+                light = house.add_device(Light(f'{floor.name} light {d}', ''), floor.rooms[0], floor)
+                light.attributes['on'] = False
+        store = HouseStore(str(tmp_path / 'house.snap'))
+        store.write_snapshot(house)
+        lazy = store.load_house(lazy=True)
+        store.track(lazy)
+        lazy.floorBudget = 4
+        return lazy
+    return make
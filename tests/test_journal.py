@@ -0,0 +1,57 @@
+import os
+
+from journal import Journal, INDEX, RECORD
+
+def write(path, texts, indexEvery=4):
+    journal = Journal(path, indexEvery=indexEvery, flushInterval=0)
+    for i, text in enumerate(texts):
+        journal.append(text, when=1000.0 + i)
+    journal.close()
+
+def offset_of(texts, n):
+    return sum(RECORD.size + len(text.encode('utf-8')) for text in texts[:n])
+
+def test_torn_tail_after_index_entry(tmp_path):
+    path = str(tmp_path)
+    texts = [f'event {i}' for i in range(9)]
+    write(path, texts)
+    log = os.path.join(path, 'journal-000000.log')
+    idx = os.path.join(path, 'journal-000000.idx')
+    assert os.path.getsize(idx) == 3 * INDEX.size
+
+    # Record 8 has an index entry but only part of it reached the log
+    with open(log, 'r+b') as f:
+        f.truncate(offset_of(texts, 8) + 3)
+
+    journal = Journal(path, indexEvery=4, flushInterval=0)
+    assert len(journal) == 8
+    assert os.path.getsize(log) == offset_of(texts, 8)
+    assert os.path.getsize(idx) == 2 * INDEX.size
+    journal.append('after crash', when=2000.0)
+    journal.close()
+
+    journal = Journal(path, indexEvery=4, flushInterval=0)
+    assert len(journal) == 9
+    assert [text for when, text in journal.tail(3)] == ['event 6', 'event 7', 'after crash']
+    assert os.path.getsize(idx) == 3 * INDEX.size
+    journal.close()
+
+def test_index_entry_past_end_of_log(tmp_path):
+    path = str(tmp_path)
+    texts = [f'event {i}' for i in range(9)]
+    write(path, texts)
+    log = os.path.join(path, 'journal-000000.log')
+
+    # The log lost records 6 to 8, the index still points at record 8
+    with open(log, 'r+b') as f:
+        f.truncate(offset_of(texts, 6) + 2)
+
+    journal = Journal(path, indexEvery=4, flushInterval=0)
+    assert len(journal) == 6
+    assert os.path.getsize(log) == offset_of(texts, 6)
+    journal.append('after crash', when=2000.0)
+    journal.close()
+
+    journal = Journal(path, indexEvery=4, flushInterval=0)
+    assert [text for when, text in journal.tail(2)] == ['event 5', 'after crash']
+    journal.close()
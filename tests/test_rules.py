@@ -0,0 +1,37 @@
+from device import Light
+from house import House, Floor, Room
+from rules import Rule, RuleEngine, Set, Term
+
+def test_condition_on_unloaded_floor_loads_it_after_the_change(lazy_house):
+    house = lazy_house()
+    house.floors[2].rooms[0].devices[0].attributes['on'] = True
+    engine = RuleEngine(house)
+    rule = engine.add(Rule('Both on', [Term((0, 0, 0), 'on', '==', True), Term((2, 0, 0), 'on', '==', True)],
+                           [Set((0, 0, 1), 'on', True)]))
+
+    # Loading floor 1 pushes floor 2 out
+    house.floors[1].rooms
+    assert house.floors[2].contents() is None
+
+    loads = []
+    house.loadListeners.append(lambda floor: loads.append((floor.name, house.registry.notifying)))
+    house.floors[0].rooms[0].devices[0].attributes['on'] = True
+
+    assert loads == [('Floor 2', 0)]
+    assert rule.fired == 1
+    assert house.floors[0].rooms[0].devices[1].attributes['on'] is True
+
+def test_cascade_runs_after_each_change():
+    house = House(floors=[Floor('Floor', [Room('Room')], [[0]])])
+    floor = house.floors[0]
+    a, b, c = (house.add_device(Light(name, ''), floor.rooms[0], floor) for name in 'abc')
+    for light in (a, b, c):
+        light.attributes['on'] = False
+    engine = RuleEngine(house)
+    first = engine.add(Rule('a turns on b', [Term(a, 'on', '==', True)], [Set(b, 'on', True)]))
+    second = engine.add(Rule('b turns on c', [Term(b, 'on', '==', True)], [Set(c, 'on', True)]))
+
+    a.attributes['on'] = True
+    assert (first.fired, second.fired) == (1, 1)
+    assert c.attributes['on'] is True
+    assert not engine.pending and not engine.queue
@@ -0,0 +1,26 @@
+from datetime import datetime, timedelta
+
+from device import Light
+from house import House, Floor, Room
+from scheduler import Scheduler, Fade
+
+def test_daily_fade_runs_again_the_next_day():
+    house = House(floors=[Floor('Floor', [Room('Room')], [[0]])])
+    floor = house.floors[0]
+    light = house.add_device(Light('Lamp', ''), floor.rooms[0], floor)
+    now = [datetime(2024, 1, 1, 12).timestamp()]
+    scheduler = Scheduler(house, clock=lambda: now[0], arm=lambda seconds: None)
+    scheduler.daily(22, 0, Fade('intensity', 30, 600, steps=5, deviceClass=Light))
+
+    for day in (1, 2):
+        light.attributes['intensity'] = 100
+        now[0] = datetime(2024, 1, day, 22).timestamp()
+        while scheduler.next_deadline() <= now[0] + 600:
+            now[0] = scheduler.next_deadline()
+            scheduler.run_due(now[0])
+            house.pipeline.flush()
+        assert light.attributes['intensity'] == 30
+        assert scheduler.next_deadline() == (datetime(2024, 1, day, 22) + timedelta(days=1)).timestamp()
+
+    assert scheduler.counts['failed'] == 0
+    assert scheduler.counts['fired'] == 10
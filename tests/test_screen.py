@@ -0,0 +1,49 @@
+from screen import ScreenCache
+
+class FakeScreen(object):
+    def __init__(self, manager, common):
+        self.shown = True
+        self.destroyed = False
+
+    def show(self):
+        self.shown = True
+
+    def hide(self):
+        self.shown = False
+
+    def destroy(self):
+        self.destroyed = True
+
+    def element_count(self):
+        return 1
+
+class OtherScreen(FakeScreen):
+    pass
+
+def test_discarding_active_screen_destroys_it_on_navigating_away():
+    cache = ScreenCache(None, None)
+    active, created = cache.show(FakeScreen, 'room')
+    cache.discard(FakeScreen, 'room')
+    assert not active.destroyed
+    assert cache.active is active
+
+    other, created = cache.show(OtherScreen)
+    assert active.destroyed
+    assert not other.destroyed
+    assert cache.active is other
+    assert list(cache.screens.values()) == [other]
+
+def test_discarded_screen_shown_again_is_rebuilt():
+    cache = ScreenCache(None, None)
+    first, created = cache.show(FakeScreen, 'room')
+    cache.discard(FakeScreen, 'room')
+    second, created = cache.show(FakeScreen, 'room')
+    assert created
+    assert first.destroyed and second is not first
+
+def test_clear_destroys_discarded_active_screen():
+    cache = ScreenCache(None, None)
+    active, created = cache.show(FakeScreen, 'room')
+    cache.discard(FakeScreen, 'room')
+    cache.clear()
+    assert active.destroyed
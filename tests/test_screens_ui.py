@@ -0,0 +1,34 @@
+import pygame
+import pygame_gui
+import pytest
+
+from screen import ScreenCache, CommonElements, HomeScreen, AddNewScreen, RoomsScreen
+
+def visible_texts(manager):
+    texts = []
+    def walk(container):
+        for elem in container.elements:
+            if elem.visible and getattr(elem, 'text', None):
+                texts.append(elem.text)
+            if hasattr(elem, 'get_container'):
+                walk(elem.get_container())
+    walk(manager.get_root_container())
+    return texts
+
+@pytest.fixture
+def manager():
+    pygame.init()
+    pygame.display.set_mode((300, 600))
+    # pygame isn't quit afterwards, pygame_gui keeps its fonts between managers
+    return pygame_gui.UIManager((300, 600))
+
+@pytest.mark.parametrize('nextScreen', [HomeScreen, RoomsScreen])
+def test_nothing_from_add_new_stays_visible(manager, nextScreen):
+    cache = ScreenCache(manager, CommonElements(manager))
+    addNew, created = cache.show(AddNewScreen)
+    assert {'New Room', 'New Device'} <= set(visible_texts(manager))
+
+    cache.show(nextScreen)
+    texts = visible_texts(manager)
+    assert 'New Room' not in texts and 'New Device' not in texts
+    assert not any(elem.visible for elem in addNew.elems.values())
@@ -0,0 +1,47 @@
+import statusbar
+from statusbar import StatusBar, StubStatusProvider, default_provider
+
+class FakeLabel(object):
+    def __init__(self, text=''):
+        self.text = text
+
+    def set_text(self, text):
+        self.text = text
+
+class FakeCommon(object):
+    def __init__(self):
+        self.elems = {'clock': FakeLabel(), 'battery': FakeLabel()}
+
+def poll_once(bar):
+    events = []
+    bar.post = events.append
+    bar.stopping.set()
+    bar.poll()
+    for event in events:
+        bar.handle(event)
+
+def test_battery_label_empty_without_battery(tmp_path, monkeypatch):
+    monkeypatch.setattr(statusbar.SysfsStatusProvider, 'root', str(tmp_path))
+    common = FakeCommon()
+    bar = StatusBar(common, default_provider())
+    poll_once(bar)
+    assert bar.status == statusbar.Status(None, False)
+    assert common.elems['battery'].text == ''
+
+def test_battery_label_from_sysfs(tmp_path, monkeypatch):
+    battery = tmp_path / 'BAT0'
+    battery.mkdir()
+    (battery / 'type').write_text('Battery\n')
+    (battery / 'capacity').write_text('57\n')
+    (battery / 'status').write_text('Charging\n')
+    monkeypatch.setattr(statusbar.SysfsStatusProvider, 'root', str(tmp_path))
+    common = FakeCommon()
+    bar = StatusBar(common, default_provider())
+    poll_once(bar)
+    assert common.elems['battery'].text == '57%+'
+
+def test_stub_provider_only_when_given():
+    common = FakeCommon()
+    bar = StatusBar(common, StubStatusProvider(50))
+    poll_once(bar)
+    assert common.elems['battery'].text == '50%'
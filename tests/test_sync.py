@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+
+from rules import Rule, Set, Term
+from store import HouseStore
+from sync import StateHub, HubClient
+
+class Panel(object):
+    def __init__(self, path, snapshot, name):
+        self.events = []
+        self.client = HubClient(path, name, post=self.events.append)
+        store = HouseStore(snapshot)
+        store.readOnly = True
+        self.house = store.load_house(lazy=True, backend=self.client)
+        store.track(self.house)
+        self.client.attach(self.house)
+
+    def apply(self):
+        while self.events:
+            self.client.apply(self.events.pop(0))
+
+    def device(self, where):
+        f, r, d = where
+        return self.house.floors[f].rooms[r].devices[d]
+
+    def rule_entries(self):
+        return [desc for when, desc in self.house.log if desc.startswith('Hall')]
+
+def wait_for(check, panels, timeout=5.0):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        for panel in panels:
+            panel.apply()
+        if check():
+            return True
+        time.sleep(0.01)
+    return False
+
+def test_rule_fires_once_on_the_hub_for_two_panels(lazy_house, tmp_path):
+    house = lazy_house()
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    hub = StateHub(house, str(tmp_path / 'hub.sock'))
+    hub.rules = [Rule('Hall light follows switch', [Term((0, 0, 0), 'on', '==', True)],
+                      [Set((0, 0, 1), 'on', True)])]
+    asyncio.run_coroutine_threadsafe(hub.start(), loop).result()
+    panels = [Panel(hub.path, house.store.path, name) for name in ('a', 'b')]
+    try:
+        assert wait_for(lambda: all(p.client.counts['snapshots'] for p in panels), panels)
+
+        a, b = panels
+        a.house.command(a.device((0, 0, 0)), 'on', True)
+        a.house.pipeline.flush()
+
+        assert wait_for(lambda: all(p.device((0, 0, 1)).attributes['on'] for p in panels), panels)
+        assert b.device((0, 0, 0)).attributes['on'] is True
+        assert hub.ruleEngine.rules[0].fired == 1
+        assert hub.counts['commands'] == 1
+        for panel in panels:
+            assert len(panel.rule_entries()) == 1
+    finally:
+        for panel in panels:
+            panel.client.close()
+        asyncio.run_coroutine_threadsafe(hub.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
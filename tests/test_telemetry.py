@@ -0,0 +1,23 @@
+from telemetry import Telemetry
+
+def test_history_does_not_load_or_touch_floors(lazy_house):
+    house = lazy_house()
+    house.floorBudget = 6
+    now = [1000.0]
+    telemetry = Telemetry(house, clock=lambda: now[0])
+    light = house.floors[1].rooms[0].devices[0]
+    now[0] = 1100.0
+    light.attributes['on'] = True
+
+    # Floor 1 is now the least recently used, after the selected floor
+    house.floors[2].rooms
+    order = list(house.loadedFloors)
+
+    loads = []
+    house.loadListeners.append(loads.append)
+    now[0] = 1200.0
+    columns = telemetry.history(light, 'on', 1000.0, 1200.0, 2)
+    assert telemetry.summary(light, 'on', 1000.0, 1200.0) == (0.0, 1.0, 0.5, 1.0)
+    assert [value[3] for at, value in columns if value is not None][-1] == 1.0
+    assert list(house.loadedFloors) == order
+    assert loads == []
@@ -0,0 +1,24 @@
+from usage import Usage
+
+def test_room_energy_survives_unload_and_reload(lazy_house):
+    house = lazy_house()
+    now = [0.0]
+    usage = Usage(house, clock=lambda: now[0])
+    floor = house.floors[1]
+    light = floor.rooms[0].devices[0]
+    light.attributes['on'] = True
+
+    # One hour loaded, one unloaded, one loaded again
+    now[0] = 3600.0
+    before = floor.rooms[0]
+    house.unload_floor(floor)
+    assert usage.room(before) is None
+    now[0] = 7200.0
+    room = floor.rooms[0]
+    now[0] = 10800.0
+
+    roomTotals = usage.room(room)
+    floorTotals = usage.floor(floor)
+    assert floorTotals.energy_wh(now[0]) == 27.0
+    assert roomTotals.energy_wh(now[0]) == floorTotals.energy_wh(now[0])
+    assert roomTotals.on == 1
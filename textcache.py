@@ -0,0 +1,180 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+textcache.py: Rendered text shared across screens
+
+pygame_gui renders an element's text from scratch whenever it's built
+or its text changes, so the same few strings (navbar labels, "on",
+"off", intensities) get rendered over and over. CachedFont stands in
+for the theme's fonts and keeps what they render in a TextCache.
+'''
+import logging
+from collections import OrderedDict
+
+import pygame
+from pygame_gui.core.gui_font_pygame import GUIFontPygame
+
+log = logging.getLogger(__name__)
+
+# pygame_gui renders text in white and tints it afterwards
+WHITE = pygame.Color('#FFFFFFFF')
+
+class TextCache(object):
+    '''
+    Least recently used text surfaces, up to maxBytes of pixels.
+    Keys are (font id, kind, text, colour).
+    '''
+    # Rough size of an entry that isn't a surface, eg a rect
+    entryBytes = 64
+
+    def __init__(self, maxBytes=4 * 1024 * 1024):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+
+    @staticmethod
+    def size_of(value):
+        if isinstance(value, pygame.Surface):
+            return value.get_width() * value.get_height() * value.get_bytesize()
+        return TextCache.entryBytes
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        size = self.size_of(value)
+        if size > self.maxBytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= self.size_of(old)
+        self.entries[key] = value
+        self.bytes += size
+        while self.bytes > self.maxBytes:
+            _, dropped = self.entries.popitem(last=False)
+            self.bytes -= self.size_of(dropped)
+            self.evicted += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        looked = self.hits + self.misses
+        return {
+            'entries':  len(self.entries),
+            'bytes':    self.bytes,
+            'hits':     self.hits,
+            'misses':   self.misses,
+            'evicted':  self.evicted,
+            'hitRate':  round(self.hits / looked, 3) if looked else 0.0
+        }
+
+class CachedFont(object):
+    '''
+    Wraps a pygame_gui font so rendering the same text in the same
+    colour again comes from cache. Callers tint and draw over what
+    they get back, so they always get their own surface.
+
+    render_premul_to is built from the cached render_premul surface
+    for pygame fonts, the default. Other font types only cache
+    render_premul and get_rect.
+    '''
+    def __init__(self, font, fontId, cache):
+        self.font = font
+        self.fontId = fontId
+        self.cache = cache
+        self.composes = isinstance(font, GUIFontPygame)
+        self.ascent = None
+
+    def __getattr__(self, name):
+        return getattr(self.font, name)
+
+    def premul(self, text, colour):
+        key = (self.fontId, 'premul', text, tuple(colour))
+        surface = self.cache.get(key)
+        if surface is None:
+            surface = self.font.render_premul(text, colour)
+            self.cache.put(key, surface)
+        return surface
+
+    def render_premul(self, text, text_color):
+        return self.premul(text, text_color).copy()
+
+    def render_premul_to(self, text, text_colour, surf_size, surf_position):
+        if not self.composes:
+            return self.font.render_premul_to(text, text_colour, surf_size, surf_position)
+
+        # Same as GUIFontPygame.render_premul_to, from the cached glyphs
+        surface = pygame.Surface(surf_size, depth=32, flags=pygame.SRCALPHA)
+        surface.fill((0, 0, 0, 0))
+        glyphs = self.premul(text, text_colour)
+        if glyphs.get_width() > 0 and glyphs.get_height() > 0:
+            if self.ascent is None:
+                self.ascent = self.font.get_rect(' ').top
+            surface.blit(glyphs, (surf_position[0], surf_position[1] - self.ascent),
+                         special_flags=pygame.BLEND_PREMULTIPLIED)
+        return surface
+
+    def get_rect(self, text):
+        key = (self.fontId, 'rect', text, None)
+        rect = self.cache.get(key)
+        if rect is None:
+            rect = self.font.get_rect(text)
+            self.cache.put(key, rect)
+        return pygame.Rect(rect)
+
+def install(manager, cache):
+    '''
+    Puts a CachedFont in front of every font manager has loaded so far.
+    Safe to call again after more fonts are loaded.
+    '''
+    fonts = manager.get_theme().get_font_dictionary()
+    for fontId, resource in fonts.loaded_fonts.items():
+        font = resource.loaded_font
+        if font is not None and not isinstance(font, CachedFont):
+            resource.loaded_font = CachedFont(font, fontId, cache)
+
+def theme_fonts(manager):
+    '''
+    The distinct fonts the theme gives its elements, leaving out the
+    symbol font pygame_gui only uses for arrows and icons.
+    '''
+    theme = manager.get_theme()
+    symbols = theme.get_font_dictionary().get_default_symbol_font()
+    found = {}
+    for locales in theme.ele_font_res.values():
+        for resource in locales.values():
+            if resource.loaded_font is not symbols:
+                found[resource.font_id] = resource.loaded_font
+    return [font for font in found.values() if isinstance(font, CachedFont)]
+
+def warm_up(manager, strings):
+    '''
+    Renders strings in every theme font so they're cached before the
+    first frame. Returns how many were rendered.
+    '''
+    count = 0
+    for font in theme_fonts(manager):
+        for text in strings:
+            if text:
+                font.get_rect(text)
+                font.premul(text, WHITE)
+                count += 1
+    return count
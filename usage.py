@@ -0,0 +1,229 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+usage.py: Lights on, average intensity and energy use
+
+Totals are kept per room, per floor and for the house, and every
+attribute change moves them by the difference it makes, so reading any
+of them is O(1) however big the house is. Power is kept as an integer
+(watts x intensity percent) so adding and taking away never drifts.
+'''
+from time import time
+
+import pygame
+
+# Fired every Usage.tickInterval so energy figures on screen keep moving
+USAGE_TICK = pygame.event.custom_type()
+
+def contribution(device, on, intensity):
+    '''
+    (on, lit, intensity, load) that device adds to its totals with the
+    given values. lit counts dimmable devices that are on, whose
+    intensity is summed; load is watts x intensity percent.
+    '''
+    if not on:
+        return (0, 0, 0, 0)
+    if intensity is None:
+        return (1, 0, 0, device.watts * 100)
+    return (1, 1, intensity, device.watts * intensity)
+
+class Totals(object):
+    '''
+    Sums over a room, floor or the house. energy is in watt hours up to
+    since; energy_wh() adds on what's been used after that.
+    '''
+    __slots__ = ('devices', 'on', 'lit', 'intensity', 'load', 'energy', 'since')
+
+    def __init__(self, since):
+        self.devices = 0
+        self.on = 0
+        self.lit = 0
+        self.intensity = 0
+        self.load = 0
+        self.energy = 0.0
+        self.since = since
+
+    def advance(self, now):
+        '''
+        Adds the energy used since the last change in load.
+        '''
+        if self.load and now > self.since:
+            self.energy += self.load * (now - self.since) / 360000
+        self.since = now
+
+    def add(self, change, sign=1):
+        on, lit, intensity, load = change
+        self.on += sign * on
+        self.lit += sign * lit
+        self.intensity += sign * intensity
+        self.load += sign * load
+
+    def add_totals(self, other, sign=1):
+        self.devices += sign * other.devices
+        self.add((other.on, other.lit, other.intensity, other.load), sign)
+
+    @property
+    def watts(self):
+        return self.load / 100
+
+    def average_intensity(self):
+        '''
+        Mean intensity of the dimmable devices that are on, 0 if none.
+        '''
+        return self.intensity / self.lit if self.lit else 0.0
+
+    def energy_wh(self, now):
+        return self.energy + self.load * max(0.0, now - self.since) / 360000
+
+class Usage(object):
+    '''
+    Keeps Totals for a House up to date.
+
+    Watches every change through the house's registry. A lazy floor's
+    rooms are counted when it's loaded; its floor and room totals stay
+    when it's unloaded, since nothing on it can change until it's loaded
+    again, and its lights keep using energy meanwhile. Room energy is
+    carried over to the reloaded rooms by position. Floors that haven't
+    been loaded yet aren't counted, see complete().
+
+    Batch operations like House.turn_off_all set attributes device by
+    device, so they go through the same O(1) update per device.
+    '''
+    # Seconds between USAGE_TICKs
+    tickInterval = 10
+
+    def __init__(self, house, clock=time):
+        self.house = house
+        self.clock = clock
+        self.total = Totals(clock())
+        self.floors = {}
+        self.rooms = {}
+
+        # Unloaded floor -> its rooms' Totals in order, None for rooms
+        # that weren't counted
+        self.unloadedRooms = {}
+        self.ticking = False
+        for floor in house.floors:
+            if floor.contents() is not None:
+                self.count_floor(floor)
+
+        house.registry.watchers.append(self.changed)
+        house.loadListeners.append(self.count_floor)
+        house.floorListeners.append(self.floor_unloaded)
+
+    def start(self):
+        pygame.time.set_timer(USAGE_TICK, int(self.tickInterval * 1000))
+        self.ticking = True
+
+    def close(self):
+        if self.ticking:
+            pygame.time.set_timer(USAGE_TICK, 0)
+            self.ticking = False
+        self.house.registry.watchers.remove(self.changed)
+        self.house.loadListeners.remove(self.count_floor)
+        self.house.floorListeners.remove(self.floor_unloaded)
+
+    def count_floor(self, floor):
+        '''
+        Counts a floor's devices from scratch, eg when it's loaded.
+        '''
+        now = self.clock()
+        registry = self.house.registry
+        totals = Totals(now)
+        previous = self.unloadedRooms.pop(floor, ())
+        for r, room in enumerate(floor.contents()[0]):
+            roomTotals = self.rooms[room] = Totals(now)
+            for id in registry.byRoom.get(room, ()):
+                device = registry.devices[id]
+                attributes = device.attributes
+                roomTotals.devices += 1
+                roomTotals.add(contribution(device, attributes.get('on'), attributes.get('intensity')))
+            old = previous[r] if r < len(previous) else None
+            if old is not None:
+                old.advance(now)
+                roomTotals.energy = old.energy
+            totals.add_totals(roomTotals)
+
+        old = self.floors.get(floor)
+        self.total.advance(now)
+        if old is not None:
+            old.advance(now)
+            totals.energy = old.energy
+            self.total.add_totals(old, -1)
+        self.floors[floor] = totals
+        self.total.add_totals(totals)
+
+    def floor_unloaded(self, floor, rooms):
+        self.unloadedRooms[floor] = [self.rooms.pop(room, None) for room in rooms]
+
+    def changed(self, device, attribute, value, previous=None):
+        '''
+        Registry watcher, called for every attribute change.
+        '''
+        if attribute == 'on':
+            intensity = device.attributes.get('intensity')
+            before = contribution(device, previous, intensity)
+            after = contribution(device, value, intensity)
+        elif attribute == 'intensity':
+            on = device.attributes.get('on')
+            before = contribution(device, on, previous)
+            after = contribution(device, on, value)
+        else:
+            return
+        if before == after:
+            return
+        change = tuple(a - b for a, b in zip(after, before))
+
+        registry = self.house.registry
+        now = self.clock()
+        for totals in (self.rooms.get(registry.rooms[device.id]),
+                       self.floors.get(registry.floors[device.id]),
+                       self.total):
+            if totals is not None:
+                totals.advance(now)
+                totals.add(change)
+
+    def tick(self):
+        '''
+        Folds energy used so far into the house and floor totals.
+        '''
+        now = self.clock()
+        self.total.advance(now)
+        for totals in self.floors.values():
+            totals.advance(now)
+
+    def room(self, room):
+        '''
+        Totals for a room on a loaded floor, None if it isn't counted.
+        '''
+        return self.rooms.get(room)
+
+    def floor(self, floor):
+        return self.floors.get(floor)
+
+    def house_totals(self):
+        return self.total
+
+    def complete(self):
+        '''
+        True once every floor has been counted.
+        '''
+        return len(self.floors) == len(self.house.floors)
+
+    def stats(self):
+        now = self.clock()
+        total = self.total
+        return {
+            'floors':       len(self.floors),
+            'rooms':        len(self.rooms),
+            'on':           total.on,
+            'watts':        total.watts,
+            'energy_wh':    round(total.energy_wh(now), 3)
+        }
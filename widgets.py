@@ -0,0 +1,471 @@
+'''
+home-dash
+
+Smart home dashboard interface, high fidelity prototype
+
+by Alex McColm
+for CSCI 310 at VIU
+
+started November 21st, 2024
+
+widgets.py: Custom pygame_gui widgets
+'''
+from bisect import bisect_left, bisect_right
+
+import pygame
+from pygame_gui.core import UIContainer
+from pygame_gui.elements import UIButton, UIImage, UIScrollingContainer
+
+class VirtualList(UIScrollingContainer):
+    '''
+    Scrolling list that only builds enough row buttons to fill the view.
+
+    The scrollable area is sized for every item, but as the user scrolls
+    the same few rows are moved and given the text of whichever items are
+    now in view. Opening and scrolling costs the same for 10 items or
+    100,000.
+
+    Items come from bind(count, getText), where getText(i) returns the
+    text for item i. Nothing is copied out of the source.
+    '''
+    def __init__(self, relative_rect, manager, rowHeight=30, margin=(10, 20)):
+        super().__init__(
+            relative_rect=relative_rect,
+            manager=manager,
+            # Height comes from the item count, not from the pooled rows
+            should_grow_automatically=False,
+            allow_scroll_x=False
+        )
+        self.rowHeight = rowHeight
+        self.margin = margin
+        self.count = 0
+        self.getText = None
+        self.first = None
+        self.used = 0
+
+        # One row more than fits so partially scrolled rows are covered
+        poolSize = relative_rect.height // rowHeight + 2
+        self.rows = []
+        for i in range(poolSize):
+            row = UIButton(
+                relative_rect=pygame.Rect((margin[0], margin[1] + i * rowHeight),
+                                          (relative_rect.width, rowHeight)),
+                text='',
+                manager=manager,
+                container=self
+            )
+            row.hide()
+            self.rows.append(row)
+
+    def bind(self, count, getText):
+        '''
+        Points the list at a new set of items and redraws the visible rows.
+        '''
+        self.count = count
+        self.getText = getText
+        height = self.margin[1] + count * self.rowHeight
+        self.set_scrollable_area_dimensions((self.scrollable_container.relative_rect.width, height))
+        if self.first_visible() >= count:
+            # List shrank past where we were scrolled to, go back to the top
+            self.scrollable_container.set_relative_position((0, 0))
+            if self.vert_scroll_bar is not None:
+                self.vert_scroll_bar.reset_scroll_position()
+        self.first = None
+        self.rebind()
+
+    def first_visible(self):
+        offset = -self.scrollable_container.relative_rect.y - self.margin[1]
+        return max(0, offset // self.rowHeight)
+
+    def rebind(self):
+        '''
+        Moves the pooled rows to the items currently in view.
+        '''
+        first = self.first_visible()
+        if first == self.first:
+            return
+        self.first = first
+
+        self.used = max(0, min(len(self.rows), self.count - first))
+        for i, row in enumerate(self.rows):
+            index = first + i
+            if i >= self.used:
+                row.hide()
+                continue
+
+            row.set_relative_position((self.margin[0], self.margin[1] + index * self.rowHeight))
+            text = self.getText(index)
+            if row.text != text:
+                row.set_text(text)
+            if self.visible and not row.visible:
+                row.show()
+
+    def element_count(self):
+        return len(self.rows) + 1
+
+    def show(self):
+        super().show()
+        # Container show() brings back every row, including unused ones
+        for row in self.rows[self.used:]:
+            row.hide()
+
+    def update(self, time_delta):
+        super().update(time_delta)
+        if self.visible and self.getText is not None:
+            self.rebind()
+
+class DeviceList(UIScrollingContainer):
+    '''
+    Scrolling list of device rows, where each row is the device's
+    DeviceModifier. Rows are only built once they scroll into view.
+
+    Rows that scroll out of view are hidden and put back in a pool by
+    modifier class, and the next device of that class to scroll in
+    reuses them. pygame_gui widgets can't safely move between
+    containers, so the pool belongs to this list.
+
+    onBind(modifier) is called whenever a row is bound to a device.
+    '''
+    def __init__(self, relative_rect, manager, onBind=None):
+        super().__init__(
+            relative_rect=relative_rect,
+            manager=manager,
+            should_grow_automatically=False,
+            allow_scroll_x=False
+        )
+        self.onBind = onBind
+        self.devices = []
+        # Top of each row, plus the bottom of the last one
+        self.tops = [0]
+        self.view = None
+
+        # modifier class -> modifiers not bound to a row
+        self.pool = {}
+        # row index -> modifier, for rows in view
+        self.bound = {}
+        self.byDevice = {}
+
+    def bind(self, devices):
+        '''
+        Shows devices in the list. Row heights come from each device's
+        modifier class, so nothing is built for rows out of view.
+        '''
+        for index in list(self.bound):
+            self.release(index)
+
+        self.devices = devices
+        self.tops = [0]
+        for device in devices:
+            self.tops.append(self.tops[-1] + device.modifierClass.height)
+        self.set_scrollable_area_dimensions(
+            (self.scrollable_container.relative_rect.width, self.tops[-1]))
+        self.view = None
+        self.rebind()
+
+    def visible_rows(self):
+        top = -self.scrollable_container.relative_rect.y
+        bottom = top + self.relative_rect.height
+        first = max(0, bisect_right(self.tops, top) - 1)
+        last = min(len(self.devices), bisect_left(self.tops, bottom))
+        return first, last
+
+    def rebind(self):
+        view = self.visible_rows()
+        if view == self.view:
+            return
+        self.view = view
+        first, last = view
+
+        for index in [i for i in self.bound if not first <= i < last]:
+            self.release(index)
+
+        for index in range(first, last):
+            if index not in self.bound:
+                self.acquire(index)
+
+    def acquire(self, index):
+        device = self.devices[index]
+        free = self.pool.get(device.modifierClass)
+        if free:
+            modifier = free.pop()
+        else:
+            modifier = device.modifierClass()
+            modifier.build(self.ui_manager, self)
+
+        modifier.bind(device, self.tops[index])
+        if not self.visible:
+            modifier.hide()
+        self.bound[index] = modifier
+        self.byDevice[device] = modifier
+        if self.onBind is not None:
+            self.onBind(modifier)
+
+    def release(self, index):
+        modifier = self.bound.pop(index)
+        self.byDevice.pop(modifier.device, None)
+        modifier.hide()
+        self.pool.setdefault(type(modifier), []).append(modifier)
+
+    def modifier_for(self, device):
+        '''
+        The row currently showing device, or None if it's out of view.
+        '''
+        return self.byDevice.get(device)
+
+    def refresh(self):
+        for modifier in self.bound.values():
+            for attribute in modifier.labels:
+                modifier.refresh(attribute)
+
+    def element_count(self):
+        count = 0
+        for modifier in self.bound.values():
+            count += len(modifier.elements())
+        for free in self.pool.values():
+            for modifier in free:
+                count += len(modifier.elements())
+        return count + 1
+
+    def show(self):
+        super().show()
+        # Container show() brings back pooled rows too
+        for free in self.pool.values():
+            for modifier in free:
+                modifier.hide()
+
+    def update(self, time_delta):
+        super().update(time_delta)
+        if self.visible:
+            self.rebind()
+
+class FloorPlanView(UIContainer):
+    '''
+    Pannable, zoomable view of a FloorLayout with a button per room.
+
+    Only rooms inside the view get a button. Buttons for rooms that move
+    out of view go back in a pool and are reused for rooms moving in, so
+    a floor with thousands of rooms costs about what fits on screen.
+
+    Drag the empty space between rooms to pan, and use the mouse wheel
+    or zoom_at() to zoom. onBind(room, button) is called whenever a
+    button is given to a room.
+    '''
+    minZoom = 0.25
+    maxZoom = 2.0
+
+    def __init__(self, relative_rect, manager, onBind=None):
+        super().__init__(relative_rect=relative_rect, manager=manager)
+        self.onBind = onBind
+        self.layout = None
+        self.names = []
+        self.pan = pygame.Vector2(0, 0)
+        self.zoom = 1.0
+        self.dragFrom = None
+
+        self.pool = []
+        # room index -> button, for rooms in view
+        self.bound = {}
+        # what the bound buttons were last placed for
+        self.placed = None
+
+    def bind(self, layout, names):
+        '''
+        Shows layout, with names[i] on room i's button.
+        '''
+        for room in list(self.bound):
+            self.release(room)
+        self.layout = layout
+        self.names = names
+        self.placed = None
+        self.rebind()
+
+    def view(self):
+        '''
+        The part of the plan in view, in plan coordinates.
+        '''
+        size = self.relative_rect.size
+        return pygame.Rect(int(self.pan.x), int(self.pan.y),
+                           int(size[0] / self.zoom) + 1, int(size[1] / self.zoom) + 1)
+
+    def to_plan(self, pos):
+        '''
+        Screen position to plan coordinates.
+        '''
+        return (pygame.Vector2(pos) - pygame.Vector2(self.rect.topleft)) / self.zoom + self.pan
+
+    def room_at(self, pos):
+        '''
+        Room index under a screen position, or None.
+        '''
+        if self.layout is None or not self.rect.collidepoint(pos):
+            return None
+        return self.layout.room_at(self.to_plan(pos))
+
+    def rebind(self):
+        if self.layout is None:
+            return
+        placed = (tuple(self.pan), self.zoom)
+        if placed == self.placed:
+            return
+        resized = self.placed is None or self.placed[1] != self.zoom
+        self.placed = placed
+
+        visible = self.layout.visible(self.view())
+        for room in [room for room in self.bound if room not in visible]:
+            self.release(room)
+
+        for room in visible:
+            button = self.bound.get(room)
+            if button is None:
+                self.acquire(room)
+            else:
+                self.place(room, button, resized)
+
+    def place(self, room, button, resize=True):
+        rect = self.layout.rects[room]
+        if resize:
+            button.set_dimensions((round(rect.width * self.zoom), round(rect.height * self.zoom)))
+        button.set_relative_position(((rect.x - self.pan.x) * self.zoom,
+                                      (rect.y - self.pan.y) * self.zoom))
+
+    def acquire(self, room):
+        if self.pool:
+            button = self.pool.pop()
+        else:
+            button = UIButton(
+                relative_rect=pygame.Rect((0, 0), self.layout.roomSize),
+                text='',
+                manager=self.ui_manager,
+                container=self
+            )
+        self.place(room, button)
+        name = self.names[room]
+        if button.text != name:
+            button.set_text(name)
+        if self.visible and not button.visible:
+            button.show()
+        elif not self.visible:
+            button.hide()
+        self.bound[room] = button
+        if self.onBind is not None:
+            self.onBind(room, button)
+
+    def release(self, room):
+        button = self.bound.pop(room)
+        button.hide()
+        self.pool.append(button)
+
+    def button_for(self, room):
+        return self.bound.get(room)
+
+    def pan_by(self, dx, dy):
+        '''
+        Moves the plan by dx, dy screen pixels, keeping some of it in view.
+        '''
+        self.pan -= pygame.Vector2(dx, dy) / self.zoom
+        self.clamp()
+        self.rebind()
+
+    def zoom_at(self, factor, pos=None):
+        '''
+        Zooms by factor, keeping the plan point under pos (a screen
+        position, the middle of the view by default) where it is.
+        '''
+        if pos is None:
+            pos = self.rect.center
+        anchor = self.to_plan(pos)
+        self.zoom = max(self.minZoom, min(self.maxZoom, self.zoom * factor))
+        self.pan = anchor - (pygame.Vector2(pos) - pygame.Vector2(self.rect.topleft)) / self.zoom
+        self.clamp()
+        self.rebind()
+
+    def clamp(self):
+        if self.layout is None:
+            return
+        bounds = self.layout.bounds
+        view = self.view()
+        # Always leave a quarter of the view over the plan
+        slackX, slackY = view.width * 3 // 4, view.height * 3 // 4
+        self.pan.x = max(bounds.left - slackX, min(self.pan.x, bounds.right - view.width + slackX))
+        self.pan.y = max(bounds.top - slackY, min(self.pan.y, bounds.bottom - view.height + slackY))
+
+    def handle_input(self, event):
+        '''
+        Panning and zooming from raw mouse events. Returns True if the
+        event was used.
+        '''
+        if not self.visible or self.layout is None:
+            return False
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            if self.rect.collidepoint(event.pos) and self.room_at(event.pos) is None:
+                self.dragFrom = event.pos
+                return True
+        elif event.type == pygame.MOUSEMOTION and self.dragFrom is not None:
+            self.pan_by(event.pos[0] - self.dragFrom[0], event.pos[1] - self.dragFrom[1])
+            self.dragFrom = event.pos
+            return True
+        elif event.type == pygame.MOUSEBUTTONUP and self.dragFrom is not None:
+            self.dragFrom = None
+            return True
+        elif event.type == pygame.MOUSEWHEEL:
+            pos = pygame.mouse.get_pos()
+            if self.rect.collidepoint(pos):
+                self.zoom_at(1.25 ** event.y, pos)
+                return True
+        return False
+
+    def element_count(self):
+        return len(self.bound) + len(self.pool) + 1
+
+    def show(self):
+        super().show()
+        # Container show() brings back pooled buttons too
+        for button in self.pool:
+            button.hide()
+
+class Sparkline(UIImage):
+    '''
+    Small graph of a value over time, eg from Telemetry.history().
+    Each column is drawn as a bar from its min to its max with a line
+    through the averages; unknown columns are left blank.
+    '''
+    bandColour = pygame.Color('#D5D8DC')
+    lineColour = pygame.Color('#4A4F56')
+
+    def __init__(self, relative_rect, manager):
+        super().__init__(
+            relative_rect=relative_rect,
+            image_surface=pygame.Surface(relative_rect.size, pygame.SRCALPHA),
+            manager=manager
+        )
+
+    def plot(self, columns, low, high):
+        '''
+        columns: [(start, (min, max, average, last) or None)] as returned
+        by Telemetry.history. low and high are the values at the bottom
+        and top of the graph.
+        '''
+        width, height = self.rect.size
+        surface = pygame.Surface((width, height), pygame.SRCALPHA)
+        span = (high - low) or 1
+        step = width / max(1, len(columns))
+
+        def y(value):
+            return height - 1 - round((min(high, max(low, value)) - low) * (height - 1) / span)
+
+        line = []
+        for i, (start, result) in enumerate(columns):
+            if result is None:
+                if len(line) > 1:
+                    pygame.draw.lines(surface, self.lineColour, False, line, 2)
+                line = []
+                continue
+            minimum, maximum, average, last = result
+            x = round(i * step)
+            band = pygame.Rect(x, y(maximum), max(1, round(step) - 1), 0)
+            band.height = y(minimum) - band.y + 1
+            surface.fill(self.bandColour, band)
+            line.append((x + step / 2, y(average)))
+        if len(line) > 1:
+            pygame.draw.lines(surface, self.lineColour, False, line, 2)
+        self.set_image(surface)